@@ -0,0 +1,961 @@
+import asyncio
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core import signing
+
+from chat.events import CHAT_EVENT_TYPES, DEVICE_EVENT_TYPES, SCAN_EVENT_TYPES
+from chat.services.broadcast import broadcast_group
+from chat.services.consumer_services import ConsumerServices
+from chat.services.rate_limiter import rate_limiter
+from chat.services.route_cache import route_cache
+from src.utils import (
+    BaseAsyncJsonWebsocketConsumer,
+    device_key,
+    is_valid_stream_id,
+    is_valid_uuid,
+    send,
+    send_many,
+)
+from src.wire import Envelope, get_codecs
+
+
+class DeviceConsumer(BaseAsyncJsonWebsocketConsumer):
+    """
+    Device consumer, of the ws/ endpoint. A device holds a single socket, and a
+    single registration in redis, for it's whole session. It will:
+
+    1. Accept connections, checks device if to keep or discard connection.
+    2. Register the device channel, rejoin it's groups & deliver it's inbox. Or
+       resume the session of a device that reconnects with a resume token.
+    3. Dispatch every frame to the handler of it's 'event', i.e device.setup,
+       scan.connect, scan.setup, chat.message, chat.group, chat.ack, chat.inbox
+       and device.disconnect. Chat events need the device setup to be complete.
+    4. Then Disconnect, when explicitly requested.
+
+    The ws/connect/, ws/connect/scan/<uuid>/, ws/disconnect/ and ws/chat/p2p/
+    endpoints are aliases, that only handle some events of the device consumer.
+    """
+
+    rate_limiter = rate_limiter
+
+    connect_event: str = DEVICE_EVENT_TYPES.DEVICE_CONNECT.value
+    """
+    Event of the connect response.
+    """
+
+    setup_required: bool = False
+    """
+    Close the connection if the device setup is not complete.
+    """
+
+    chat_session: bool = True
+    """
+    Rejoin the device groups, opt in to broadcasts & deliver the device inbox on
+    connect, i.e the device can send & receive chats.
+    """
+
+    forget_alias: bool = False
+    """
+    Also forget the device alias when the connection is closed.
+    """
+
+    identity_events = [DEVICE_EVENT_TYPES.DEVICE_SETUP.value, SCAN_EVENT_TYPES.SCAN_SETUP.value]
+    """
+    Events received on the device channel, that carry a new device alias.
+    """
+
+    group_actions = ["join", "leave", "message"]
+    """
+    Actions of chat.group events, sent by the client.
+    """
+
+    frame_handlers = {
+        DEVICE_EVENT_TYPES.DEVICE_SETUP.value: "device_setup",
+        SCAN_EVENT_TYPES.SCAN_CONNECT.value: "scan_connect",
+        SCAN_EVENT_TYPES.SCAN_SETUP.value: "scan_setup",
+        CHAT_EVENT_TYPES.CHAT_MESSAGE.value: "chat_send",
+        CHAT_EVENT_TYPES.CHAT_GROUP.value: "group_chat",
+        CHAT_EVENT_TYPES.CHAT_ACK.value: "chat_ack",
+        CHAT_EVENT_TYPES.CHAT_INBOX.value: "inbox_ack",
+        DEVICE_EVENT_TYPES.DEVICE_DISCONNECT.value: "device_disconnect",
+    }
+    """
+    Events of client frames, and their handlers. Frames of any other event are
+    handled as receive_event frames.
+    """
+
+    frame_keys = {
+        DEVICE_EVENT_TYPES.DEVICE_SETUP.value: ("alias",),
+        SCAN_EVENT_TYPES.SCAN_CONNECT.value: ("did",),
+        SCAN_EVENT_TYPES.SCAN_SETUP.value: ("alias",),
+        CHAT_EVENT_TYPES.CHAT_MESSAGE.value: ("to", "message"),
+        CHAT_EVENT_TYPES.CHAT_INBOX.value: ("cursor",),
+    }
+    """
+    Keys client frames must have, by event. chat.group & chat.ack frames validate
+    their own keys.
+    """
+
+    chat_events = [
+        CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+        CHAT_EVENT_TYPES.CHAT_GROUP.value,
+        CHAT_EVENT_TYPES.CHAT_ACK.value,
+        CHAT_EVENT_TYPES.CHAT_INBOX.value,
+    ]
+    """
+    Events of client frames, that need the device setup to be complete.
+    """
+
+    chat_groups: frozenset[str] = frozenset()
+    """
+    Names of the chat groups the device is a member of.
+    """
+
+    broadcast_group: str | None = None
+    """
+    Broadcast group shard of the device, when it opted in to broadcasts with a
+    'broadcast' entry in subprotocols.
+    """
+
+    subprotocol_options: tuple[str, ...] = ("batch", "broadcast")
+    """
+    Subprotocols that opt in to a feature, instead of requesting a codec at index 1.
+    """
+
+    scanned_device: str | None = None
+    """
+    Device scanned with the last successful scan.connect frame, whose alias is
+    set with scan.setup frames.
+    """
+
+    resume_salt: str = "chat.resume"
+    """
+    Salt of the signed resume tokens of devices.
+    """
+
+    async def connect(self):
+        """
+        Accept all connections at first.
+
+        But only keep connection if the value at index 0 in the request subprotocol
+        is a valid uuid, the codec requested at index 1 is available, and the device
+        setup is complete when setup_required. The accept echoes the requested
+        codec, or the device uuid when no codec was requested.
+        """
+        try:
+            self.did = self.scope["subprotocols"][0]
+            # echo the selected codec, so the client knows how frames are encoded
+            selected: bool = self.codec_subprotocol is not None and not self.codec_refused
+            await self.accept(subprotocol=self.codec_subprotocol if selected else self.did)
+        except IndexError:
+            await self.accept()
+            await self.send_json(
+                {
+                    "event": self.connect_event,
+                    "status": False,
+                    "message": "A valid uuid should be at index 0 in subprotocols",
+                }
+            )
+            await self.close()
+        else:
+            if self.codec_refused:  # close if the requested codec is not available
+                await self.send_json(
+                    {
+                        "event": self.connect_event,
+                        "status": False,
+                        "message": f"Codec at index 1 in subprotocols must be one of "
+                        f"{', '.join(get_codecs())}",
+                    }
+                )
+                await self.close()
+                return
+
+            if is_valid_uuid(self.did):
+                # set instance variables did, device & device_groups values
+                self.device = device_key(self.did)
+                self.device_groups = f"{self.device}:groups"
+
+                if self.chat_session:
+                    # listen for route invalidations, to serve routes from the cache
+                    route_cache.start()
+
+                    # add device channel to it's broadcast group shard, when opted in
+                    if "broadcast" in self.scope["subprotocols"][1:]:
+                        self.broadcast_group = broadcast_group(self.did)
+                        await self.channel_layer.group_add(self.broadcast_group, self.channel_name)
+
+                    # rebind a device that just went offline, skipping the handshake
+                    if await self.resume():
+                        return
+
+                # set and get device data
+                device_data: dict = await ConsumerServices.set_device_data(
+                    device=self.device,
+                    did=self.did,
+                    channel=self.channel_name,
+                )
+
+                # if device setup is not complete & required, notify device and
+                # close connection
+                if "alias" not in device_data and self.setup_required:
+                    await self.send_json(
+                        {
+                            "event": self.connect_event,
+                            "status": False,
+                            "message": "Device setup not complete",
+                        }
+                    )
+                    await self.close(code=1000)
+                    return
+
+                # keep device identity for the lifetime of the connection
+                self.alias = device_data.get("alias")
+
+                # rejoin the channel layer groups of the device chat groups
+                if self.alias and self.chat_session:
+                    self.chat_groups = set(device_data.get("groups") or [])
+
+                    for group in self.chat_groups:
+                        await self.channel_layer.group_add(
+                            self.group_channel(group), self.channel_name
+                        )
+
+                    device_data["resume"] = self.resume_token()
+
+                await self.send_json(
+                    {
+                        "event": self.connect_event,
+                        "status": True,
+                        "message": "Current device data",
+                        "data": device_data,
+                    }
+                )
+
+                # deliver chats stored while the device was offline
+                if self.alias and self.chat_session and device_data.get("inbox"):
+                    await self.drain_inbox()
+
+            else:  # close if uuid is not valid
+                await self.send_json(
+                    {
+                        "event": self.connect_event,
+                        "status": False,
+                        "message": "A valid uuid should be at index 0 in subprotocols",
+                    }
+                )
+                await self.close()
+
+    def resume_token(self) -> str:
+        """
+        Return a signed token, the device reconnects with in a ?resume= query
+        string to resume it's session, see resume().
+        """
+        return signing.dumps({"did": str(self.did)}, salt=self.resume_salt)
+
+    async def resume(self) -> bool:
+        """
+        Resume the session of a device that reconnects with a valid resume token,
+        within settings.CHAT_RESUME["GRACE"] seconds of going offline. It's new
+        channel is bound to it's existing registration with a single redis write,
+        instead of the full handshake. Returns True if the session was resumed.
+        """
+        query: dict = parse_qs(self.scope.get("query_string", b"").decode())
+        token: str | None = (query.get("resume") or [None])[0]
+
+        if token is None:
+            return False
+
+        try:
+            payload: dict = signing.loads(
+                token, salt=self.resume_salt, max_age=settings.CHAT_RESUME["MAX_AGE"]
+            )
+        except signing.BadSignature:
+            return False
+
+        if payload.get("did") != str(self.did):
+            return False
+
+        resumed: dict | None = await ConsumerServices.resume_device(
+            device=self.device, did=self.did, channel=self.channel_name
+        )
+
+        if resumed is None:
+            return False
+
+        self.alias = resumed["alias"]
+        self.chat_groups = set(resumed["groups"])
+
+        await asyncio.gather(
+            *(
+                self.channel_layer.group_add(self.group_channel(group), self.channel_name)
+                for group in self.chat_groups
+            )
+        )
+
+        await self.send_json(
+            {
+                "event": self.connect_event,
+                "status": True,
+                "message": "Resumed",
+                "data": {"alias": self.alias, "resume": self.resume_token()},
+            }
+        )
+
+        # deliver chats stored while the device was offline
+        if resumed["inbox"]:
+            await self.drain_inbox()
+
+        return True
+
+    def frame_event(self, envelope: Envelope) -> str | None:
+        return envelope.event if envelope.event in self.frame_handlers else self.receive_event
+
+    def required_keys_for(self, envelope: Envelope) -> tuple[str, ...]:
+        return self.frame_keys.get(self.frame_event(envelope), ())
+
+    async def receive_envelope(self, envelope: Envelope):
+        """
+        Pass every frame on to the handler of it's event, see frame_handlers.
+        Frames without a handler, and chat frames of a device whose setup is not
+        complete, are answered with an error response.
+        """
+        event: str | None = self.frame_event(envelope)
+        handler: str | None = self.frame_handlers.get(event)
+
+        if handler is None:
+            await self.send_json(
+                {
+                    "event": envelope.event,
+                    "status": False,
+                    "message": f"Unknown event {envelope.event!r}",
+                }
+            )
+            return
+
+        if event in self.chat_events and self.alias is None:
+            await self.send_json(
+                {
+                    "event": event,
+                    "status": False,
+                    "message": "Device setup not complete",
+                }
+            )
+            return
+
+        await getattr(self, handler)(envelope)
+
+    async def device_setup(self, envelope: Envelope) -> bool:
+        """
+        Handle a device.setup frame, i.e {"event": "device.setup", "alias"}, that
+        sets the device alias. Returns True if the alias was set.
+        """
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
+            device=self.device, alias=envelope["alias"]
+        )
+
+        if status:  # SUCCESS: alias claimed, notify client.
+            self.alias = alias
+            device_data: dict = await ConsumerServices.get_device_data(self.device)
+
+            if self.chat_session:
+                device_data["resume"] = self.resume_token()
+
+            await self.send_json(
+                {
+                    "event": DEVICE_EVENT_TYPES.DEVICE_SETUP.value,
+                    "status": status,
+                    "message": message,
+                    "data": device_data,
+                }
+            )
+
+        else:  # FAILURE: notify client
+            await self.send_json(
+                {
+                    "event": DEVICE_EVENT_TYPES.DEVICE_SETUP.value,
+                    "status": status,
+                    "message": message,
+                    "data": {"alias": alias},
+                }
+            )
+
+        return status
+
+    async def scan_connect(self, envelope: Envelope) -> bool:
+        """
+        Handle a scan.connect frame, i.e {"event": "scan.connect", "did"}, of a
+        device that scanned the QR code of another device. The scanned device
+        must be connected, and it's setup not complete. Returns True if it is,
+        and both devices were notified.
+        """
+        did = envelope["did"]
+        route: dict = {"channel": None, "alias": None}
+
+        if is_valid_uuid(did):
+            route = await ConsumerServices.get_device_route(device=device_key(did))
+
+        if not route["channel"] or route["alias"] is not None:
+            # device with channel already has an alias or channel not present
+            await self.send_json(
+                {
+                    "event": SCAN_EVENT_TYPES.SCAN_CONNECT.value,
+                    "status": False,
+                    "message": "Invalid channel or device already setup",
+                }
+            )
+            return False
+
+        self.scanned_device = device_key(did)
+
+        # SUCCESS: notify the client of the scanned device details
+        await self.send_json(
+            {
+                "event": SCAN_EVENT_TYPES.SCAN_CONNECT.value,
+                "status": True,
+                "message": "Scanned succeccfully",
+                "data": await ConsumerServices.get_device_data(device=self.scanned_device),
+            }
+        )
+
+        # SUCCESS: notify the scanned device.
+        await send(
+            self.channel_layer,
+            route["channel"],
+            {
+                "type": "chat.message",
+                "data": {
+                    "event": SCAN_EVENT_TYPES.SCAN_CONNECT.value,
+                    "status": True,
+                    "message": "Scanned successfully",
+                },
+            },
+        )
+
+        return True
+
+    async def scan_setup(self, envelope: Envelope) -> bool:
+        """
+        Handle a scan.setup frame, i.e {"event": "scan.setup", "alias"}, that sets
+        the alias of the scanned device, see scan_connect(). Returns True if the
+        alias was set.
+        """
+        if self.scanned_device is None:
+            await self.send_json(
+                {
+                    "event": SCAN_EVENT_TYPES.SCAN_SETUP.value,
+                    "status": False,
+                    "message": "No scanned device, send a scan.connect frame first",
+                }
+            )
+            return False
+
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
+            device=self.scanned_device, alias=envelope["alias"]
+        )
+
+        if status:  # SUCCESS: alias claimed, notify the scanned device.
+            route: dict = await ConsumerServices.get_device_route(device=self.scanned_device)
+
+            await send(
+                self.channel_layer,
+                route["channel"],
+                {
+                    "type": "chat.message",
+                    "data": {
+                        "event": SCAN_EVENT_TYPES.SCAN_SETUP.value,
+                        "status": status,
+                        "message": message,
+                        "data": await ConsumerServices.get_device_data(device=self.scanned_device),
+                    },
+                },
+            )
+
+        # SUCCESS | FAILURE: notify scanning device
+        await self.send_json(
+            {
+                "event": SCAN_EVENT_TYPES.SCAN_SETUP.value,
+                "status": status,
+                "message": message,
+                "data": {"alias": alias},
+            }
+        )
+
+        return status
+
+    async def device_disconnect(self, envelope: Envelope) -> None:
+        """
+        Handle a device.disconnect frame, that ends the device session. The
+        connection is closed, and the device data & alias are deleted.
+        """
+        self.forget_alias = True
+
+        await self.send_json(
+            {
+                "event": DEVICE_EVENT_TYPES.DEVICE_DISCONNECT.value,
+                "status": True,
+                "message": "Disconnected",
+            }
+        )
+        await self.close(code=1000)
+
+    async def chat_send(self, envelope: Envelope):
+        """
+        Receive chat messages and send to reciepient. 'to' is either a single
+        recipient alias, or a list of aliases for a multicast message.
+        """
+        to_alias: str | list = envelope["to"]
+        message: str = envelope["message"]
+
+        if isinstance(to_alias, list):
+            await self.multicast(to_aliases=to_alias, message=message)
+            return
+
+        if not isinstance(to_alias, str):
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                    "status": False,
+                    "message": "Key 'to' must be an alias or a non empty list of aliases",
+                }
+            )
+            return
+
+        route: dict = await ConsumerServices.get_chat_route(alias=to_alias)
+
+        # an offline recipient is still known by it's offline alias
+        device: str | None = route["device"] or await ConsumerServices.get_offline_device(
+            alias=to_alias
+        )
+
+        if device is None:
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                    "status": False,
+                    "message": f"{to_alias} is offline or not available",
+                }
+            )
+            return
+
+        [sequence] = await ConsumerServices.next_sequences(sender=self.did, devices=[device])
+
+        if route["channel"] is None:
+            # store chat for an offline recipient, delivered once it connects.
+            # Unless the alias no longer belongs to the device, e.g it was forgotten
+            stored: str | None = await ConsumerServices.store_message(
+                alias=to_alias,
+                data=self.received_event(message, sequence)["data"],
+                device=device,
+            )
+
+            if stored is None:
+                await self.send_json(
+                    {
+                        "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                        "status": False,
+                        "message": f"{to_alias} is offline or not available",
+                    }
+                )
+                return
+
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                    "status": True,
+                    "message": "queued",
+                    "data": {"alias": to_alias, "message": message, "seq": sequence},
+                }
+            )
+
+        else:
+            # send chat to receipient
+            await send(self.channel_layer, route["channel"], self.received_event(message, sequence))
+
+            # send chat to sender
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                    "status": True,
+                    "message": "send",
+                    "data": {
+                        "alias": to_alias,
+                        "did": route["did"],
+                        "message": message,
+                        "seq": sequence,
+                    },
+                }
+            )
+
+    async def multicast(self, to_aliases: list, message: str) -> None:
+        """
+        Send a chat message to many recipients. Their routes are resolved in a
+        single round trip, and the message is sent to all of them with a single
+        batched channel layer operation. Then the sender gets one delivery report,
+        listing the aliases that were offline or not available.
+        """
+        if not to_aliases or not all(isinstance(alias, str) for alias in to_aliases):
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                    "status": False,
+                    "message": "Key 'to' must be an alias or a non empty list of aliases",
+                }
+            )
+            return
+
+        # drop duplicate aliases, keeping their order
+        to_aliases = list(dict.fromkeys(to_aliases))
+
+        if len(to_aliases) > settings.CHAT_MAX_RECIPIENTS:
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                    "status": False,
+                    "message": f"Message(s) can't have more than {settings.CHAT_MAX_RECIPIENTS} "
+                    "recipients",
+                }
+            )
+            return
+
+        routes: dict[str, dict] = await ConsumerServices.get_chat_routes(aliases=to_aliases)
+
+        # an offline recipient is still known by it's offline alias
+        unknown: list[str] = [alias for alias, route in routes.items() if not route["device"]]
+        offline_devices: list[str | None] = await asyncio.gather(
+            *(ConsumerServices.get_offline_device(alias=alias) for alias in unknown)
+        )
+        devices: dict[str, str] = {
+            alias: route["device"] for alias, route in routes.items() if route["device"]
+        }
+        devices.update({alias: device for alias, device in zip(unknown, offline_devices) if device})
+
+        sequences: dict[str, int] = dict(
+            zip(
+                devices,
+                await ConsumerServices.next_sequences(
+                    sender=self.did, devices=list(devices.values())
+                ),
+            )
+        )
+        online: list[dict] = [routes[alias] for alias in devices if routes[alias]["channel"]]
+        offline: list[str] = [alias for alias in devices if not routes[alias]["channel"]]
+
+        # send chat to every online receipient
+        await send_many(
+            self.channel_layer,
+            [
+                (route["channel"], self.received_event(message, sequences[route["alias"]]))
+                for route in online
+            ],
+        )
+
+        # store chat for every offline recipient, delivered once it connects.
+        # Unless the alias no longer belongs to the device, e.g it was forgotten
+        stored: list[str | None] = await asyncio.gather(
+            *(
+                ConsumerServices.store_message(
+                    alias=alias,
+                    data=self.received_event(message, sequences[alias])["data"],
+                    device=devices[alias],
+                )
+                for alias in offline
+            )
+        )
+        queued: list[str] = [alias for alias, entry in zip(offline, stored) if entry]
+        delivered: set[str] = {route["alias"] for route in online}.union(queued)
+
+        # send delivery report to sender
+        await self.send_json(
+            {
+                "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                "status": bool(delivered),
+                "message": "send" if delivered else "Recipient(s) offline or not available",
+                "data": {
+                    "to": [
+                        {
+                            "alias": route["alias"],
+                            "did": route["did"],
+                            "seq": sequences[route["alias"]],
+                        }
+                        for route in online
+                    ],
+                    "queued": [{"alias": alias, "seq": sequences[alias]} for alias in queued],
+                    "offline": [alias for alias in to_aliases if alias not in delivered],
+                    "message": message,
+                },
+            }
+        )
+
+    async def chat_ack(self, envelope: Envelope) -> None:
+        """
+        Handle a cumulative acknowledgement, i.e {"event": "chat.ack", "did", "seq"}.
+        It acknowledges every chat up to & including seq, received from the device
+        with the given did. So a client only needs to ack once in a while, e.g every
+        few messages or when idle, instead of once per message.
+
+        The highest acknowledged seq is kept in redis, and forwarded to the sender
+        when it moves forward & the sender is online.
+        """
+        sender_did, sequence = envelope.get("did"), envelope.get("seq")
+
+        if (
+            not is_valid_uuid(sender_did)
+            or not isinstance(sequence, int)
+            or isinstance(sequence, bool)
+        ):
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_ACK.value,
+                    "status": False,
+                    "message": "Keys 'did' & 'seq' must be a valid uuid & a positive integer",
+                }
+            )
+            return
+
+        acked, moved = await ConsumerServices.ack_sequence(
+            device=self.device, sender=sender_did, sequence=sequence
+        )
+
+        # chats held back for the acknowledged ones can be sent
+        self.acknowledge(sender_did, acked)
+
+        if not moved:
+            return
+
+        route: dict = await ConsumerServices.get_device_route(device=device_key(sender_did))
+
+        if route["channel"]:
+            await send(
+                self.channel_layer,
+                route["channel"],
+                {
+                    "type": "chat.message",
+                    "data": {
+                        "event": CHAT_EVENT_TYPES.CHAT_ACK.value,
+                        "status": True,
+                        "message": "acknowledged",
+                        "data": {"alias": self.alias, "did": self.did, "seq": acked},
+                    },
+                },
+            )
+
+    async def drain_inbox(self) -> None:
+        """
+        Deliver the chats stored while the device was offline, oldest first, in
+        frames of at most settings.CHAT_INBOX["BATCH_SIZE"] messages.
+
+        Each frame carries a cursor, the id of it's last message. Messages are only
+        removed from the inbox once the client acknowledges a cursor, with a
+        chat.inbox frame, see inbox_ack(), or by reconnecting with a ?inbox= cursor
+        in the query string. So a connection dropped mid-drain gets every message
+        it did not acknowledge again on reconnect.
+        """
+        batch_size: int = settings.CHAT_INBOX["BATCH_SIZE"]
+
+        # messages up to the cursor the device reconnects with were already received
+        query: dict = parse_qs(self.scope.get("query_string", b"").decode())
+        cursor: str | None = (query.get("inbox") or [None])[0]
+
+        if is_valid_stream_id(cursor):
+            await ConsumerServices.ack_inbox(device=self.device, cursor=cursor)
+
+        cursor = None
+
+        while True:
+            entries = await ConsumerServices.read_inbox(
+                device=self.device, count=batch_size, after=cursor
+            )
+
+            if not entries:
+                break
+
+            cursor = entries[-1][0]
+
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_INBOX.value,
+                    "status": True,
+                    "message": "Undelivered messages",
+                    "data": {
+                        "messages": [{"id": entry_id, **data} for entry_id, data in entries],
+                        "cursor": cursor,
+                    },
+                }
+            )
+
+            if len(entries) < batch_size:
+                break
+
+    async def inbox_ack(self, envelope: Envelope) -> None:
+        """
+        Handle an inbox acknowledgement, i.e {"event": "chat.inbox", "cursor"}. It
+        removes every stored message up to & including the cursor of a chat.inbox
+        frame the client received, see drain_inbox().
+        """
+        cursor = envelope["cursor"]
+
+        if not is_valid_stream_id(cursor):
+            await self.send_json(
+                {
+                    "event": CHAT_EVENT_TYPES.CHAT_INBOX.value,
+                    "status": False,
+                    "message": "Key 'cursor' must be the cursor of a chat.inbox frame",
+                }
+            )
+            return
+
+        await ConsumerServices.ack_inbox(device=self.device, cursor=cursor)
+
+    async def group_chat(self, envelope: Envelope) -> None:
+        """
+        Handle a chat.group frame, i.e {"event": "chat.group", "action", "group"}.
+
+        join: add the device to the group, unless the group is full.
+        leave: remove the device from the group.
+        message: send envelope["message"] to every member of the group, with a
+            single channel layer group_send.
+        """
+        action: str | None = envelope.get("action")
+
+        if action not in self.group_actions:
+            return await self.send_group_response(
+                False, f"Key 'action' must be one of {', '.join(self.group_actions)}"
+            )
+
+        if "group" not in envelope:
+            return await self.send_group_response(False, "Missing key 'group'")
+
+        message, group, status = ConsumerServices.format_and_validate_group(envelope["group"])
+
+        if not status:
+            return await self.send_group_response(False, message, group)
+
+        if action == "join":
+            joined: int = await ConsumerServices.join_group(
+                device=self.device, device_groups=self.device_groups, group=group
+            )
+
+            if joined == -1:
+                return await self.send_group_response(False, f"{group} is full", group)
+
+            self.chat_groups = {*self.chat_groups, group}
+            await self.channel_layer.group_add(self.group_channel(group), self.channel_name)
+
+            await self.send_group_response(True, f"Joined {group}", group)
+
+        elif action == "leave":
+            await ConsumerServices.leave_group(
+                device=self.device, device_groups=self.device_groups, group=group
+            )
+
+            self.chat_groups = self.chat_groups - {group}
+            await self.channel_layer.group_discard(self.group_channel(group), self.channel_name)
+
+            await self.send_group_response(True, f"Left {group}", group)
+
+        elif group not in self.chat_groups:
+            await self.send_group_response(False, f"You are not a member of {group}", group)
+
+        elif "message" not in envelope:
+            await self.send_group_response(False, "Missing key 'message'", group)
+
+        else:
+            # send chat to every member of the group, except the sender
+            await self.channel_layer.group_send(
+                self.group_channel(group),
+                {
+                    "type": "chat.message",
+                    "sender": self.channel_name,
+                    "data": {
+                        "event": CHAT_EVENT_TYPES.CHAT_GROUP.value,
+                        "status": True,
+                        "message": "received",
+                        "data": {
+                            "group": group,
+                            "alias": self.alias,
+                            "did": self.did,
+                            "message": envelope["message"],
+                        },
+                    },
+                },
+            )
+
+            await self.send_group_response(
+                True, "send", group, {"group": group, "message": envelope["message"]}
+            )
+
+    async def send_group_response(
+        self, status: bool, message: str, group: str | None = None, data: dict | None = None
+    ) -> None:
+        """Send the response of a chat.group action to the device."""
+        await self.send_json(
+            {
+                "event": CHAT_EVENT_TYPES.CHAT_GROUP.value,
+                "status": status,
+                "message": message,
+                "data": data or {"group": group},
+            }
+        )
+
+    @staticmethod
+    def group_channel(group: str) -> str:
+        """Name of the channel layer group of a chat group."""
+        return f"chat_group.{group}"
+
+    def received_event(self, message: str, sequence: int) -> dict:
+        """
+        Channel layer event, that delivers a chat message to it's recipient. seq
+        is the position of the message in the conversation from this device.
+        """
+        return {
+            "type": "chat.message",
+            "data": {
+                "event": CHAT_EVENT_TYPES.CHAT_MESSAGE.value,
+                "status": True,
+                "message": "received",
+                "data": {
+                    "alias": self.alias,
+                    "did": self.did,
+                    "message": message,
+                    "seq": sequence,
+                },
+            },
+        }
+
+    def awaited_ack(self, content: dict) -> tuple[str, int] | None:
+        """Chats received from a device, are acknowledged with chat.ack frames."""
+        if (
+            content.get("event") == CHAT_EVENT_TYPES.CHAT_MESSAGE.value
+            and content.get("message") == "received"
+        ):
+            return f"{content['data']['did']}", content["data"]["seq"]
+
+        return None
+
+    async def chat_message(self, event):
+        # group messages are not echoed back to their sender
+        if event.get("sender") == self.channel_name:
+            return
+
+        # refresh device identity, when the device alias was set or changed
+        if event["data"]["event"] in self.identity_events and event["data"]["status"]:
+            self.alias = event["data"]["data"]["alias"]
+
+        await self.send_event(event["data"])
+
+    async def disconnect(self, code):
+        """
+        Discard device channel from broadcast & chat groups. And delete/reset
+        device data in redis store.
+        """
+        if self.broadcast_group:
+            await self.channel_layer.group_discard(self.broadcast_group, self.channel_name)
+
+        for group in self.chat_groups:
+            await self.channel_layer.group_discard(self.group_channel(group), self.channel_name)
+
+        if self.device:
+            await ConsumerServices.disconnect_device(
+                device=self.device, channel=self.channel_name, forget_alias=self.forget_alias
+            )
@@ -5,6 +5,7 @@ class DEVICE_EVENT_TYPES(Enum):
     DEVICE_CONNECT = "device.connect"
     DEVICE_NOTIFY = "device.notify"
     DEVICE_SETUP = "device.setup"
+    DEVICE_DISCONNECT = "device.disconnect"
 
 
 class SCAN_EVENT_TYPES(Enum):
@@ -17,3 +18,7 @@ class CHAT_EVENT_TYPES(Enum):
     CHAT_SETUP = "chat.setup"
     CHAT_MESSAGE = "chat.message"
     CHAT_CONNECT = "chat.connect"
+    CHAT_GROUP = "chat.group"
+    CHAT_INBOX = "chat.inbox"
+    CHAT_ACK = "chat.ack"
+    CHAT_BROADCAST = "chat.broadcast"
@@ -1,12 +1,154 @@
 """
 Lua scripts used for redis programmability
 """
-from src.utils import redis_client
+import asyncio
+import contextlib
+import hashlib
+import logging
+import math
+import time
+from collections.abc import Callable, Iterator
+
+from django.conf import settings
+from redis import exceptions as redis_exceptions
+
+from src.utils import (
+    alias_key,
+    async_redis_client,
+    convert_array_to_dict,
+    offline_alias_key,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ScriptRegistry:
+    """
+    Registry of every lua script source, versioned by it's SHA1 digest.
+
+    Scripts are loaded with SCRIPT LOAD once at startup, see load(), and then
+    only ever called with EVALSHA. A script missing from redis (e.g after a
+    failover or a SCRIPT FLUSH) is run with EVAL once, while every script is
+    reloaded in the background.
+
+    Since scripts are called by SHA, workers running different versions of a
+    script can share the same redis store.
+
+    Tests can replace a script by name with a stand-in coroutine, see stand_in().
+    """
+
+    def __init__(self):
+        self.scripts: dict[str, str] = {}
+        self.stand_ins: dict[str, Callable] = {}
+
+        self.loaded: bool = False
+        self.reloads: int = 0
+
+        self._loader: asyncio.Task | None = None
+
+    def register(self, source: str) -> str:
+        """Register a script source and return it's SHA1 digest."""
+        sha: str = hashlib.sha1(source.encode()).hexdigest()
+        self.scripts[sha] = source
+
+        return sha
+
+    async def load(self, client=None) -> int:
+        """
+        SCRIPT LOAD every registered script. In cluster mode the client sends
+        SCRIPT LOAD to every primary node. Returns the number of scripts loaded.
+        """
+        client = client or async_redis_client
+
+        for source in self.scripts.values():
+            await client.script_load(source)
+
+        self.loaded = True
+        logger.info(f"Loaded {len(self.scripts)} lua scripts")
+
+        return len(self.scripts)
+
+    def start(self) -> None:
+        """
+        Load every script in the background, in the running event loop, if not
+        already loaded or loading.
+        """
+        if not self.loaded and (self._loader is None or self._loader.done()):
+            self._loader = asyncio.get_running_loop().create_task(self._load_in_background())
+
+    def reload(self) -> None:
+        """Reload every script in the background, e.g after a NOSCRIPT error."""
+        self.loaded = False
+        self.reloads += 1
+        self.start()
+
+    async def evalsha(self, sha: str, keys: list, args: list, client=None):
+        """
+        Call a script by SHA, falling back to EVAL with the script source when
+        it is missing from redis.
+        """
+        client = client or async_redis_client
+
+        try:
+            return await client.evalsha(sha, len(keys), *keys, *args)
+        except redis_exceptions.NoScriptError:
+            logger.warning("Lua script missing from redis, reloading every script")
+            self.reload()
+
+            return await client.eval(self.scripts[sha], len(keys), *keys, *args)
+
+    @contextlib.contextmanager
+    def stand_in(self, name: str, script: Callable) -> Iterator[None]:
+        """
+        Replace the script called name in every layout, with a stand-in
+        coroutine taking the same keys, args & client arguments.
+        """
+        self.stand_ins[name] = script
+
+        try:
+            yield
+        finally:
+            self.stand_ins.pop(name, None)
+
+    async def _load_in_background(self) -> None:
+        try:
+            await self.load()
+        except redis_exceptions.RedisError:
+            logger.exception("Unable to load lua scripts, they will be loaded on first use")
+
+
+scripts = ScriptRegistry()
+
+
+class LuaScript:
+    """
+    Awaitable lua script, registered in the script registry and called by SHA.
+
+    Called like a redis-py script i.e script(keys=[...], args=[...], client=...),
+    unless a stand-in was set for it's name in the registry.
+    """
+
+    def __init__(self, source: str):
+        self.source: str = source
+        self.sha: str = scripts.register(source)
+        self.name: str | None = None
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    async def __call__(self, keys: list | None = None, args: list | None = None, client=None):
+        stand_in: Callable | None = scripts.stand_ins.get(self.name)
+
+        if stand_in is not None:
+            return await stand_in(keys=keys or [], args=args or [], client=client)
+
+        return await scripts.evalsha(self.sha, keys or [], args or [], client)
 
 
 class LuaScripts:
     """
-    Lua scripts
+    Lua scripts, for the default layout where device aliases are stored in the
+    global device:alias & alias:device hashes.
     """
 
     _get_device_data = """
@@ -30,28 +172,1283 @@ class LuaScripts:
     return device_data
     """
 
-    _set_alias_device = """
+    _reserve_alias = """
+    local device = KEYS[1]
+    local alias = ARGV[1]
+    local current_alias = redis.call('HGET', 'device:alias', device)
+
+    -- alias is already the device alias
+    if current_alias == alias then
+        return 0
+    end
+
+    -- alias already belongs to another device
+    local owner = redis.call('HGET', 'alias:device', alias)
+
+    if owner and owner ~= device then
+        return -1
+    end
+
+    -- or to an offline device, until it's device hash expires
+    local offline_owner = redis.call('GET', 'alias:' .. alias .. ':offline')
+
+    if offline_owner and offline_owner ~= device
+        and redis.call('EXISTS', offline_owner) == 1
+        and redis.call('HGET', 'device:alias', offline_owner) == alias then
+        return -1
+    end
+
+    -- claim alias for device and release its previous alias
+    redis.call('HSET', 'alias:device', alias, device)
+    redis.call('HSET', 'device:alias', device, alias)
+    redis.call('DEL', 'alias:' .. alias .. ':offline')
+
+    -- extend the device expiry to the given ttl
+    redis.call('HSET', device, 'ttl', ARGV[2])
+    redis.call('EXPIREAT', device, ARGV[3])
+
+    if current_alias then
+        if redis.call('HGET', 'alias:device', current_alias) == device then
+            redis.call('HDEL', 'alias:device', current_alias)
+        end
+
+        if redis.call('GET', 'alias:' .. current_alias .. ':offline') == device then
+            redis.call('DEL', 'alias:' .. current_alias .. ':offline')
+        end
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return 1
+    """
+
+    _connect_device = """
     redis.setresp(3)
 
     local device = KEYS[1]
+
+    -- upsert device hash and expire it at the given ttl
+    redis.call('HSET', device, 'did', ARGV[1], 'channel', ARGV[2], 'ttl', ARGV[3])
+    redis.call('HDEL', device, 'offline')
+    redis.call('EXPIREAT', device, ARGV[4])
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    -- repair alias:device hash, unless the alias was claimed by another
+    -- device while this device was offline
     local device_alias = redis.call('HGET', 'device:alias', device)
 
-    -- add alias:device to alias_device hash
     if device_alias then
-        redis.call('HSET', 'alias:device', device_alias, device)
+        local owner = redis.call('HGET', 'alias:device', device_alias)
+
+        if owner and owner ~= device then
+            redis.call('HDEL', 'device:alias', device)
+            device_alias = nil
+        else
+            redis.call('HSET', 'alias:device', device_alias, device)
+
+            -- the device is back online, drop it's offline alias
+            if redis.call('GET', 'alias:' .. device_alias .. ':offline') == device then
+                redis.call('DEL', 'alias:' .. device_alias .. ':offline')
+            end
+        end
+    end
+
+    local device_data = redis.call('HGETALL', device)
+    local device_groups = redis.call('SMEMBERS', device .. ':groups')
+
+    -- add device alias to device data if present
+    if device_alias then
+        device_data['map']['alias'] = device_alias
+    end
+
+    -- add device groups to device data if present
+    if device_groups then
+        device_data['map']['groups'] = device_groups
+    end
+
+    -- add the number of messages stored while the device was offline
+    local inbox = redis.call('XLEN', device .. ':inbox')
+
+    if inbox > 0 then
+        device_data['map']['inbox'] = inbox
+    end
+
+    return device_data
+    """
+
+    _disconnect_device = """
+    local device = KEYS[1]
+    local forget_alias = ARGV[1] == '1'
+
+    -- a stale disconnect, the device already reconnected on another channel
+    if redis.call('HGET', device, 'channel') ~= ARGV[4] then
+        return {0, false, 0, 0}
+    end
+
+    local channel_removed = redis.call('HDEL', device, 'channel')
+    local device_alias = redis.call('HGET', 'device:alias', device)
+    local alias_device_removed = 0
+    local device_alias_removed = 0
+
+    -- only remove the alias:device entry if it still points to this device
+    if device_alias and redis.call('HGET', 'alias:device', device_alias) == device then
+        alias_device_removed = redis.call('HDEL', 'alias:device', device_alias)
+    end
+
+    -- also remove the device:alias entry, when the device alias is to be forgotten.
+    -- Else keep the alias pointing to the offline device, for messages to be stored
+    if forget_alias then
+        device_alias_removed = redis.call('HDEL', 'device:alias', device)
+
+        if device_alias and redis.call('GET', 'alias:' .. device_alias .. ':offline') == device then
+            redis.call('DEL', 'alias:' .. device_alias .. ':offline')
+        end
+    elseif alias_device_removed == 1 and ARGV[2] then
+        -- and at least until the device hash expires, so the alias can't be claimed
+        local ttl = math.max(tonumber(ARGV[2]), math.ceil(redis.call('PTTL', device) / 1000))
+        redis.call('SET', 'alias:' .. device_alias .. ':offline', device, 'EX', ttl)
+    end
+
+    -- keep the time the device went offline, to resume it within a grace window
+    if channel_removed == 1 and not forget_alias and ARGV[3] then
+        redis.call('HSET', device, 'offline', ARGV[3])
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return {channel_removed, device_alias, alias_device_removed, device_alias_removed}
+    """
+
+    _resume_device = """
+    local device = KEYS[1]
+    local offline = redis.call('HGET', device, 'offline')
+
+    -- only resume the same device, when it went offline within the grace window
+    if not offline or redis.call('HGET', device, 'did') ~= ARGV[1] then
+        return {0}
+    end
+
+    if tonumber(ARGV[5]) - tonumber(offline) > tonumber(ARGV[6]) then
+        return {0}
+    end
+
+    -- and it's alias was neither forgotten nor claimed by another device since
+    local device_alias = redis.call('HGET', 'device:alias', device)
+
+    if not device_alias then
+        return {0}
+    end
+
+    local owner = redis.call('HGET', 'alias:device', device_alias)
+
+    if owner and owner ~= device then
+        return {0}
+    end
+
+    -- rebind the device to it's new channel
+    redis.call('HSET', device, 'channel', ARGV[2], 'ttl', ARGV[3])
+    redis.call('HDEL', device, 'offline')
+    redis.call('EXPIREAT', device, ARGV[4])
+    redis.call('HSET', 'alias:device', device_alias, device)
+
+    -- the device is back online, drop it's offline alias
+    if redis.call('GET', 'alias:' .. device_alias .. ':offline') == device then
+        redis.call('DEL', 'alias:' .. device_alias .. ':offline')
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return {
+        1,
+        device_alias,
+        redis.call('XLEN', device .. ':inbox'),
+        redis.call('SMEMBERS', device .. ':groups'),
+    }
+    """
+
+    _get_chat_route = """
+    local recipient_alias = ARGV[1]
+    local recipient = redis.call('HGET', 'alias:device', recipient_alias)
+
+    local recipient_channel = false
+    local recipient_did = false
+
+    -- resolve recipient channel & did only when the alias belongs to a device
+    if recipient then
+        recipient_channel = redis.call('HGET', recipient, 'channel')
+        recipient_did = redis.call('HGET', recipient, 'did')
+    end
+
+    return {recipient, recipient_channel, recipient_did}
+    """
+
+    _get_chat_routes = """
+    local recipients = redis.call('HMGET', 'alias:device', unpack(ARGV))
+    local routes = {}
+
+    -- resolve recipient channel & did only when the alias belongs to a device
+    for i = 1, #ARGV do
+        local recipient = recipients[i]
+        local route = {false, false}
+
+        if recipient then
+            route = redis.call('HMGET', recipient, 'channel', 'did')
+        end
+
+        routes[#routes + 1] = recipient
+        routes[#routes + 1] = route[1]
+        routes[#routes + 1] = route[2]
+    end
+
+    return routes
+    """
+
+    _get_device_route = """
+    local device = KEYS[1]
+
+    return {
+        redis.call('HGET', device, 'channel'),
+        redis.call('HGET', 'device:alias', device),
+        redis.call('HGET', device, 'did'),
+    }
+    """
+
+    _prune_aliases = """
+    local pruned = 0
+
+    -- remove alias mappings of every given device that no longer exists
+    for _, device in ipairs(ARGV) do
+        if redis.call('EXISTS', device) == 0 then
+            local device_alias = redis.call('HGET', 'device:alias', device)
+
+            if device_alias then
+                redis.call('HDEL', 'device:alias', device)
+
+                if redis.call('HGET', 'alias:device', device_alias) == device then
+                    redis.call('HDEL', 'alias:device', device_alias)
+                end
+
+                redis.call('PUBLISH', 'routes:invalidate', device)
+                pruned = pruned + 1
+            end
+        end
+    end
+
+    return pruned
+    """
+
+    get_device_data = LuaScript(_get_device_data)
+    """
+    Awaitable redis lua script to get complete device info
+    """
+
+    get_chat_route = LuaScript(_get_chat_route)
+    """
+    Redis lua script to resolve the recipient of a chat message by alias, in one
+    round trip. Returns [recipient device, recipient channel, recipient did], where
+    missing values are returned as nil.
+    """
+
+    get_chat_routes = LuaScript(_get_chat_routes)
+    """
+    Redis lua script to resolve the recipients of a multicast chat message, in one
+    round trip. Aliases are given as args, and it returns a flat list of
+    [recipient device, recipient channel, recipient did] for each alias, in order.
+    """
+
+    get_device_route = LuaScript(_get_device_route)
+    """
+    Redis lua script to get the channel, alias & did of a device in one round trip.
+    Returns [channel, alias, did], where missing values are returned as nil.
+    """
+
+    reserve_alias = LuaScript(_reserve_alias)
+    """
+    Redis lua script to atomically check and claim an alias for a device, using
+    O(1) lookups on the device:alias & alias:device hashes. An alias stays taken
+    by an offline device, until it's device hash expires. ARGV is [alias, ttl,
+    expire at], and the device expiry is extended to the ttl when the alias is
+    claimed. Returns 1 when the alias was claimed, 0 when it is already the device
+    alias and -1 when it is taken by another device.
+    """
+
+    connect_device = LuaScript(_connect_device)
+    """
+    Redis lua script to run the whole connect handshake in one round trip. It
+    upserts the device hash, sets it's expiry, repairs the alias:device hash and
+    returns the complete device info, including alias, groups & the number of
+    messages in it's inbox.
+    """
+
+    disconnect_device = LuaScript(_disconnect_device)
+    """
+    Redis lua script to clean up after a device disconnects, in one round trip. It
+    removes the device channel and the alias:device entry of the device, and
+    optionally the device:alias entry. Unless the alias is forgotten, ARGV[2] is
+    the number of seconds the alias keeps pointing to the offline device, at least
+    until the device hash expires, and ARGV[3] the time the device went offline.
+    ARGV[4] is the channel of the disconnected consumer, nothing is removed unless
+    it is still the device channel. Returns [channel removed, device alias,
+    alias:device removed, device:alias removed].
+    """
+
+    resume_device = LuaScript(_resume_device)
+    """
+    Redis lua script to rebind a device that went offline less than ARGV[6]
+    seconds ago to a new channel, with a single write & without the connect
+    handshake. Returns [1, alias, number of messages in it's inbox, groups] when
+    the device was resumed, else [0].
+    """
+
+    prune_aliases = LuaScript(_prune_aliases)
+    """
+    Redis lua script to remove the device:alias & alias:device entries of expired
+    devices. Devices are given as args, and only those whose hash no longer exists
+    are pruned. Returns the number of devices pruned.
+    """
+
+    _join_group = """
+    local group = KEYS[1]
+    local device_groups = KEYS[2]
+    local device = ARGV[1]
+    local max_members = tonumber(ARGV[3])
+
+    -- device is already a member of the group
+    if redis.call('SISMEMBER', group, device) == 1 then
+        return 0
+    end
+
+    -- make room in a full group, by removing members whose device expired
+    if redis.call('SCARD', group) >= max_members then
+        for _, member in ipairs(redis.call('SMEMBERS', group)) do
+            if redis.call('EXISTS', member) == 0 then
+                redis.call('SREM', group, member)
+            end
+        end
+    end
+
+    if redis.call('SCARD', group) >= max_members then
+        return -1
+    end
+
+    redis.call('SADD', group, device)
+    redis.call('SADD', device_groups, ARGV[2])
+
+    return 1
+    """
+
+    _leave_group = """
+    redis.call('SREM', KEYS[2], ARGV[2])
+
+    return redis.call('SREM', KEYS[1], ARGV[1])
+    """
+
+    join_group = LuaScript(_join_group)
+    """
+    Redis lua script to add a device to a chat group, in one round trip. KEYS are
+    [group members set, device groups set] and ARGV is [device, group, max members].
+    Returns 1 when joined, 0 when already a member and -1 when the group is full.
+    """
+
+    leave_group = LuaScript(_leave_group)
+    """
+    Redis lua script to remove a device from a chat group, with the same KEYS &
+    ARGV as join_group. Returns 1 when removed and 0 when not a member.
+    """
+
+    _get_offline_device = """
+    local device = redis.call('GET', 'alias:' .. ARGV[1] .. ':offline')
+
+    -- only while the alias still belongs to the offline device
+    if device and redis.call('EXISTS', device) == 1
+        and redis.call('HGET', 'device:alias', device) == ARGV[1] then
+        return device
+    end
+
+    return false
+    """
+
+    _store_message = """
+    -- only store messages sent to an alias that still belongs to the device
+    if redis.call('HGET', 'device:alias', KEYS[1]) ~= ARGV[4] then
+        return false
+    end
+
+    local id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+
+    return id
+    """
+
+    get_offline_device = LuaScript(_get_offline_device)
+    """
+    Redis lua script to resolve the device an alias belonged to when it went
+    offline, i.e the alias:{alias}:offline key. ARGV is [alias]. Returns the device,
+    or nil when the alias no longer belongs to it, e.g it was forgotten or changed.
+    """
+
+    store_message = LuaScript(_store_message)
+    """
+    Redis lua script to store an undelivered message in the capped inbox stream of
+    a device, i.e device:{did}:inbox, and reset the stream retention ttl. KEYS are
+    [device, inbox stream] and ARGV is [message, max length, ttl, alias]. The alias
+    is checked to still belong to the device, in the same script. Returns the stream
+    entry id, or nil when it does not.
+    """
+
+    _next_sequences = """
+    local sequences = {}
+
+    for i, key in ipairs(KEYS) do
+        sequences[i] = redis.call('HINCRBY', key, ARGV[1], 1)
+        redis.call('EXPIRE', key, ARGV[2])
+    end
+
+    return sequences
+    """
+
+    next_sequences = LuaScript(_next_sequences)
+    """
+    Redis lua script to assign the next chat sequence number of a sender, in the
+    sequence hash of each recipient device, i.e device:{did}:seq. KEYS are the
+    recipients sequence hashes and ARGV is [sender did, ttl]. Returns the sequence
+    numbers, in the order of KEYS.
+    """
+
+    _ack_sequence = """
+    local last = tonumber(redis.call('HGET', KEYS[1], ARGV[1])) or 0
+    local acked = tonumber(redis.call('HGET', KEYS[1], ARGV[1] .. ':acked')) or 0
+    local sequence = tonumber(ARGV[2])
+
+    -- acks are cumulative, only move forward & never past the last sequence
+    if sequence <= acked or sequence > last then
+        return {acked, 0}
+    end
+
+    redis.call('HSET', KEYS[1], ARGV[1] .. ':acked', sequence)
+
+    return {sequence, 1}
+    """
+
+    ack_sequence = LuaScript(_ack_sequence)
+    """
+    Redis lua script to acknowledge every chat from a sender up to & including a
+    sequence number. KEYS is [recipient sequence hash] and ARGV is [sender did,
+    sequence]. Returns [acknowledged sequence, 1 if it moved forward else 0].
+    """
+
+    _rate_limit = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local cost = tonumber(ARGV[4])
+    local levels = {}
+    local retry_after = 0
+
+    -- refill every bucket for the time elapsed since it was last taken from
+    for i, key in ipairs(KEYS) do
+        local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or capacity
+        local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+
+        levels[i] = math.min(capacity, tokens + elapsed * rate / 1000)
+
+        if levels[i] < cost then
+            retry_after = math.max(retry_after, math.ceil((cost - levels[i]) * 1000 / rate))
+        end
     end
 
-    return true
+    -- take from every bucket, or from none of them
+    if retry_after > 0 then
+        return {0, retry_after}
+    end
+
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(capacity * 1000 / rate))
+    end
+
+    return {1, 0}
+    """
+
+    rate_limit = LuaScript(_rate_limit)
+    """
+    Redis lua script to take tokens from token buckets, e.g the buckets of a device
+    and of it's client IP, in one round trip. KEYS are the bucket hashes and ARGV is
+    [capacity, refill rate per second, now in milliseconds, cost]. Returns [1, 0]
+    when taken, else [0, milliseconds until enough tokens are refilled].
+    """
+
+    _migrate_aliases = """
+    local migrated = 0
+
+    -- copy each device, alias pair given as args to the per-alias key layout
+    for i = 1, #ARGV, 2 do
+        local device = ARGV[i]
+        local alias = ARGV[i + 1]
+        local alias_key = 'alias:' .. alias
+
+        if redis.call('EXISTS', device) == 1 then
+            local owner = redis.call('GET', alias_key)
+
+            if not owner or owner == device then
+                redis.call('HSET', device, 'alias', alias)
+                redis.call('SET', alias_key, device)
+
+                -- expire the alias key along with the device
+                local pttl = redis.call('PTTL', device)
+
+                if pttl > 0 then
+                    redis.call('PEXPIRE', alias_key, pttl)
+                end
+
+                redis.call('PUBLISH', 'routes:invalidate', device)
+                migrated = migrated + 1
+            end
+        end
+    end
+
+    return migrated
     """
 
-    get_device_data = redis_client.register_script(_get_device_data)
+    migrate_aliases = LuaScript(_migrate_aliases)
     """
-    Redis lua script to get complete device info
+    Redis lua script to copy device, alias pairs from the device:alias hash to the
+    per-alias key layout. Pairs are given as args, and only pairs of existing devices
+    whose alias is not taken are copied. Returns the number of pairs copied.
     """
 
-    set_alias_device = redis_client.register_script(_set_alias_device)
+
+class AliasKeyLuaScripts(LuaScripts):
     """
-    Redis lua script to set/update the alias:device hash. Where key is device alias
-    and value is device:did. We use this to store each alias/device:did to easily
-    retreive device:did when needed.
+    Lua scripts for the per-alias key layout.
+
+    Instead of the global device:alias & alias:device hashes, each device alias
+    is stored in an 'alias' field of it's device hash, and each alias is it's own
+    key i.e alias:{alias}, holding the device and expiring along with the device.
     """
+
+    _get_device_data = """
+    redis.setresp(3)
+
+    local device = KEYS[1]
+    local device_data = redis.call('HGETALL', device)
+    local device_groups = redis.call('SMEMBERS', device .. ':groups')
+
+    -- add device groups to device data if present
+    if device_groups then
+        device_data['map']['groups'] = device_groups
+    end
+
+    return device_data
+    """
+
+    _reserve_alias = """
+    local device = KEYS[1]
+    local alias = ARGV[1]
+    local alias_key = 'alias:' .. alias
+    local current_alias = redis.call('HGET', device, 'alias')
+
+    -- alias is already the device alias
+    if current_alias == alias then
+        return 0
+    end
+
+    -- alias already belongs to another device
+    local owner = redis.call('GET', alias_key)
+
+    if owner and owner ~= device then
+        return -1
+    end
+
+    -- or to an offline device, until it's device hash expires
+    local offline_owner = redis.call('GET', alias_key .. ':offline')
+
+    if offline_owner and offline_owner ~= device
+        and redis.call('HGET', offline_owner, 'alias') == alias then
+        return -1
+    end
+
+    -- claim alias for device, expiring along with the device at the given ttl
+    redis.call('SET', alias_key, device)
+    redis.call('HSET', device, 'alias', alias, 'ttl', ARGV[2])
+    redis.call('DEL', alias_key .. ':offline')
+    redis.call('EXPIREAT', device, ARGV[3])
+    redis.call('EXPIREAT', alias_key, ARGV[3])
+
+    -- release the previous alias of the device, and it's offline alias
+    if current_alias then
+        if redis.call('GET', 'alias:' .. current_alias) == device then
+            redis.call('DEL', 'alias:' .. current_alias)
+        end
+
+        if redis.call('GET', 'alias:' .. current_alias .. ':offline') == device then
+            redis.call('DEL', 'alias:' .. current_alias .. ':offline')
+        end
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return 1
+    """
+
+    _connect_device = """
+    redis.setresp(3)
+
+    local device = KEYS[1]
+
+    -- upsert device hash and expire it at the given ttl
+    redis.call('HSET', device, 'did', ARGV[1], 'channel', ARGV[2], 'ttl', ARGV[3])
+    redis.call('HDEL', device, 'offline')
+    redis.call('EXPIREAT', device, ARGV[4])
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    -- set the alias key with the same expiry, unless the alias was claimed
+    -- by another device while this device was offline
+    local device_alias = redis.call('HGET', device, 'alias')
+
+    if device_alias then
+        local alias_key = 'alias:' .. device_alias
+        local owner = redis.call('GET', alias_key)
+
+        if owner and owner ~= device then
+            redis.call('HDEL', device, 'alias')
+        else
+            redis.call('SET', alias_key, device)
+            redis.call('EXPIREAT', alias_key, ARGV[4])
+
+            -- the device is back online, drop it's offline alias
+            if redis.call('GET', alias_key .. ':offline') == device then
+                redis.call('DEL', alias_key .. ':offline')
+            end
+        end
+    end
+
+    local device_data = redis.call('HGETALL', device)
+    local device_groups = redis.call('SMEMBERS', device .. ':groups')
+
+    -- add device groups to device data if present
+    if device_groups then
+        device_data['map']['groups'] = device_groups
+    end
+
+    -- add the number of messages stored while the device was offline
+    local inbox = redis.call('XLEN', device .. ':inbox')
+
+    if inbox > 0 then
+        device_data['map']['inbox'] = inbox
+    end
+
+    return device_data
+    """
+
+    _disconnect_device = """
+    local device = KEYS[1]
+    local forget_alias = ARGV[1] == '1'
+
+    -- a stale disconnect, the device already reconnected on another channel
+    if redis.call('HGET', device, 'channel') ~= ARGV[4] then
+        return {0, false, 0, 0}
+    end
+
+    local channel_removed = redis.call('HDEL', device, 'channel')
+    local device_alias = redis.call('HGET', device, 'alias')
+    local alias_device_removed = 0
+    local device_alias_removed = 0
+
+    -- only remove the alias key if it still points to this device
+    if device_alias and redis.call('GET', 'alias:' .. device_alias) == device then
+        alias_device_removed = redis.call('DEL', 'alias:' .. device_alias)
+    end
+
+    -- also remove the alias field, when the device alias is to be forgotten.
+    -- Else keep the alias pointing to the offline device, for messages to be stored
+    if forget_alias then
+        device_alias_removed = redis.call('HDEL', device, 'alias')
+
+        if device_alias and redis.call('GET', 'alias:' .. device_alias .. ':offline') == device then
+            redis.call('DEL', 'alias:' .. device_alias .. ':offline')
+        end
+    elseif alias_device_removed == 1 and ARGV[2] then
+        -- and at least until the device hash expires, so the alias can't be claimed
+        local ttl = math.max(tonumber(ARGV[2]), math.ceil(redis.call('PTTL', device) / 1000))
+        redis.call('SET', 'alias:' .. device_alias .. ':offline', device, 'EX', ttl)
+    end
+
+    -- keep the time the device went offline, to resume it within a grace window
+    if channel_removed == 1 and not forget_alias and ARGV[3] then
+        redis.call('HSET', device, 'offline', ARGV[3])
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return {channel_removed, device_alias, alias_device_removed, device_alias_removed}
+    """
+
+    _resume_device = """
+    local device = KEYS[1]
+    local offline = redis.call('HGET', device, 'offline')
+
+    -- only resume the same device, when it went offline within the grace window
+    if not offline or redis.call('HGET', device, 'did') ~= ARGV[1] then
+        return {0}
+    end
+
+    if tonumber(ARGV[5]) - tonumber(offline) > tonumber(ARGV[6]) then
+        return {0}
+    end
+
+    -- and it's alias was neither forgotten nor claimed by another device since
+    local device_alias = redis.call('HGET', device, 'alias')
+
+    if not device_alias then
+        return {0}
+    end
+
+    local alias_key = 'alias:' .. device_alias
+    local owner = redis.call('GET', alias_key)
+
+    if owner and owner ~= device then
+        return {0}
+    end
+
+    -- rebind the device to it's new channel
+    redis.call('HSET', device, 'channel', ARGV[2], 'ttl', ARGV[3])
+    redis.call('HDEL', device, 'offline')
+    redis.call('EXPIREAT', device, ARGV[4])
+    redis.call('SET', alias_key, device)
+    redis.call('EXPIREAT', alias_key, ARGV[4])
+
+    -- the device is back online, drop it's offline alias
+    if redis.call('GET', alias_key .. ':offline') == device then
+        redis.call('DEL', alias_key .. ':offline')
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return {
+        1,
+        device_alias,
+        redis.call('XLEN', device .. ':inbox'),
+        redis.call('SMEMBERS', device .. ':groups'),
+    }
+    """
+
+    _get_chat_route = """
+    local recipient = redis.call('GET', 'alias:' .. ARGV[1])
+
+    local recipient_channel = false
+    local recipient_did = false
+
+    -- resolve recipient channel & did only when the alias belongs to a device
+    if recipient then
+        recipient_channel = redis.call('HGET', recipient, 'channel')
+        recipient_did = redis.call('HGET', recipient, 'did')
+    end
+
+    return {recipient, recipient_channel, recipient_did}
+    """
+
+    _get_chat_routes = """
+    local routes = {}
+
+    -- resolve recipient channel & did only when the alias belongs to a device
+    for _, alias in ipairs(ARGV) do
+        local recipient = redis.call('GET', 'alias:' .. alias)
+        local route = {false, false}
+
+        if recipient then
+            route = redis.call('HMGET', recipient, 'channel', 'did')
+        end
+
+        routes[#routes + 1] = recipient
+        routes[#routes + 1] = route[1]
+        routes[#routes + 1] = route[2]
+    end
+
+    return routes
+    """
+
+    _get_device_route = """
+    local device = KEYS[1]
+
+    return {
+        redis.call('HGET', device, 'channel'),
+        redis.call('HGET', device, 'alias'),
+        redis.call('HGET', device, 'did'),
+    }
+    """
+
+    _prune_aliases = """
+    -- alias keys expire along with their device, nothing is left behind
+    return 0
+    """
+
+    _get_offline_device = """
+    local device = redis.call('GET', 'alias:' .. ARGV[1] .. ':offline')
+
+    -- only while the alias still belongs to the offline device
+    if device and redis.call('HGET', device, 'alias') == ARGV[1] then
+        return device
+    end
+
+    return false
+    """
+
+    _store_message = """
+    -- only store messages sent to an alias that still belongs to the device
+    if redis.call('HGET', KEYS[1], 'alias') ~= ARGV[4] then
+        return false
+    end
+
+    local id = redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+
+    return id
+    """
+
+    get_device_data = LuaScript(_get_device_data)
+    reserve_alias = LuaScript(_reserve_alias)
+    connect_device = LuaScript(_connect_device)
+    disconnect_device = LuaScript(_disconnect_device)
+    resume_device = LuaScript(_resume_device)
+    get_chat_route = LuaScript(_get_chat_route)
+    get_chat_routes = LuaScript(_get_chat_routes)
+    get_device_route = LuaScript(_get_device_route)
+    prune_aliases = LuaScript(_prune_aliases)
+    get_offline_device = LuaScript(_get_offline_device)
+    store_message = LuaScript(_store_message)
+
+
+def alias_keys(alias: str) -> list[str]:
+    """Alias key & offline alias key of an alias, which share a slot."""
+    return [alias_key(alias), offline_alias_key(alias)]
+
+
+class ClusterLuaScripts(AliasKeyLuaScripts):
+    """
+    Lua scripts for redis cluster mode, built on the per-alias key layout.
+
+    Every script only touches keys declared in KEYS, which all hash to a single
+    slot. A device hash and it's groups set share the device hash tag, see
+    src.utils.device_key(), but an alias key lives in it's own slot. So the
+    scripts that touch both a device and an alias are replaced by coroutines with
+    the same call signature, that run one single-slot script per slot.
+
+    The device and alias steps are not atomic together. Claiming an alias is
+    still atomic on the alias key, and an alias key left behind by an
+    interrupted call expires along with it's device.
+    """
+
+    _device_data = """
+    redis.setresp(3)
+
+    local device_data = redis.call('HGETALL', KEYS[1])
+    local device_groups = redis.call('SMEMBERS', KEYS[2])
+
+    -- add device groups to device data if present
+    if device_groups then
+        device_data['map']['groups'] = device_groups
+    end
+
+    return device_data
+    """
+
+    _connect = """
+    redis.setresp(3)
+
+    local device = KEYS[1]
+
+    -- upsert device hash and expire it at the given ttl
+    redis.call('HSET', device, 'did', ARGV[1], 'channel', ARGV[2], 'ttl', ARGV[3])
+    redis.call('HDEL', device, 'offline')
+    redis.call('EXPIREAT', device, ARGV[4])
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    local device_data = redis.call('HGETALL', device)
+    local device_groups = redis.call('SMEMBERS', KEYS[2])
+
+    -- add device groups to device data if present
+    if device_groups then
+        device_data['map']['groups'] = device_groups
+    end
+
+    -- add the number of messages stored while the device was offline
+    local inbox = redis.call('XLEN', KEYS[3])
+
+    if inbox > 0 then
+        device_data['map']['inbox'] = inbox
+    end
+
+    return device_data
+    """
+
+    _alias_state = """
+    return {redis.call('HGET', KEYS[1], 'alias'), redis.call('PTTL', KEYS[1])}
+    """
+
+    _set_alias = """
+    redis.call('HSET', KEYS[1], 'alias', ARGV[1], 'ttl', ARGV[2])
+    redis.call('EXPIREAT', KEYS[1], ARGV[3])
+    redis.call('PUBLISH', 'routes:invalidate', KEYS[1])
+
+    return 1
+    """
+
+    _forget_alias = """
+    local device = KEYS[1]
+
+    -- only forget the alias, if it is still the device alias
+    if redis.call('HGET', device, 'alias') ~= ARGV[1] then
+        return 0
+    end
+
+    redis.call('HDEL', device, 'alias')
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return 1
+    """
+
+    _offline_owner = """
+    return redis.call('GET', KEYS[2])
+    """
+
+    _disconnect = """
+    local device = KEYS[1]
+
+    -- a stale disconnect, the device already reconnected on another channel
+    if redis.call('HGET', device, 'channel') ~= ARGV[4] then
+        return {0, false, 0, -2}
+    end
+
+    local channel_removed = redis.call('HDEL', device, 'channel')
+    local device_alias = redis.call('HGET', device, 'alias')
+    local device_alias_removed = 0
+
+    -- also remove the alias field, when the device alias is to be forgotten
+    if ARGV[1] == '1' then
+        device_alias_removed = redis.call('HDEL', device, 'alias')
+    elseif channel_removed == 1 and ARGV[3] then
+        -- keep the time the device went offline, to resume it within a grace window
+        redis.call('HSET', device, 'offline', ARGV[3])
+    end
+
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return {channel_removed, device_alias, device_alias_removed, redis.call('PTTL', device)}
+    """
+
+    _claim_alias = """
+    local alias_key = KEYS[1]
+    local device = ARGV[1]
+    local owner = redis.call('GET', alias_key)
+
+    -- alias already belongs to another device
+    if owner and owner ~= device then
+        return -1
+    end
+
+    -- claim alias for device, expiring along with the device
+    redis.call('SET', alias_key, device)
+    redis.call('DEL', KEYS[2])
+
+    if tonumber(ARGV[2]) > 0 then
+        redis.call('PEXPIRE', alias_key, ARGV[2])
+    end
+
+    return 1
+    """
+
+    _release_alias = """
+    -- drop the offline alias of the device, when the alias is not kept for it
+    if not ARGV[2] and redis.call('GET', KEYS[2]) == ARGV[1] then
+        redis.call('DEL', KEYS[2])
+    end
+
+    -- only remove the alias key if it still points to the device
+    if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+
+    -- keep the alias pointing to the offline device, for messages to be stored
+    if ARGV[2] then
+        redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+    end
+
+    return redis.call('DEL', KEYS[1])
+    """
+
+    _resume = """
+    local device = KEYS[1]
+    local offline = redis.call('HGET', device, 'offline')
+
+    -- only resume the same device, when it went offline within the grace window
+    if not offline or redis.call('HGET', device, 'did') ~= ARGV[1] then
+        return {0}
+    end
+
+    if tonumber(ARGV[5]) - tonumber(offline) > tonumber(ARGV[6]) then
+        return {0}
+    end
+
+    -- and it's alias was not forgotten, the alias key is claimed separately
+    local device_alias = redis.call('HGET', device, 'alias')
+
+    if not device_alias then
+        return {0}
+    end
+
+    -- rebind the device to it's new channel
+    redis.call('HSET', device, 'channel', ARGV[2], 'ttl', ARGV[3])
+    redis.call('HDEL', device, 'offline')
+    redis.call('EXPIREAT', device, ARGV[4])
+    redis.call('PUBLISH', 'routes:invalidate', device)
+
+    return {1, device_alias, redis.call('XLEN', KEYS[3]), redis.call('SMEMBERS', KEYS[2])}
+    """
+
+    device_data = LuaScript(_device_data)
+    connect = LuaScript(_connect)
+    resume = LuaScript(_resume)
+    alias_state = LuaScript(_alias_state)
+    offline_owner = LuaScript(_offline_owner)
+    set_alias = LuaScript(_set_alias)
+    forget_alias = LuaScript(_forget_alias)
+    disconnect = LuaScript(_disconnect)
+    claim_alias = LuaScript(_claim_alias)
+    release_alias = LuaScript(_release_alias)
+
+    @staticmethod
+    async def get_device_data(keys: list, args: list | None = None, client=None):
+        return await ClusterLuaScripts.device_data(
+            keys=[keys[0], f"{keys[0]}:groups"], client=client
+        )
+
+    @staticmethod
+    async def connect_device(keys: list, args: list, client=None) -> dict:
+        device: str = keys[0]
+        device_data: dict = convert_array_to_dict(
+            await ClusterLuaScripts.connect(
+                keys=[device, f"{device}:groups", f"{device}:inbox"], args=args, client=client
+            )
+        )
+
+        # set the alias key with the same expiry, unless the alias was claimed
+        # by another device while this device was offline
+        device_alias: str | None = device_data.get("alias")
+
+        if device_alias:
+            pttl: int = int((float(args[2]) - time.time()) * 1000)
+            claimed: int = await ClusterLuaScripts.claim_alias(
+                keys=alias_keys(device_alias), args=[device, pttl], client=client
+            )
+
+            if claimed == -1:
+                await ClusterLuaScripts.forget_alias(
+                    keys=[device], args=[device_alias], client=client
+                )
+                del device_data["alias"]
+
+        return device_data
+
+    @staticmethod
+    async def resume_device(keys: list, args: list, client=None) -> list:
+        device: str = keys[0]
+        resumed: list = await ClusterLuaScripts.resume(
+            keys=[device, f"{device}:groups", f"{device}:inbox"], args=args, client=client
+        )
+
+        if not resumed[0]:
+            return resumed
+
+        # claim the alias key with the same expiry, unless the alias was claimed
+        # by another device while this device was offline
+        pttl: int = int((float(args[2]) - time.time()) * 1000)
+        claimed: int = await ClusterLuaScripts.claim_alias(
+            keys=alias_keys(resumed[1]), args=[device, pttl], client=client
+        )
+
+        if claimed == -1:
+            await ClusterLuaScripts.forget_alias(keys=[device], args=[resumed[1]], client=client)
+            return [0]
+
+        return resumed
+
+    @staticmethod
+    async def reserve_alias(keys: list, args: list, client=None) -> int:
+        device: str = keys[0]
+        alias: str = args[0]
+        current_alias, _ = await ClusterLuaScripts.alias_state(keys=[device], client=client)
+
+        # alias is already the device alias
+        if current_alias == alias:
+            return 0
+
+        # alias belongs to an offline device, until it's device hash expires
+        offline_owner: str | None = await ClusterLuaScripts.get_offline_device(
+            args=[alias], client=client
+        )
+
+        if offline_owner and offline_owner != device:
+            return -1
+
+        # claim the alias key, expiring along with the device at the given ttl
+        pttl: int = int((float(args[1]) - time.time()) * 1000)
+        claimed: int = await ClusterLuaScripts.claim_alias(
+            keys=alias_keys(alias), args=[device, pttl], client=client
+        )
+
+        if claimed == -1:
+            return -1
+
+        await ClusterLuaScripts.set_alias(keys=[device], args=args, client=client)
+
+        # release the previous alias of the device, and it's offline alias
+        if current_alias:
+            await ClusterLuaScripts.release_alias(
+                keys=alias_keys(current_alias), args=[device], client=client
+            )
+
+        return 1
+
+    @staticmethod
+    async def get_offline_device(args: list, keys: list | None = None, client=None):
+        # the offline alias key & the device hash live in different slots. The
+        # alias is checked again when a message is stored, see store_message
+        device: str | None = await ClusterLuaScripts.offline_owner(
+            keys=alias_keys(args[0]), client=client
+        )
+
+        if device is None:
+            return None
+
+        device_alias, _ = await ClusterLuaScripts.alias_state(keys=[device], client=client)
+
+        return device if device_alias == args[0] else None
+
+    @staticmethod
+    async def disconnect_device(keys: list, args: list, client=None) -> list:
+        device: str = keys[0]
+        removed: list = await ClusterLuaScripts.disconnect(keys=[device], args=args, client=client)
+        channel_removed, device_alias, device_alias_removed, pttl = removed
+        alias_device_removed: int = 0
+
+        if device_alias:
+            # keep an offline alias, unless the device alias is to be forgotten. It
+            # lasts at least until the device hash expires, so it can't be claimed
+            offline_ttl: int = max(int(args[1]), math.ceil(pttl / 1000))
+            alias_device_removed = await ClusterLuaScripts.release_alias(
+                keys=alias_keys(device_alias),
+                args=[device] if device_alias_removed else [device, offline_ttl],
+                client=client,
+            )
+
+        return [channel_removed, device_alias, alias_device_removed, device_alias_removed]
+
+    @staticmethod
+    async def get_chat_route(args: list, keys: list | None = None, client=None) -> list:
+        client = client or async_redis_client
+        recipient: str | None = await client.get(alias_key(args[0]))
+
+        # resolve recipient channel & did only when the alias belongs to a device
+        if recipient is None:
+            return [None, None, None]
+
+        return [recipient, *await client.hmget(recipient, "channel", "did")]
+
+    @staticmethod
+    async def get_chat_routes(args: list, keys: list | None = None, client=None) -> list:
+        # every alias key lives in it's own slot, resolve them concurrently
+        routes: list[list] = await asyncio.gather(
+            *(ClusterLuaScripts.get_chat_route(args=[alias], client=client) for alias in args)
+        )
+
+        return [value for route in routes for value in route]
+
+    _join_group_members = """
+    local group = KEYS[1]
+
+    if redis.call('SISMEMBER', group, ARGV[1]) == 1 then
+        return 0
+    end
+
+    if redis.call('SCARD', group) >= tonumber(ARGV[2]) then
+        return -1
+    end
+
+    return redis.call('SADD', group, ARGV[1])
+    """
+
+    join_group_members = LuaScript(_join_group_members)
+
+    @staticmethod
+    async def join_group(keys: list, args: list, client=None) -> int:
+        # a group members set & a device groups set live in different slots
+        client = client or async_redis_client
+        joined: int = await ClusterLuaScripts.join_group_members(
+            keys=[keys[0]], args=[args[0], args[2]], client=client
+        )
+
+        # make room in a full group, by removing members whose device expired.
+        # Every member device lives in it's own slot, so each is checked on it's own
+        if joined == -1:
+            members: list[str] = list(await client.smembers(keys[0]))
+            exists: list[int] = await asyncio.gather(*(client.exists(member) for member in members))
+            expired: list[str] = [member for member, found in zip(members, exists) if not found]
+
+            if expired:
+                await client.srem(keys[0], *expired)
+                joined = await ClusterLuaScripts.join_group_members(
+                    keys=[keys[0]], args=[args[0], args[2]], client=client
+                )
+
+        if joined == 1:
+            await client.sadd(keys[1], args[1])
+
+        return joined
+
+    @staticmethod
+    async def leave_group(keys: list, args: list, client=None) -> int:
+        client = client or async_redis_client
+        await client.srem(keys[1], args[1])
+
+        return await client.srem(keys[0], args[0])
+
+    @staticmethod
+    async def next_sequences(keys: list, args: list, client=None) -> list:
+        # sequence hashes of different recipients live in different slots
+        sequences: list[list] = await asyncio.gather(
+            *(LuaScripts.next_sequences(keys=[key], args=args, client=client) for key in keys)
+        )
+
+        return [sequence for [sequence] in sequences]
+
+    @staticmethod
+    async def rate_limit(keys: list, args: list, client=None) -> list:
+        # buckets of a device & of an IP live in different slots, so each bucket
+        # is taken from on it's own, and a denied bucket doesn't refund the rest
+        results: list[list] = await asyncio.gather(
+            *(LuaScripts.rate_limit(keys=[key], args=args, client=client) for key in keys)
+        )
+
+        return [int(all(allowed for allowed, _ in results)), max(retry for _, retry in results)]
+
+    @staticmethod
+    async def prune_aliases(args: list, keys: list | None = None, client=None) -> int:
+        # alias keys expire along with their device, nothing is left behind
+        return 0
+
+
+def get_lua_scripts() -> type[LuaScripts]:
+    """
+    Return the lua scripts of the redis key layout selected in settings.
+    i.e settings.REDIS_KEY_LAYOUT, either 'hash' or 'keys', or the cluster
+    safe scripts when settings.REDIS_CLUSTER is set.
+    """
+    if settings.REDIS_CLUSTER:
+        return ClusterLuaScripts
+
+    if settings.REDIS_KEY_LAYOUT == "keys":
+        return AliasKeyLuaScripts
+
+    return LuaScripts
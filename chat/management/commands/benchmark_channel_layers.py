@@ -0,0 +1,123 @@
+import asyncio
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from src.utils import send_many
+
+BACKENDS = {
+    "channels_redis": "channels_redis.core.RedisChannelLayer",
+    "pubsub": "src.layers.PubSubChannelLayer",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the latency & throughput of channel layer backends against the redis "
+        "server in settings.CHANNEL_LAYERS. Each backend runs as two workers, one sending "
+        "& one receiving, like two devices connected to different workers. Throughput is "
+        "measured through src.utils.send_many, batched by backends with a send_many & "
+        "sent concurrently by the others."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            action="append",
+            choices=list(BACKENDS),
+            help="Backend to benchmark, can be repeated. Default is every backend.",
+        )
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=2000,
+            help="Number of messages sent by each benchmark.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Number of messages in flight in the throughput benchmark.",
+        )
+        parser.add_argument(
+            "--group-size",
+            type=int,
+            default=50,
+            help="Number of channels in the group of the group send benchmark.",
+        )
+
+    def handle(self, *args, **options):
+        config: dict = settings.CHANNEL_LAYERS["default"].get("CONFIG", {})
+
+        for name in options["backend"] or list(BACKENDS):
+            backend = import_string(BACKENDS[name])
+            results: dict = asyncio.run(self.benchmark(backend, config, options))
+
+            self.stdout.write(
+                self.style.SUCCESS(name)
+                + f"\n  latency: p50 {results['p50']:.3f}ms, p99 {results['p99']:.3f}ms"
+                + f"\n  throughput: {results['throughput']:.0f} messages/s ({results['path']})"
+                + f"\n  group send: {results['group_send']:.0f} deliveries/s"
+            )
+
+    async def benchmark(self, backend, config: dict, options: dict) -> dict:
+        prefix: str = f"benchmark{int(time.time())}"
+        sender, receiver = backend(prefix=prefix, **config), backend(prefix=prefix, **config)
+        message: dict = {"type": "chat.message", "data": {"message": "x" * 64}}
+
+        try:
+            channel: str = await receiver.new_channel()
+
+            # latency, one message in flight at a time
+            latencies: list[float] = []
+
+            for _ in range(options["messages"]):
+                start = time.perf_counter()
+                await sender.send(channel, message)
+                await receiver.receive(channel)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            quantiles: list[float] = statistics.quantiles(latencies, n=100)
+
+            # throughput, --concurrency messages in flight at a time, sent like a multicast
+            path: str = "batched send_many" if hasattr(sender, "send_many") else "concurrent sends"
+            start = time.perf_counter()
+
+            for sent in range(0, options["messages"], options["concurrency"]):
+                window = min(options["concurrency"], options["messages"] - sent)
+
+                await send_many(sender, [(channel, message)] * window)
+                await asyncio.gather(*(receiver.receive(channel) for _ in range(window)))
+
+            throughput: float = options["messages"] / (time.perf_counter() - start)
+
+            # group send, to --group-size channels of the receiving worker
+            group: str = f"{prefix}.group"
+            channels = [await receiver.new_channel() for _ in range(options["group_size"])]
+            await asyncio.gather(*(sender.group_add(group, member) for member in channels))
+
+            sends: int = max(options["messages"] // options["group_size"], 1)
+            start = time.perf_counter()
+
+            for _ in range(sends):
+                await sender.group_send(group, message)
+                await asyncio.gather(*(receiver.receive(member) for member in channels))
+
+            group_send: float = sends * len(channels) / (time.perf_counter() - start)
+
+        finally:
+            await sender.flush()
+
+            for layer in (sender, receiver):
+                await (layer.close() if hasattr(layer, "close") else layer.close_pools())
+
+        return {
+            "p50": quantiles[49],
+            "p99": quantiles[98],
+            "throughput": throughput,
+            "path": path,
+            "group_send": group_send,
+        }
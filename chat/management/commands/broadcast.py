@@ -0,0 +1,19 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chat.services.broadcast import broadcast
+
+
+class Command(BaseCommand):
+    help = (
+        "Send a message to every connected device that opted in to broadcasts. The "
+        "message is sent one broadcast group shard at a time, paced by settings.BROADCAST."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("message", help="The broadcast message.")
+
+    def handle(self, *args, **options):
+        shards: int = asyncio.run(broadcast(options["message"]))
+        self.stdout.write(self.style.SUCCESS(f"Broadcast sent to {shards} group shard(s)"))
@@ -0,0 +1,68 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.lua_scripts import LuaScripts
+from src.utils import async_redis_client
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy device aliases from the device:alias & alias:device hashes to the per-alias "
+        "key layout. Safe to run while the server is running, and to run more than once. "
+        "Run it once before and once after setting REDIS_KEY_LAYOUT to 'keys', to pick up "
+        "aliases set in between. Then run it with --cleanup to delete the old hashes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of aliases copied per redis call.",
+        )
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the device:alias & alias:device hashes once copied.",
+        )
+
+    def handle(self, *args, **options):
+        if settings.REDIS_CLUSTER:
+            self.stderr.write(
+                self.style.ERROR("The alias hashes don't exist in cluster mode, nothing to migrate")
+            )
+            return
+
+        if options["cleanup"] and settings.REDIS_KEY_LAYOUT != "keys":
+            self.stderr.write(
+                self.style.ERROR("Set REDIS_KEY_LAYOUT to 'keys' before deleting the old hashes")
+            )
+            return
+
+        migrated: int = asyncio.run(self.migrate(options["batch_size"], options["cleanup"]))
+        self.stdout.write(self.style.SUCCESS(f"Migrated {migrated} device alias(es)"))
+
+    async def migrate(self, batch_size: int, cleanup: bool) -> int:
+        migrated: int = 0
+        cursor: int = 0
+
+        while True:
+            cursor, mapping = await async_redis_client.hscan(
+                "device:alias", cursor=cursor, count=batch_size
+            )
+
+            if mapping:
+                migrated += await LuaScripts.migrate_aliases(
+                    args=[value for pair in mapping.items() for value in pair],
+                    client=async_redis_client,
+                )
+
+            if not cursor:
+                break
+
+        if cleanup:
+            await async_redis_client.unlink("device:alias", "alias:device")
+
+        return migrated
@@ -0,0 +1,39 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from chat.services.alias_reaper import AliasReaper
+
+
+class Command(BaseCommand):
+    help = "Prune device:alias & alias:device entries left behind by expired devices"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run a single sweep, report the number of devices pruned and exit.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Number of devices pruned per redis call.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Number of seconds between full sweeps.",
+        )
+
+    def handle(self, *args, **options):
+        reaper = AliasReaper(batch_size=options["batch_size"], interval=options["interval"])
+
+        if options["once"]:
+            pruned: int = asyncio.run(reaper.sweep())
+            self.stdout.write(self.style.SUCCESS(f"Pruned {pruned} expired device(s)"))
+            return
+
+        try:
+            asyncio.run(reaper.run())
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS(f"Pruned {reaper.pruned} expired device(s)"))
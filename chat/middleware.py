@@ -0,0 +1,45 @@
+import logging
+
+from redis import exceptions as redis_exceptions
+
+from chat.lua_scripts import scripts
+
+logger = logging.getLogger(__name__)
+
+
+class LuaScriptsMiddleware:
+    """
+    ASGI middleware that loads every lua script into redis at startup.
+
+    Servers that send lifespan events (e.g uvicorn) load the scripts before
+    accepting connections. Servers that don't (e.g daphne) load them in the
+    background on the first connection, while the scripts fall back to EVAL
+    until they are loaded.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        scripts.start()
+
+        return await self.inner(scope, receive, send)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                try:
+                    await scripts.load()
+                except redis_exceptions.RedisError:
+                    logger.exception("Unable to load lua scripts, they will be loaded on first use")
+
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
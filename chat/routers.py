@@ -2,10 +2,13 @@ from django.urls import path
 
 from chat.consumers.chat_p2p_consumer import P2PChatConsumer
 from chat.consumers.connect_consumer import ConnectConsumer
+from chat.consumers.device_consumer import DeviceConsumer
 from chat.consumers.disconnect_consumer import DisconnectConsumer
 from chat.consumers.scan_consumer import ScanConnectConsumer
 
 websocket_urlpatterns = [
+    path("ws/", DeviceConsumer.as_asgi(), name="device_consumer"),
+    # aliases of ws/, each handling some of it's events
     path("ws/connect/", ConnectConsumer.as_asgi(), name="connect_consumer"),
     path(
         "ws/connect/scan/<uuid:did>/",
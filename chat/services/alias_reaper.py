@@ -0,0 +1,117 @@
+import logging
+import time
+
+from django.conf import settings
+from redis import exceptions as redis_exceptions
+
+from chat.lua_scripts import get_lua_scripts
+from src.utils import async_pubsub_client, async_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class AliasReaper:
+    """
+    Removes the device:alias & alias:device entries left behind by devices
+    whose hash expired in redis store.
+
+    It listens for keyspace 'expired' events to prune devices as soon as they
+    expire, and periodically sweeps the device:alias hash with HSCAN as a
+    fallback for missed events (e.g. while the reaper was not running).
+
+    Not needed with the 'keys' layout, where alias keys expire along with
+    their device.
+    """
+
+    device_alias: str = "device:alias"
+
+    def __init__(self, batch_size: int | None = None, interval: float | None = None):
+        """
+        :param batch_size: Number of devices pruned per lua script call.
+        :param interval: Number of seconds between full sweeps.
+        """
+        self.batch_size: int = batch_size or settings.ALIAS_REAPER["BATCH_SIZE"]
+        self.interval: float = interval or settings.ALIAS_REAPER["INTERVAL"]
+        self.pruned: int = 0
+
+    @staticmethod
+    def is_device(key: str) -> bool:
+        """Check if an expired key is a device hash i.e device:{did}"""
+        return key.startswith("device:") and key.count(":") == 1 and key != "device:alias"
+
+    async def prune(self, devices: list[str]) -> int:
+        """
+        Prune the alias mappings of the given devices, that no longer exist.
+        Returns the number of devices pruned.
+        """
+        if not devices:
+            return 0
+
+        pruned: int = await get_lua_scripts().prune_aliases(args=devices, client=async_redis_client)
+        self.pruned += pruned
+
+        return pruned
+
+    async def sweep(self) -> int:
+        """
+        Scan the whole device:alias hash in batches and prune the devices that
+        no longer exist. Returns the number of devices pruned.
+        """
+        pruned: int = 0
+        cursor: int = 0
+
+        while True:
+            cursor, mapping = await async_redis_client.hscan(
+                self.device_alias, cursor=cursor, count=self.batch_size
+            )
+            pruned += await self.prune(list(mapping.keys()))
+
+            if not cursor:
+                break
+
+        logger.info(f"Alias reaper sweep pruned {pruned} device(s)")
+        return pruned
+
+    async def enable_expired_events(self) -> None:
+        """
+        Make redis publish keyspace 'expired' events. Managed redis services may
+        not allow CONFIG SET, in which case we rely on periodic sweeps only.
+        """
+        try:
+            await async_pubsub_client.config_set("notify-keyspace-events", "Ex")
+        except redis_exceptions.ResponseError:
+            logger.warning("Unable to enable keyspace events, relying on periodic sweeps")
+
+    async def run(self) -> None:
+        """
+        Prune expired devices in batches as their 'expired' events arrive, and
+        sweep the whole device:alias hash every interval.
+        """
+        await self.enable_expired_events()
+
+        db: int = async_pubsub_client.connection_pool.connection_kwargs.get("db", 0)
+        pubsub = async_pubsub_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(f"__keyevent@{db}__:expired")
+
+        expired: list[str] = []
+        next_sweep: float = time.monotonic()
+
+        try:
+            while True:
+                if time.monotonic() >= next_sweep:
+                    await self.sweep()
+                    next_sweep = time.monotonic() + self.interval
+
+                message = await pubsub.get_message(timeout=1.0)
+
+                if message and self.is_device(message["data"]):
+                    expired.append(message["data"])
+
+                # flush a full batch, or whatever arrived once events go quiet
+                if len(expired) >= self.batch_size or (expired and message is None):
+                    pruned = await self.prune(expired)
+                    logger.info(f"Alias reaper pruned {pruned} expired device(s)")
+                    expired = []
+
+        finally:
+            await pubsub.close()
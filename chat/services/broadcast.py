@@ -0,0 +1,50 @@
+import asyncio
+import zlib
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from chat.events import CHAT_EVENT_TYPES
+
+
+def broadcast_group(did: str) -> str:
+    """
+    Return the broadcast group shard of a device i.e broadcast.{shard}. Devices
+    are spread evenly over settings.BROADCAST["SHARDS"] groups by their did, so
+    no single channel layer group holds every connected device.
+    """
+    return f"broadcast.{zlib.crc32(str(did).encode()) % settings.BROADCAST['SHARDS']}"
+
+
+async def broadcast(message: str, channel_layer=None) -> int:
+    """
+    Send a message to every device that opted in to broadcasts, one group shard
+    at a time with a pause of settings.BROADCAST["PACE"] seconds in between.
+    So the fan-out is spread over time, instead of hitting every channel at
+    once. Returns the number of shards the message was sent to.
+
+    :param message: The broadcast message
+    :param channel_layer: The channel layer to send with. Default is the
+        default channel layer
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    shards: int = settings.BROADCAST["SHARDS"]
+
+    for shard in range(shards):
+        if shard:
+            await asyncio.sleep(settings.BROADCAST["PACE"])
+
+        await channel_layer.group_send(
+            f"broadcast.{shard}",
+            {
+                "type": "chat.message",
+                "data": {
+                    "event": CHAT_EVENT_TYPES.CHAT_BROADCAST.value,
+                    "status": True,
+                    "message": "broadcast",
+                    "data": {"message": message},
+                },
+            },
+        )
+
+    return shards
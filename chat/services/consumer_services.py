@@ -1,10 +1,14 @@
+import time
 import uuid
 
+from django.conf import settings
 from django.utils import timezone
 from django.utils.text import slugify
 
-from chat.lua_scripts import LuaScripts
-from src.utils import convert_array_to_dict, redis_client
+from chat.lua_scripts import get_lua_scripts
+from chat.services.route_cache import route_cache
+from src.utils import async_redis_client, convert_array_to_dict, group_key
+from src.wire import json_dumps, json_loads
 
 
 class ConsumerServices:
@@ -13,10 +17,13 @@ class ConsumerServices:
     """
 
     @staticmethod
-    def set_device_data(device: str, did: uuid.UUID, channel: str) -> None:
+    async def set_device_data(device: str, did: uuid.UUID, channel: str) -> dict:
         """
         Set/update device hash in redis store, also set an expire option to
-        the device hash in redis store using the ttl as value.
+        the device hash in redis store using the ttl as value. Then update the
+        'alias:device' redis hash and return the complete device data.
+
+        All of which is done in a single round trip, by calling a lua script.
 
         :param device: Unique device id
         :param did: Device uuid, from the connection subprotocols
@@ -24,64 +31,352 @@ class ConsumerServices:
         """
         ttl = timezone.now() + timezone.timedelta(minutes=30)
 
-        redis_client.hset(
-            name=device,
-            mapping={
-                "did": f"{did}",
-                "channel": f"{channel}",
-                "ttl": ttl.timestamp(),
-            },
+        return (
+            convert_array_to_dict(
+                await get_lua_scripts().connect_device(
+                    keys=[device],
+                    args=[f"{did}", f"{channel}", ttl.timestamp(), int(ttl.timestamp())],
+                    client=async_redis_client,
+                )
+            ),
+        )[0]
+
+    @staticmethod
+    async def resume_device(device: str, did: uuid.UUID, channel: str) -> dict | None:
+        """
+        Rebind a device that went offline less than settings.CHAT_RESUME["GRACE"]
+        seconds ago to it's new channel, keeping it's alias, groups & inbox. Done
+        in a single round trip, by calling a lua script.
+
+        Returns the alias, number of stored messages & groups of the device, or
+        None if it can't be resumed, in which case the device connects as usual.
+
+        :param device: Unique device id
+        :param did: Device uuid, from the connection subprotocols
+        :param channel: Channel given to the consumer on connect
+        """
+        ttl = timezone.now() + timezone.timedelta(minutes=30)
+
+        resumed: list = await get_lua_scripts().resume_device(
+            keys=[device],
+            args=[
+                f"{did}",
+                f"{channel}",
+                ttl.timestamp(),
+                int(ttl.timestamp()),
+                int(time.time()),
+                settings.CHAT_RESUME["GRACE"],
+            ],
+            client=async_redis_client,
         )
-        redis_client.expireat(device, ttl)
 
-        # call method to update the 'alias:device' redis hash
-        ConsumerServices.set_alias_device(device=device)
+        if not resumed[0]:
+            return None
+
+        return {"alias": resumed[1], "inbox": int(resumed[2]), "groups": list(resumed[3])}
 
     @staticmethod
-    def set_device_alias(
-        device: str,
-        alias: str,
-        device_alias: str = "device:alias",
-        alias_device: str = "alias:device",
-    ) -> None:
+    async def disconnect_device(device: str, channel: str, forget_alias: bool = False) -> dict:
         """
-        Add the device alias to device:alias & alias:device hashes in redis store.
+        Call lua script to remove the device channel & the alias:device entry
+        of a disconnected device, in a single round trip. Returns what was removed.
 
-        :param device: The name of the hash in redis that holds a particular device data
-        :param alias: The alias for the device.
-        :param device_alias: This holds the name of the redis hash. Default is 'device:alias'
-        :param alias_device: This holds the name of the redis hash. Default is 'alias:device'
+        Nothing is removed when the device already reconnected on another channel,
+        i.e a disconnect that arrives after the reconnect is ignored.
 
-        In redis store, update device data ttl value. And also set an expire
-        option to the device data in redis store using the ttl as the value.
-        """
-        redis_client.hset(device_alias, mapping={device: alias})
-        redis_client.hset(alias_device, mapping={alias: device})
+        Unless forgotten, the alias keeps pointing to the offline device for as long
+        as messages sent to it are stored, see store_message().
 
-        ttl = timezone.now() + timezone.timedelta(minutes=30)
+        :param device: The name of the hash in redis that holds a particular device data
+        :param channel: Channel of the disconnected consumer
+        :param forget_alias: Also remove the device:alias entry. Default is False
+        """
+        removed: list = await get_lua_scripts().disconnect_device(
+            keys=[device],
+            args=[int(forget_alias), settings.CHAT_INBOX["TTL"], int(time.time()), f"{channel}"],
+            client=async_redis_client,
+        )
 
-        redis_client.hset(device, mapping={"ttl": ttl.timestamp()})
-        redis_client.expireat(device, ttl)
+        return {
+            "channel": bool(removed[0]),
+            "alias": removed[1],
+            "alias_device": bool(removed[2]),
+            "device_alias": bool(removed[3]),
+        }
 
     @staticmethod
-    def get_device_data(device: str) -> dict:
+    async def get_device_data(device: str) -> dict:
         """Get and return device data, from redis store. By calling a lua script"""
         return (
             convert_array_to_dict(
-                LuaScripts.get_device_data(
+                await get_lua_scripts().get_device_data(
                     keys=[device],
-                    client=redis_client,
+                    client=async_redis_client,
                 )
             ),
         )[0]
 
     @staticmethod
-    def set_alias_device(device: str) -> int:
+    async def reserve_alias(device: str, alias: str) -> int:
+        """
+        Call lua script to atomically check and claim an alias for a device. In
+        the same round trip, the device expiry is extended and every worker drops
+        it's cached routes.
+
+        Returns 1 if the alias was claimed, 0 if it is already the device alias
+        and -1 if it already belongs to another device, online or offline.
+
+        :param device: The device claiming the alias
+        :param alias: The formated & validated alias to claim
+        """
+        ttl = timezone.now() + timezone.timedelta(minutes=30)
+
+        return await get_lua_scripts().reserve_alias(
+            keys=[device],
+            args=[alias, ttl.timestamp(), int(ttl.timestamp())],
+            client=async_redis_client,
+        )
+
+    @staticmethod
+    async def get_chat_route(alias: str) -> dict:
+        """
+        Resolve the device, channel & did of the recipient of a chat message.
+        Served from the process-local route cache when possible, else resolved
+        in a single round trip by calling a lua script.
+
+        :param alias: The recipient device alias
+        """
+        route: dict | None = route_cache.get(alias)
+
+        if route is None:
+            generation: int = route_cache.generation
+            device, channel, did = await get_lua_scripts().get_chat_route(
+                args=[alias], client=async_redis_client
+            )
+
+            route = {"device": device, "did": did, "channel": channel, "alias": alias}
+
+            # an alias not owned by any device can't be invalidated, so don't cache it
+            if device:
+                route_cache.set(alias, route, generation)
+
+        return route
+
+    @staticmethod
+    async def get_chat_routes(aliases: list[str]) -> dict[str, dict]:
+        """
+        Resolve the device, channel & did of every recipient of a multicast chat
+        message. Cached routes are served from the process-local route cache, and
+        the rest are resolved together in a single round trip by calling a lua
+        script. Returns the routes keyed by alias, in the order given.
+
+        :param aliases: The recipient device aliases
+        """
+        routes: dict[str, dict] = {}
+        missing: list[str] = []
+
+        for alias in aliases:
+            route: dict | None = route_cache.get(alias)
+
+            if route is None:
+                missing.append(alias)
+            else:
+                routes[alias] = route
+
+        if missing:
+            generation: int = route_cache.generation
+            resolved: list = await get_lua_scripts().get_chat_routes(
+                args=missing, client=async_redis_client
+            )
+
+            for index, alias in enumerate(missing):
+                device, channel, did = resolved[index * 3 : index * 3 + 3]
+                routes[alias] = {"device": device, "did": did, "channel": channel, "alias": alias}
+
+                # an alias not owned by any device can't be invalidated, so don't cache it
+                if device:
+                    route_cache.set(alias, routes[alias], generation)
+
+        return {alias: routes[alias] for alias in aliases}
+
+    @staticmethod
+    async def get_device_route(device: str) -> dict:
+        """
+        Get the channel, alias & did of a device. Served from the process-local
+        route cache when possible, else by calling a lua script.
+
+        :param device: The name of the hash in redis that holds a particular device data
+        """
+        route: dict | None = route_cache.get(device)
+
+        if route is None:
+            generation: int = route_cache.generation
+            channel, alias, did = await get_lua_scripts().get_device_route(
+                keys=[device], client=async_redis_client
+            )
+
+            route = {"device": device, "did": did, "channel": channel, "alias": alias}
+            route_cache.set(device, route, generation)
+
+        return route
+
+    @staticmethod
+    async def get_offline_device(alias: str) -> str | None:
+        """
+        Call lua script to return the device an alias belonged to when it went
+        offline, or None if the alias no longer belongs to any offline device.
+        """
+        return await get_lua_scripts().get_offline_device(args=[alias], client=async_redis_client)
+
+    @staticmethod
+    async def store_message(alias: str, data: dict, device: str | None = None) -> str | None:
+        """
+        Store a chat message sent to an offline device, in the capped inbox stream
+        of the device. Returns the stream entry id, or None if the alias does not
+        belong to the device, which is checked in the same round trip as it's stored.
+
+        :param alias: The recipient device alias
+        :param data: The chat event data, delivered as is once the device connects
+        :param device: The recipient device if known, else it's looked up from the
+            offline alias key
+        """
+        device = device or await ConsumerServices.get_offline_device(alias=alias)
+
+        if device is None:
+            return None
+
+        return await get_lua_scripts().store_message(
+            keys=[device, f"{device}:inbox"],
+            args=[
+                json_dumps(data),
+                settings.CHAT_INBOX["MAXLEN"],
+                settings.CHAT_INBOX["TTL"],
+                alias,
+            ],
+            client=async_redis_client,
+        )
+
+    @staticmethod
+    async def next_sequences(sender: str, devices: list[str]) -> list[int]:
         """
-        Call lua script to add the connected device and it's alias
-        to the 'alias:device' hash in redis store.
+        Call lua script to assign the next sequence number of the chats from a
+        sender to each recipient device, in one round trip. Sequence numbers are
+        per conversation, i.e a sender & recipient pair, and start at 1.
+
+        :param sender: The did of the sending device
+        :param devices: The recipient devices
         """
-        return LuaScripts.set_alias_device(keys=[device], client=redis_client)
+        if not devices:
+            return []
+
+        return await get_lua_scripts().next_sequences(
+            keys=[f"{device}:seq" for device in devices],
+            args=[sender, settings.CHAT_SEQUENCE["TTL"]],
+            client=async_redis_client,
+        )
+
+    @staticmethod
+    async def ack_sequence(device: str, sender: str, sequence: int) -> tuple[int, bool]:
+        """
+        Call lua script to acknowledge every chat a device received from a sender,
+        up to & including sequence. Returns the acknowledged sequence, and whether
+        it moved forward.
+
+        :param device: The acknowledging device
+        :param sender: The did of the sending device
+        :param sequence: Sequence number of the last chat received
+        """
+        acked, moved = await get_lua_scripts().ack_sequence(
+            keys=[f"{device}:seq"], args=[sender, sequence], client=async_redis_client
+        )
+
+        return acked, bool(moved)
+
+    @staticmethod
+    async def read_inbox(
+        device: str, count: int, after: str | None = None
+    ) -> list[tuple[str, dict]]:
+        """
+        Return the oldest messages in the inbox of a device, as (id, data) pairs.
+
+        :param device: The name of the hash in redis that holds a particular device data
+        :param count: Maximum number of messages returned
+        :param after: Only return messages after this id. Default is None, from the start
+        """
+        entries: list = await async_redis_client.xrange(
+            f"{device}:inbox", min=f"({after}" if after else "-", count=count
+        )
+
+        return [(entry_id, json_loads(fields["data"])) for entry_id, fields in entries]
+
+    @staticmethod
+    async def ack_inbox(device: str, cursor: str) -> int:
+        """
+        Remove every message up to & including cursor from the inbox of a device,
+        once the device acknowledged them. Returns the number of messages removed.
+
+        :param device: The name of the hash in redis that holds a particular device data
+        :param cursor: Id of the last acknowledged message
+        """
+        timestamp, sequence = cursor.split("-")
+
+        return await async_redis_client.xtrim(
+            f"{device}:inbox", minid=f"{timestamp}-{int(sequence) + 1}", approximate=False
+        )
+
+    @staticmethod
+    async def join_group(device: str, device_groups: str, group: str) -> int:
+        """
+        Call lua script to add a device to a chat group, bounded by the maximum
+        number of members in settings.
+
+        Returns 1 if the device joined, 0 if it is already a member and -1 if
+        the group is full.
+
+        :param device: The device joining the group
+        :param device_groups: The redis set that holds the device groups
+        :param group: The formated & validated group name
+        """
+        return await get_lua_scripts().join_group(
+            keys=[group_key(group), device_groups],
+            args=[device, group, settings.CHAT_GROUP["MAX_MEMBERS"]],
+            client=async_redis_client,
+        )
+
+    @staticmethod
+    async def leave_group(device: str, device_groups: str, group: str) -> int:
+        """
+        Call lua script to remove a device from a chat group. Returns 1 if the
+        device left, and 0 if it was not a member.
+
+        :param device: The device leaving the group
+        :param device_groups: The redis set that holds the device groups
+        :param group: The formated & validated group name
+        """
+        return await get_lua_scripts().leave_group(
+            keys=[group_key(group), device_groups],
+            args=[device, group],
+            client=async_redis_client,
+        )
+
+    @staticmethod
+    def format_and_validate_group(group: str) -> tuple[str, str, bool]:
+        """
+        Converts spaces and hyphens to underscores then validates a chat
+        group name.
+
+        :param group: The value to format then validate.
+        """
+        group: str = slugify(str(group).lower()).replace("-", "_")
+
+        message: str = "Group name formated successfully"
+        status: bool = True
+
+        if len(group) < 3 or len(group) > 30:
+            status = False
+            message = "Group name must be between 3 to 30 characters long"
+
+        return message, group, status
 
     @staticmethod
     def format_and_validate_alias(alias: str) -> tuple[str, str, bool]:
@@ -112,15 +407,17 @@ class ConsumerServices:
         return message, alias, status
 
     @staticmethod
-    def format_and_verify_alias(device: str, alias: str) -> tuple[str, str, bool]:
+    async def format_and_verify_alias(device: str, alias: str) -> tuple[str, str, bool]:
         """
         Appends the word ".linq" to alias.
 
         Check if the alias already belongs to another device or is already the
-        alias of the device trying to set it's alias in the redis store.
+        alias of the device trying to set it's alias in the redis store. If it
+        does not, the alias is claimed for the device in the same atomic step.
 
-        Alias are stored in redis as hash, with name "device:alias" using
-        'device' as key and 'alias' as value.
+        Alias are stored in redis as hashes, with name "device:alias" using
+        'device' as key and 'alias' as value, and "alias:device" using 'alias'
+        as key and 'device' as value.
 
         :param device: Device used as the key.
         :param alias: The new device alias to set, used as the value.
@@ -128,17 +425,18 @@ class ConsumerServices:
         message, alias, status = ConsumerServices.format_and_validate_alias(alias)
 
         if status:
-            device_alias: str = "device:alias"
             alias: str = f"{alias}.linq"
 
             message = "Alias accepted"
             status = True
 
-            if alias == redis_client.hget(device_alias, key=device):
+            reserved: int = await ConsumerServices.reserve_alias(device=device, alias=alias)
+
+            if reserved == 0:
                 status = False
                 message = f"{alias} is already your device alias"
 
-            elif alias in redis_client.hvals(device_alias):
+            elif reserved == -1:
                 status = False
                 message = "Alias already taken"
 
@@ -0,0 +1,53 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from chat.lua_scripts import get_lua_scripts
+from src.utils import async_redis_client, rate_limit_key
+
+
+class RateLimiter:
+    """
+    Token bucket rate limits of inbound frames, by event type. Every frame takes
+    a token from the bucket of it's device and from the bucket of it's client IP,
+    in a single round trip, and is refused when either bucket is empty.
+
+    Limits are configured per event type in settings.RATE_LIMITS.
+    """
+
+    def __init__(self):
+        self.limited: Counter[str] = Counter()
+
+    @property
+    def stats(self) -> dict:
+        return {"limited": dict(self.limited)}
+
+    async def hit(self, event: str, identities: list[str]) -> float:
+        """
+        Take a token for a frame of event, from the bucket of every identity.
+        Returns 0 when the frame is allowed, else the number of seconds until
+        it would be.
+
+        :param event: The event type of the frame
+        :param identities: The device & client IP of the frame e.g ["device:{did}", "ip:{ip}"]
+        """
+        limit: dict | None = settings.RATE_LIMITS.get(event)
+
+        if limit is None or not identities:
+            return 0
+
+        allowed, retry_after = await get_lua_scripts().rate_limit(
+            keys=[rate_limit_key(event, identity) for identity in identities],
+            args=[limit["CAPACITY"], limit["RATE"], int(time.time() * 1000), 1],
+            client=async_redis_client,
+        )
+
+        if allowed:
+            return 0
+
+        self.limited[event] += 1
+        return int(retry_after) / 1000
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from redis import exceptions as redis_exceptions
+
+from src.utils import async_pubsub_client
+
+logger = logging.getLogger(__name__)
+
+ROUTE_INVALIDATION_CHANNEL = "routes:invalidate"
+"""
+Redis pub/sub channel the lua scripts & services publish a device to, whenever
+it's channel or alias changes.
+"""
+
+
+class RouteCache:
+    """
+    Process-local LRU cache with a TTL, that sits in front of the alias:device
+    and device:{did} lookups used to route messages.
+
+    Keys are either a device alias or a device, and values are the route of
+    the device they belong to. i.e {"device", "did", "channel", "alias"}.
+
+    The cache only serves entries while it is subscribed to the route
+    invalidation channel, so that a change made by another worker can never
+    be missed. Entries are dropped by device, when the device is published to
+    the invalidation channel.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0):
+        """
+        :param maxsize: Maximum number of entries kept in the cache.
+        :param ttl: Number of seconds an entry is served before it expires.
+        """
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.listening: bool = False
+        self.generation: int = 0
+
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._keys_by_device: dict[str, set[str]] = {}
+        self._listener: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+    def get(self, key: str) -> dict | None:
+        """
+        Return the cached route for key, or None if the key is not cached,
+        has expired or the cache is not listening for invalidations.
+        """
+        entry = self._entries.get(key) if self.listening else None
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._discard(key)
+
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, route: dict, generation: int | None = None) -> None:
+        """
+        Cache the route of a device under key, evicting the least recently
+        used entries when the cache is full.
+
+        :param key: Device alias or device.
+        :param route: Route of the device, must contain the 'device' key.
+        :param generation: Value of self.generation before the route was read
+            from redis. The route is not cached if an invalidation was received
+            since then, as it may already be stale.
+        """
+        if not self.listening or generation not in (None, self.generation):
+            return
+
+        self._discard(key)
+        self._entries[key] = (time.monotonic() + self.ttl, route)
+        self._keys_by_device.setdefault(route["device"], set()).add(key)
+
+        while len(self._entries) > self.maxsize:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate(self, device: str) -> int:
+        """
+        Drop every cached entry that belongs to device. Returns the number of
+        entries dropped.
+        """
+        self.generation += 1
+        keys = self._keys_by_device.pop(device, set())
+
+        for key in keys:
+            self._entries.pop(key, None)
+
+        return len(keys)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self._keys_by_device.clear()
+
+    def start(self) -> None:
+        """
+        Start listening for route invalidations in the running event loop,
+        if enabled in settings and not already listening.
+        """
+        if not settings.ROUTE_CACHE["ENABLED"]:
+            return
+
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self.listen())
+
+    async def listen(self) -> None:
+        """
+        Subscribe to the route invalidation channel and drop the entries of
+        every published device. Reconnects when the connection is lost.
+        """
+        while True:
+            pubsub = async_pubsub_client.pubsub(ignore_subscribe_messages=True)
+
+            try:
+                await pubsub.subscribe(ROUTE_INVALIDATION_CHANNEL)
+
+                # anything cached before subscribing may already be stale
+                self.clear()
+                self.listening = True
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.invalidate(message["data"])
+
+            except (redis_exceptions.ConnectionError, redis_exceptions.TimeoutError):
+                logger.warning("Route cache lost it's redis connection, reconnecting")
+
+            finally:
+                self.listening = False
+                self.clear()
+                await pubsub.close()
+
+            await asyncio.sleep(1)
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            keys = self._keys_by_device.get(entry[1]["device"], set())
+            keys.discard(key)
+
+            if not keys:
+                self._keys_by_device.pop(entry[1]["device"], None)
+
+
+route_cache = RouteCache(
+    maxsize=settings.ROUTE_CACHE["MAXSIZE"],
+    ttl=settings.ROUTE_CACHE["TTL"],
+)
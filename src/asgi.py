@@ -15,17 +15,20 @@ from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
 import src.routers
+from chat.middleware import LuaScriptsMiddleware
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "src.settings")
 
 django_asgi_app = get_asgi_application()
 
 
-application = ProtocolTypeRouter(
-    {
-        "http": django_asgi_app,
-        "websocket": AllowedHostsOriginValidator(
-            URLRouter(src.routers.websocket_urlpatterns),
-        ),
-    }
+application = LuaScriptsMiddleware(
+    ProtocolTypeRouter(
+        {
+            "http": django_asgi_app,
+            "websocket": AllowedHostsOriginValidator(
+                URLRouter(src.routers.websocket_urlpatterns),
+            ),
+        }
+    )
 )
@@ -35,6 +35,8 @@ SECURE_HSTS_INCLUDE_SUBDOMAINS = os.environ.get("SECURE_HSTS_INCLUDE_SUBDOMAINS"
 REDIS_SERVER = os.environ.get("REDIS_SERVER", "localhost")
 REDIS_PORT = os.environ.get("REDIS_PORT", 6379)
 CHANNEL_LAYER_BACKEND = os.environ.get("CHANNEL_LAYER_BACKEND")
+REDIS_KEY_LAYOUT = os.environ.get("REDIS_KEY_LAYOUT", "hash")
+REDIS_CLUSTER = os.environ.get("REDIS_CLUSTER", "false").lower() in ("true", "1")
 
 
 # CodeCov
@@ -0,0 +1,378 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+import msgpack
+import redis.asyncio as aioredis
+from channels.layers import BaseChannelLayer
+from django.conf import settings
+from redis import exceptions as redis_exceptions
+
+logger = logging.getLogger(__name__)
+
+
+class PubSubChannelLayer(BaseChannelLayer):
+    """
+    Channel layer that routes events over redis pub/sub, straight to the
+    worker that owns the receiving channel.
+
+    Every worker (i.e layer instance) subscribes once to it's own inbox, and
+    channel names embed the worker they live on, i.e {prefix}.{worker}!{id}.
+    So a send is a single PUBLISH to the inbox of the receiving worker, which
+    hands the event to the in-process queue of the channel. There is no per
+    channel list to BLPOP from & expire, as with channels_redis.
+
+    Groups are redis sorted sets of channel names, scored by the time they were
+    added. A group send reads the live members once, and publishes a single
+    message per worker with all it's channels, which the worker fans out
+    in-process. Members on this worker skip redis altogether.
+
+    Delivery is at most once, an event sent while the receiving worker is not
+    subscribed (e.g reconnecting to redis) is lost, like any pub/sub message.
+    Only process-specific channels, from new_channel(), can be sent to.
+
+    Variables names
+
+    worker: id of the worker, picked at random on init
+    inbox: pub/sub channel of the worker
+    published: number of messages published to other workers
+    delivered: number of events handed to a channel of this worker
+    dropped: number of events dropped, as their channel was full or gone
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        hosts: list | None = None,
+        prefix: str = "asgi",
+        expiry: int = 60,
+        group_expiry: int = 86400,
+        capacity: int = 100,
+        channel_capacity: dict | None = None,
+        cluster: bool | None = None,
+        subscribe_timeout: float = 5,
+    ):
+        """
+        :param hosts: Redis (host, port) tuples, only the first one is used.
+        :param prefix: Prefix of channel names, group keys & worker inboxes.
+        :param group_expiry: Number of seconds a channel stays in a group.
+        :param capacity: Number of events queued per channel before dropping.
+        :param cluster: True if hosts is a node of a redis cluster. Default is
+            settings.REDIS_CLUSTER
+        :param subscribe_timeout: Number of seconds new_channel() waits for the
+            worker to be subscribed to it's inbox, before failing.
+        """
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+
+        self.host: tuple = tuple((hosts or [("localhost", 6379)])[0])
+        self.prefix: str = prefix
+        self.group_expiry: int = group_expiry
+        self.subscribe_timeout: float = subscribe_timeout
+        self.cluster: bool = settings.REDIS_CLUSTER if cluster is None else cluster
+
+        self.worker: str = uuid.uuid4().hex
+        self.inbox: str = f"{prefix}:inbox:{self.worker}"
+
+        self.published: int = 0
+        self.delivered: int = 0
+        self.dropped: int = 0
+
+        self.client = None
+        self.pubsub_client = None
+        self.channels: dict[str, asyncio.Queue] = {}
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._listener: asyncio.Task | None = None
+        self._pubsub = None
+        self._subscribed: asyncio.Event | None = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "channels": len(self.channels),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+    def create_clients(self) -> tuple:
+        """
+        Return the redis clients of the running event loop, one for group
+        commands & one for pub/sub. The async cluster client has no pub/sub
+        support, but a message published on any node of a cluster reaches the
+        subscribers of every node, so a plain client to hosts is enough.
+        """
+        host, port = self.host
+        pubsub_client = aioredis.Redis(host=host, port=port)
+
+        if self.cluster:
+            return aioredis.RedisCluster(host=host, port=port), pubsub_client
+
+        return pubsub_client, pubsub_client
+
+    # Channels
+
+    async def new_channel(self, prefix: str = "specific") -> str:
+        """
+        Return a new channel on this worker, whose events are queued from now
+        on. The worker is subscribed to it's inbox before the channel is
+        returned, so an event sent to it right away can't be missed. Raises
+        redis ConnectionError if it is not subscribed within subscribe_timeout
+        seconds, e.g while redis is down.
+        """
+        await self.start()
+
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=self.subscribe_timeout)
+        except asyncio.TimeoutError:
+            raise redis_exceptions.ConnectionError(
+                "Channel layer is not subscribed to it's redis inbox "
+                f"after {self.subscribe_timeout} second(s)"
+            ) from None
+
+        channel = f"{self.prefix}.{self.worker}!{uuid.uuid4().hex}"
+        self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+
+        return channel
+
+    async def send(self, channel: str, message: dict) -> None:
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        await self.start()
+        await self.publish(self.worker_of(channel), [channel], message)
+
+    async def receive(self, channel: str) -> dict:
+        """
+        Return the next event of a channel of this worker. The channel is
+        forgotten when the receive is cancelled, i.e when it's consumer exits.
+        """
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        await self.start()
+
+        if channel not in self.channels:
+            self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+
+        queue = self.channels[channel]
+
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            self.channels.pop(channel, None)
+            raise
+
+    async def send_many(self, messages: list[tuple[str, dict]]) -> None:
+        """
+        Send each message to it's channel. Channels of this worker get their
+        message in-process, and the rest are published in a single pipeline,
+        i.e one round trip to redis.
+
+        :param messages: List of (channel, message) pairs
+        """
+        await self.start()
+        published: list[tuple[str, bytes]] = []
+
+        for channel, message in messages:
+            assert isinstance(message, dict), "message is not a dict"
+            assert self.valid_channel_name(channel), "Channel name not valid"
+
+            worker: str = self.worker_of(channel)
+            data: bytes = msgpack.packb({"channels": [channel], "message": message})
+
+            if worker == self.worker:
+                self.dispatch(**msgpack.unpackb(data))
+            else:
+                published.append((f"{self.prefix}:inbox:{worker}", data))
+
+        if not published:
+            return
+
+        async with self.pubsub_client.pipeline(transaction=False) as pipe:
+            for inbox, data in published:
+                pipe.publish(inbox, data)
+
+            await pipe.execute()
+
+        self.published += len(published)
+
+    def worker_of(self, channel: str) -> str:
+        """Return the worker of a process-specific channel."""
+        if "!" not in channel or not channel.startswith(f"{self.prefix}."):
+            raise ValueError(f"{channel!r} is not a channel of {self.__class__.__name__}")
+
+        return channel[len(self.prefix) + 1 : channel.index("!")]
+
+    async def publish(self, worker: str, channels: list[str], message: dict) -> None:
+        """
+        Hand message to channels of worker. Channels of this worker get it
+        in-process, others with a single PUBLISH to the inbox of their worker.
+        """
+        data: bytes = msgpack.packb({"channels": channels, "message": message})
+
+        # packed either way, so local channels get a copy of message, with the
+        # same types as a message from another worker
+        if worker == self.worker:
+            return self.dispatch(**msgpack.unpackb(data))
+
+        await self.pubsub_client.publish(f"{self.prefix}:inbox:{worker}", data)
+        self.published += 1
+
+    def dispatch(self, channels: list[str], message: dict) -> None:
+        """Put message in the queue of each channel of this worker."""
+        for channel in channels:
+            queue = self.channels.get(channel)
+
+            if queue is None or queue.full():
+                self.dropped += 1
+                continue
+
+            queue.put_nowait(message)
+            self.delivered += 1
+
+    # Groups
+
+    def group_key(self, group: str) -> str:
+        return f"{self.prefix}:group:{group}"
+
+    async def group_add(self, group: str, channel: str) -> None:
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        await self.start()
+        key = self.group_key(group)
+
+        await self.client.zremrangebyscore(key, 0, time.time() - self.group_expiry)
+        await self.client.zadd(key, {channel: time.time()})
+        await self.client.expire(key, self.group_expiry)
+
+    async def group_discard(self, group: str, channel: str) -> None:
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        await self.start()
+        await self.client.zrem(self.group_key(group), channel)
+
+    async def group_send(self, group: str, message: dict) -> None:
+        """
+        Send message to every live channel of group, with a single publish per
+        worker the channels live on.
+        """
+        assert self.valid_group_name(group), "Group name not valid"
+
+        await self.start()
+        members: list = await self.client.zrangebyscore(
+            self.group_key(group), time.time() - self.group_expiry, "+inf"
+        )
+
+        workers: dict[str, list[str]] = defaultdict(list)
+
+        for member in members:
+            channel = member.decode() if isinstance(member, bytes) else member
+            workers[self.worker_of(channel)].append(channel)
+
+        await asyncio.gather(
+            *(self.publish(worker, channels, message) for worker, channels in workers.items())
+        )
+
+    # Flush extension
+
+    async def flush(self) -> None:
+        """Drop every queued event and delete every group of the prefix."""
+        await self.start()
+
+        for queue in self.channels.values():
+            while not queue.empty():
+                queue.get_nowait()
+
+        async for key in self.client.scan_iter(match=f"{self.prefix}:group:*"):
+            await self.client.delete(key)
+
+    # Inbox
+
+    async def start(self) -> None:
+        """
+        Connect to redis & start listening to the inbox of this worker in the
+        running event loop, if not already listening. Queues & clients are
+        bound to the event loop they were created in, so they are dropped when
+        the layer is used from another one.
+        """
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop:
+            self._loop = loop
+            self.channels = {}
+            self.client, self.pubsub_client = self.create_clients()
+            self._subscribed = asyncio.Event()
+            self._listener = None
+
+        if self._listener is None or self._listener.done():
+            self._listener = loop.create_task(self.listen())
+
+    async def listen(self) -> None:
+        """
+        Subscribe to the inbox of this worker and dispatch every message it
+        receives. Reconnects when the connection is lost, and a message that
+        can't be dispatched is logged & dropped, so the worker keeps receiving.
+        """
+        while self.pubsub_client is not None:
+            pubsub = self._pubsub = self.pubsub_client.pubsub(ignore_subscribe_messages=True)
+
+            try:
+                await pubsub.subscribe(self.inbox)
+                self._subscribed.set()
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.receive_message(message["data"])
+
+            except (redis_exceptions.ConnectionError, redis_exceptions.TimeoutError):
+                logger.warning("Channel layer lost it's redis connection, reconnecting")
+
+            except Exception:
+                logger.exception("Channel layer inbox listener failed, reconnecting")
+
+            finally:
+                self._subscribed.clear()
+                await pubsub.close()
+
+            if self.pubsub_client is not None:
+                await asyncio.sleep(1)
+
+    def receive_message(self, data: bytes) -> None:
+        """Dispatch a message of the inbox, dropping it if it can't be decoded."""
+        try:
+            self.dispatch(**msgpack.unpackb(data))
+        except Exception:
+            self.dropped += 1
+            logger.exception("Channel layer dropped a message of it's inbox")
+
+    async def close(self) -> None:
+        """
+        Stop listening to the inbox of this worker and drop every channel. The
+        listener is stopped by unsubscribing rather than cancelling it, as a
+        cancelled pub/sub read of redis-py leaves it's shielded task behind.
+        """
+        if self.client is None:
+            return
+
+        client, pubsub_client, listener = self.client, self.pubsub_client, self._listener
+        self.client = self.pubsub_client = None
+
+        if listener is not None and not listener.done():
+            if self._subscribed.is_set():
+                await self._pubsub.unsubscribe()
+            else:
+                listener.cancel()
+
+            await asyncio.gather(listener, return_exceptions=True)
+
+        await client.close()
+        await pubsub_client.close()
+
+        self._listener = None
+        self._loop = None
+        self.channels = {}
@@ -0,0 +1,48 @@
+from collections import Counter
+
+
+class OutboundMetrics:
+    """
+    Process-local counters of outbound websocket frames, shared by every
+    connection of the worker.
+    """
+
+    def __init__(self):
+        self.batches: int = 0
+        self.batched_events: int = 0
+        self.batch_sizes: Counter[int] = Counter()
+        self.max_queue_depth: int = 0
+        self.policies: Counter[str] = Counter()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "batched_events": self.batched_events,
+            "average_batch_size": self.batched_events / self.batches if self.batches else 0,
+            "max_batch_size": max(self.batch_sizes, default=0),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "max_queue_depth": self.max_queue_depth,
+            "policies": dict(self.policies),
+        }
+
+    def record_batch(self, size: int) -> None:
+        """Count a coalesced frame of size events."""
+        self.batches += 1
+        self.batched_events += size
+        self.batch_sizes[size] += 1
+
+    def record_depth(self, depth: int) -> None:
+        """Track the deepest outbound queue of any connection."""
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def record_policy(self, policy: str) -> None:
+        """Count a backpressure policy applied to a full outbound queue."""
+        self.policies[policy] += 1
+
+    def reset(self) -> None:
+        self.__init__()
+
+
+outbound_metrics = OutboundMetrics()
@@ -0,0 +1,49 @@
+class LocalConsumers:
+    """
+    In-process registry of the live consumers of this worker, by channel name.
+
+    Events sent to the channel of a local consumer are handed straight to it's
+    local inbox, instead of making a round trip through the channel layer, and
+    are dispatched along with it's websocket & channel layer messages. Events
+    to any other channel are left to the channel layer.
+    """
+
+    def __init__(self):
+        self.consumers: dict[str, object] = {}
+
+        self.local: int = 0
+        self.remote: int = 0
+
+    def __len__(self) -> int:
+        return len(self.consumers)
+
+    @property
+    def stats(self) -> dict:
+        return {"consumers": len(self), "local": self.local, "remote": self.remote}
+
+    def register(self, consumer) -> None:
+        self.consumers[consumer.channel_name] = consumer
+
+    def unregister(self, consumer) -> None:
+        if self.consumers.get(consumer.channel_name) is consumer:
+            del self.consumers[consumer.channel_name]
+
+    def deliver(self, channel: str, message: dict) -> bool:
+        """
+        Hand a message to the local consumer of channel. Returns False if the
+        channel has no local consumer, and the message must be sent through the
+        channel layer.
+        """
+        consumer = self.consumers.get(channel)
+
+        if consumer is None:
+            self.remote += 1
+            return False
+
+        consumer.local_inbox.put_nowait(message)
+        self.local += 1
+
+        return True
+
+
+local_consumers = LocalConsumers()
@@ -118,7 +118,12 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# Channels
+# Channels. BACKEND is either "channels_redis.core.RedisChannelLayer", or
+# "src.layers.PubSubChannelLayer" to route events over redis pub/sub straight to
+# the worker of the receiving channel. Only the latter batches the sends of a
+# multicast into a single pipeline, channels_redis has no send_many, so they are
+# sent concurrently, one redis call each. Compare them with the
+# benchmark_channel_layers command.
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": env.CHANNEL_LAYER_BACKEND,
@@ -127,3 +132,112 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Redis key layout used to store device aliases. Either "hash", for the global
+# device:alias & alias:device hashes, or "keys", for one alias:{alias} key per
+# alias that expires along with the device.
+REDIS_KEY_LAYOUT = env.REDIS_KEY_LAYOUT
+
+# Redis Cluster mode. Keys are hash tagged so that every lua script only touches
+# keys of a single slot, which the global alias hashes can't do, so the "keys"
+# layout is always used in cluster mode.
+REDIS_CLUSTER = env.REDIS_CLUSTER
+
+if REDIS_CLUSTER:
+    REDIS_KEY_LAYOUT = "keys"
+
+# Process-local cache of device routes, invalidated through redis pub/sub.
+# TTL is in seconds.
+ROUTE_CACHE = {
+    "ENABLED": True,
+    "MAXSIZE": 10_000,
+    "TTL": 30,
+}
+
+# Maximum number of recipient aliases in a single multicast chat message
+CHAT_MAX_RECIPIENTS = 50
+
+# Named group chats. MAX_MEMBERS bounds the number of devices in a group.
+CHAT_GROUP = {
+    "MAX_MEMBERS": 100,
+}
+
+# Store-and-forward of chat messages sent to offline devices. Each device keeps
+# at most MAXLEN undelivered messages for TTL seconds, delivered on connect in
+# frames of BATCH_SIZE messages.
+CHAT_INBOX = {
+    "MAXLEN": 1000,
+    "TTL": 7 * 24 * 60 * 60,
+    "BATCH_SIZE": 50,
+}
+
+# Fast reconnects. On connect a device is given a signed resume token, valid for
+# MAX_AGE seconds. Reconnecting with it within GRACE seconds of going offline
+# rebinds the device to it's new channel, skipping the full handshake.
+CHAT_RESUME = {
+    "GRACE": 120,
+    "MAX_AGE": 24 * 60 * 60,
+}
+
+# Wire codecs a websocket client can request by name, at index 1 in subprotocols.
+# The accept echoes the requested codec, and connections requesting a codec that is
+# not listed, or whose package is not installed, are closed. Text frames are always
+# decoded with the 'json' codec.
+WIRE_CODECS = [
+    "src.wire.JSONCodec",
+    "src.wire.MessagePackCodec",
+    "src.wire.CBORCodec",
+]
+
+# Outbound write coalescing, opted in by a client with a 'batch' entry in subprotocols.
+# Channel layer events arriving within WINDOW seconds, or up to MAX_SIZE of them, are
+# sent together as a single array frame.
+WEBSOCKET_BATCH = {
+    "WINDOW": 0.01,
+    "MAX_SIZE": 50,
+}
+
+# Bounded outbound queue of every connection. Chats are held back in the queue while
+# MAX_UNACKED of them are not acknowledged by the client, with chat.ack frames (None
+# disables it). Once a slow client lets MAX_SIZE channel layer events pile up, POLICY
+# is applied to the next one: 'drop-oldest' or 'drop-newest' event, or 'close' the
+# connection with CLOSE_CODE.
+WEBSOCKET_OUTBOUND = {
+    "MAX_UNACKED": 128,
+    "MAX_SIZE": 256,
+    "POLICY": "drop-oldest",
+    "CLOSE_CODE": 4008,
+}
+
+# Token bucket rate limits of inbound frames, by event type. Each device and each
+# client IP gets a bucket of CAPACITY tokens per event type, refilled at RATE tokens
+# per second, and every frame takes one token. Events without limits are not limited.
+RATE_LIMITS = {
+    "device.setup": {"CAPACITY": 5, "RATE": 0.2},
+    "scan.connect": {"CAPACITY": 5, "RATE": 0.2},
+    "scan.setup": {"CAPACITY": 5, "RATE": 0.2},
+    "chat.message": {"CAPACITY": 30, "RATE": 5},
+    "chat.group": {"CAPACITY": 30, "RATE": 5},
+    "chat.ack": {"CAPACITY": 60, "RATE": 10},
+}
+
+# Broadcasts, to devices that opted in with a 'broadcast' entry in subprotocols. Devices
+# are spread over SHARDS channel layer groups, and a broadcast is sent to one shard at
+# a time, PACE seconds apart.
+BROADCAST = {
+    "SHARDS": 16,
+    "PACE": 0.05,
+}
+
+# Per conversation chat sequence numbers, and their acknowledgements.
+# TTL is the number of seconds sequences of an idle conversation are kept.
+CHAT_SEQUENCE = {
+    "TTL": 30 * 24 * 60 * 60,
+}
+
+# Background pruning of alias mappings left behind by expired devices.
+# INTERVAL is the number of seconds between full sweeps.
+ALIAS_REAPER = {
+    "INTERVAL": 300,
+    "BATCH_SIZE": 500,
+}
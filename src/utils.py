@@ -1,11 +1,99 @@
+import asyncio
+import functools
+import re
 import uuid
+from collections import deque
 
-import redis
+import redis.asyncio as aioredis
+from channels.exceptions import StopConsumer
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.utils import await_many_dispatch
+from django.conf import settings
 
 from src import env
+from src.outbound import outbound_metrics
+from src.registry import local_consumers
+from src.wire import Codec, DecodeError, Envelope, JSONCodec, get_codec
 
-redis_client = redis.Redis(host=env.REDIS_SERVER, port=env.REDIS_PORT, decode_responses=True)
+# Clients are picked from settings.REDIS_CLUSTER, the same flag the key helpers
+# below read, so keys are only hash tagged when sent to a cluster. The async
+# cluster client discovers the cluster on it's first command, not at import.
+if settings.REDIS_CLUSTER:
+    async_redis_client = aioredis.RedisCluster(
+        host=env.REDIS_SERVER, port=env.REDIS_PORT, decode_responses=True
+    )
+
+    # The async cluster client has no pub/sub support. A message published on
+    # any node of a cluster reaches the subscribers of every node, so a plain
+    # client to the configured node is enough.
+    async_pubsub_client = aioredis.Redis(
+        host=env.REDIS_SERVER, port=env.REDIS_PORT, decode_responses=True
+    )
+
+else:
+    # Non-blocking redis client for consumers & services. Every coroutine awaiting
+    # it shares the same connection pool, so a slow round trip only suspends the
+    # awaiting consumer instead of the whole event loop.
+    async_redis_pool = aioredis.ConnectionPool(
+        host=env.REDIS_SERVER, port=env.REDIS_PORT, decode_responses=True
+    )
+    async_redis_client = aioredis.Redis(connection_pool=async_redis_pool)
+    async_pubsub_client = async_redis_client
+
+
+def device_key(did: uuid.UUID | str) -> str:
+    """
+    Return the redis key of a device hash i.e device:{did}. In cluster mode the
+    did is a hash tag, so the device hash and it's groups set share a slot.
+    """
+    if settings.REDIS_CLUSTER:
+        return f"device:{{{did}}}"
+
+    return f"device:{did}"
+
+
+def alias_key(alias: str) -> str:
+    """
+    Return the redis key of an alias, with the 'keys' layout i.e alias:{alias}.
+    In cluster mode the alias is a hash tag.
+    """
+    if settings.REDIS_CLUSTER:
+        return f"alias:{{{alias}}}"
+
+    return f"alias:{alias}"
+
+
+def offline_alias_key(alias: str) -> str:
+    """
+    Return the redis key that points an alias to it's offline device, for as long
+    as messages to the alias are stored i.e alias:{alias}:offline. It shares the
+    slot of the alias key in cluster mode.
+    """
+    return f"{alias_key(alias)}:offline"
+
+
+def group_key(group: str) -> str:
+    """
+    Return the redis key of a chat group members set i.e group:{group}.
+    In cluster mode the group name is a hash tag.
+    """
+    if settings.REDIS_CLUSTER:
+        return f"group:{{{group}}}"
+
+    return f"group:{group}"
+
+
+def rate_limit_key(event: str, identity: str) -> str:
+    """
+    Return the redis key of a rate limit token bucket i.e ratelimit:{event}:{identity},
+    where identity is a device or a client IP. In cluster mode the identity is a
+    hash tag.
+    """
+    if settings.REDIS_CLUSTER:
+        return f"ratelimit:{event}:{{{identity}}}"
+
+    return f"ratelimit:{event}:{identity}"
 
 
 class BaseAsyncJsonWebsocketConsumer(AsyncJsonWebsocketConsumer):
@@ -17,25 +105,411 @@ class BaseAsyncJsonWebsocketConsumer(AsyncJsonWebsocketConsumer):
 
     groups: list of groups
     did: device id. Default is None
-    device: redis key for a consumer's data. Default is None
+    alias: device alias, kept for the lifetime of the connection. Default is None
+    device: redis key for a consumer's data, see device_key(). Default is None
     device_groups: redis key for a consumer groups data. Default is None
     device_alias: redis hash to store all connected device aliases.
             Where key is device:did and value is alias. Hash name is device:alias"
     alias_device: redis hash to store all connected device aliases.
             Where key is alias and value is device:did. Hash name is alias:device"
+    codec: wire codec of the connection, requested at index 1 in subprotocols.
+            Default is JSON, see src.wire.get_codec()
+    codec_subprotocol: the subprotocol at index 1 requesting the codec, echoed in
+            the accept once it's selected, see codec_refused. Default is None
+    subprotocol_options: subprotocols that opt in to a feature, so at index 1 they
+            don't request a codec
+    receive_event: event of the error responses to frames that can't be parsed
+    required_keys: keys every inbound frame must have, see required_keys_for()
+    batching: True if the client opted in to coalesced channel layer events,
+            with a 'batch' entry in subprotocols, see send_event()
+    rate_limiter: rate limits inbound frames by event type when set, see receive().
+            Default is None
+
+    Live consumers are registered in the in-process registry, see
+    src.registry.LocalConsumers, so events from consumers of the same worker
+    skip the channel layer.
+
+    Channel layer events are sent from a bounded outbound queue, by a writer
+    task of the connection. So a slow client can't hold up the consumer, and
+    settings.WEBSOCKET_OUTBOUND["POLICY"] is applied once it's queue is full.
+    Events the client must acknowledge, see awaited_ack(), are held back in the
+    queue while settings.WEBSOCKET_OUTBOUND["MAX_UNACKED"] of them are not yet
+    acknowledged. So the queue fills up for a client that stops reading, even
+    when the server can still write to it's socket.
     """
 
-    groups = ["broadcast"]
+    groups = []
 
     did: uuid.UUID | None = None
+    alias: str | None = None
     device: str | None = None
     device_groups: str | None = None
     device_alias: str = "device:alias"
     alias_device: str = "alias:device"
+    codec: type[Codec] = JSONCodec
+    codec_subprotocol: str | None = None
+    subprotocol_options: tuple[str, ...] = ("batch",)
+    receive_event: str | None = None
+    required_keys: tuple[str, ...] = ()
+    batching: bool = False
+    rate_limiter = None
+
+    local_inbox: asyncio.Queue | None = None
+
+    _outbound: deque | None = None
+    _outbound_ready: asyncio.Event | None = None
+    _unacked: dict[str, deque] | None = None
+    _write_lock: asyncio.Lock | None = None
+    _writer: asyncio.Task | None = None
+    _closed: bool = False
 
     class Meta:
         abstract = True
 
+    async def __call__(self, scope, receive, send):
+        """
+        Same as channels' AsyncConsumer.__call__, except that events handed over
+        by consumers of the same worker to the local inbox, are dispatched along
+        with websocket & channel layer messages.
+        """
+        self.scope = scope
+        self.base_send = send
+        self.local_inbox = asyncio.Queue()
+        self.channel_layer = get_channel_layer(self.channel_layer_alias)
+
+        receivers: list = [receive, self.local_inbox.get]
+
+        if self.channel_layer is not None:
+            self.channel_name = await self.channel_layer.new_channel()
+            self.channel_receive = functools.partial(self.channel_layer.receive, self.channel_name)
+            receivers.append(self.channel_receive)
+
+            local_consumers.register(self)
+
+        try:
+            await await_many_dispatch(receivers, self.dispatch)
+        except StopConsumer:
+            pass
+        finally:
+            if self.channel_layer is not None:
+                local_consumers.unregister(self)
+
+    async def websocket_connect(self, message):
+        # index 0 in subprotocols is the device uuid, and index 1 the codec unless
+        # it's one of subprotocol_options
+        subprotocols: list = self.scope.get("subprotocols", [])
+
+        if len(subprotocols) > 1 and subprotocols[1] not in self.subprotocol_options:
+            self.codec_subprotocol = subprotocols[1]
+
+        self.codec = get_codec(self.codec_subprotocol)
+        self.batching = "batch" in subprotocols[1:]
+
+        self._outbound = deque()
+        self._outbound_ready = asyncio.Event()
+        self._unacked = {}
+        self._write_lock = asyncio.Lock()
+
+        await super().websocket_connect(message)
+
+    @property
+    def codec_refused(self) -> bool:
+        """
+        True if the codec requested in subprotocols is not available, i.e frames
+        would be encoded with the JSON fallback instead.
+        """
+        return self.codec_subprotocol is not None and (
+            self.codec.name != self.codec_subprotocol.lower()
+        )
+
+    async def websocket_disconnect(self, message):
+        # the socket is gone, queued events can't be delivered
+        self.stop_writer()
+
+        await super().websocket_disconnect(message)
+
+    def decode_frame(self, text_data: str | None = None, bytes_data: bytes | None = None):
+        """
+        Decode an inbound frame. Text frames are always decoded with the 'json'
+        codec, and bytes frames with the connection codec. Raises
+        src.wire.DecodeError when the frame can't be decoded.
+        """
+        if text_data is not None:
+            return get_codec("json").decode(text_data)
+
+        return self.codec.decode(bytes_data)
+
+    def frame_event(self, envelope: Envelope) -> str | None:
+        """Event type of an envelope. Default is receive_event."""
+        return self.receive_event
+
+    def required_keys_for(self, envelope: Envelope) -> tuple[str, ...]:
+        """Keys an envelope must have, given it's event. Default is required_keys."""
+        return self.required_keys
+
+    def rate_limit_identities(self) -> list[str]:
+        """The device & client IP whose token buckets a frame takes from."""
+        identities: list[str] = []
+
+        if self.did:
+            identities.append(f"device:{self.did}")
+
+        if self.scope.get("client"):
+            identities.append(f"ip:{self.scope['client'][0]}")
+
+        return identities
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Parse each inbound frame exactly once into an envelope, validated to be
+        an object with the required keys, and pass it on to receive_envelope().
+        Frames that can't be parsed or that are rate limited, are answered with
+        an error response.
+        """
+        try:
+            envelope = Envelope(self.decode_frame(text_data, bytes_data))
+            event: str | None = self.frame_event(envelope)
+
+            if self.rate_limiter is not None:
+                retry_after: float = await self.rate_limiter.hit(
+                    event, self.rate_limit_identities()
+                )
+
+                if retry_after:
+                    await self.send_json(
+                        {
+                            "event": event,
+                            "status": False,
+                            "message": f"Too many requests, retry in {retry_after} second(s)",
+                            "data": {"error": "rate_limited", "retry_after": retry_after},
+                        }
+                    )
+                    return
+
+            envelope.require(*self.required_keys_for(envelope))
+        except DecodeError:
+            await self.send_json(
+                {
+                    "event": self.receive_event,
+                    "status": False,
+                    "message": "Message(s) must be in json format",
+                }
+            )
+        except KeyError as e:
+            await self.send_json(
+                {
+                    "event": event,
+                    "status": False,
+                    "message": f"Missing key {str(e)}",
+                }
+            )
+        else:
+            await self.receive_envelope(envelope)
+
+    async def receive_envelope(self, envelope: Envelope):
+        """
+        Called with every parsed inbound frame, see receive(). Default is to
+        ignore it.
+        """
+        pass
+
+    async def send_json(self, content, close=False):
+        """
+        Encode content with the connection codec, and send it as a bytes frame
+        for binary codecs or else as a text frame. Queued events are sent first,
+        so frames keep their order, except events held back until the client
+        acknowledges earlier ones.
+        """
+        async with self._write_lock:
+            await self.flush_outbound()
+            await self.send_frame(content)
+
+        if close:
+            await self.close(close)
+
+    async def send_frame(self, content):
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.encode(content))
+        else:
+            await self.send(text_data=self.codec.encode(content))
+
+    async def send_event(self, content: dict):
+        """
+        Queue the data of a channel layer event, to be sent to the client by the
+        writer task. When batching, events arriving within
+        settings.WEBSOCKET_BATCH["WINDOW"] seconds, or up to
+        settings.WEBSOCKET_BATCH["MAX_SIZE"] of them, are coalesced and sent as a
+        single array frame.
+        """
+        if self._closed:
+            return
+
+        if len(self._outbound) >= settings.WEBSOCKET_OUTBOUND["MAX_SIZE"]:
+            if not await self.apply_backpressure():
+                return
+
+        self._outbound.append(content)
+        outbound_metrics.record_depth(len(self._outbound))
+
+        if self._writer is None:
+            self._writer = asyncio.create_task(self.write_outbound())
+
+        self._outbound_ready.set()
+
+    async def apply_backpressure(self) -> bool:
+        """
+        Apply settings.WEBSOCKET_OUTBOUND["POLICY"] to a full outbound queue.
+        Returns True if the new event should still be queued.
+
+        drop-oldest: drop the oldest queued event, to make room for the new one
+        drop-newest: drop the new event
+        close: drop every queued event and close the connection with
+            settings.WEBSOCKET_OUTBOUND["CLOSE_CODE"]
+        """
+        policy: str = settings.WEBSOCKET_OUTBOUND["POLICY"]
+        outbound_metrics.record_policy(policy)
+
+        if policy == "drop-oldest":
+            self._outbound.popleft()
+            return True
+
+        if policy == "close":
+            # don't wait on the writer, it's stuck behind the slow client
+            self.stop_writer()
+            await super().close(code=settings.WEBSOCKET_OUTBOUND["CLOSE_CODE"])
+
+        return False
+
+    async def write_outbound(self):
+        """Writer task, that sends queued events as the client keeps up."""
+        while True:
+            await self._outbound_ready.wait()
+
+            if self.batching and len(self._outbound) < settings.WEBSOCKET_BATCH["MAX_SIZE"]:
+                await asyncio.sleep(settings.WEBSOCKET_BATCH["WINDOW"])
+
+            async with self._write_lock:
+                await self.flush_outbound()
+
+            # wait for more events, or for acknowledgements of held back events
+            if not self._outbound or self.awaiting_acks:
+                self._outbound_ready.clear()
+
+    async def flush_outbound(self):
+        """
+        Send queued events, coalesced into array frames when batching, until the
+        client has settings.WEBSOCKET_OUTBOUND["MAX_UNACKED"] events to acknowledge.
+        Must be called with the write lock held.
+        """
+        size: int = settings.WEBSOCKET_BATCH["MAX_SIZE"] if self.batching else 1
+
+        while self._outbound and not self.awaiting_acks:
+            frames: list[dict] = []
+
+            while self._outbound and len(frames) < size and not self.awaiting_acks:
+                content: dict = self._outbound.popleft()
+                ack: tuple[str, int] | None = self.awaited_ack(content)
+
+                if ack is not None:
+                    self._unacked.setdefault(ack[0], deque()).append(ack[1])
+
+                frames.append(content)
+
+            if not self.batching:
+                await self.send_frame(frames[0])
+                continue
+
+            outbound_metrics.record_batch(len(frames))
+            await self.send_frame(frames)
+
+    def awaited_ack(self, content: dict) -> tuple[str, int] | None:
+        """
+        The (sender, sequence number) the client acknowledges an event with, or
+        None when the event needs no acknowledgement. Default is None.
+        """
+        return None
+
+    @property
+    def awaiting_acks(self) -> bool:
+        """True while the client has too many events to acknowledge."""
+        max_unacked: int | None = settings.WEBSOCKET_OUTBOUND["MAX_UNACKED"]
+
+        return max_unacked is not None and (
+            sum(len(sequences) for sequences in self._unacked.values()) >= max_unacked
+        )
+
+    def acknowledge(self, sender: str, sequence: int) -> None:
+        """
+        The client acknowledged every event from sender up to & including sequence,
+        so the events held back for them can be sent.
+        """
+        sequences: deque = self._unacked.get(sender, deque())
+
+        while sequences and sequences[0] <= sequence:
+            sequences.popleft()
+
+        if not sequences:
+            self._unacked.pop(sender, None)
+
+        if self._outbound:
+            self._outbound_ready.set()
+
+    def stop_writer(self):
+        self._closed = True
+        self._outbound.clear()
+
+        if self._writer is not None:
+            self._writer.cancel()
+
+    async def close(self, code=None):
+        if not self._closed:
+            async with self._write_lock:
+                await self.flush_outbound()
+
+            self.stop_writer()
+
+        await super().close(code=code)
+
+
+async def send(channel_layer, channel: str, message: dict) -> None:
+    """
+    Send a message to a channel. Handed straight to the consumer of the channel
+    when it lives in this worker, else sent through the channel layer.
+
+    :param channel_layer: The consumer channel layer
+    :param channel: The channel name
+    :param message: The channel layer event
+    """
+    if not local_consumers.deliver(channel, message):
+        await channel_layer.send(channel, message)
+
+
+async def send_many(channel_layer, messages: list[tuple[str, dict]]) -> None:
+    """
+    Send each message to it's channel. Messages to consumers of this worker are
+    handed straight to them, and the rest are sent with the channel layer's own
+    send_many when it has one, i.e src.layers.PubSubChannelLayer publishes them
+    in a single pipeline. Other layers get every message sent concurrently, so with
+    channels_redis a fan-out still costs one redis round trip per message.
+
+    :param channel_layer: The consumer channel layer
+    :param messages: List of (channel, message) pairs
+    """
+    messages = [
+        (channel, message)
+        for channel, message in messages
+        if not local_consumers.deliver(channel, message)
+    ]
+
+    if not messages:
+        return
+
+    if hasattr(channel_layer, "send_many"):
+        await channel_layer.send_many(messages)
+        return
+
+    await asyncio.gather(*(channel_layer.send(channel, message) for channel, message in messages))
+
 
 def is_valid_uuid(value: uuid.UUID):
     try:
@@ -45,6 +519,11 @@ def is_valid_uuid(value: uuid.UUID):
         return False
 
 
+def is_valid_stream_id(value) -> bool:
+    """Check that value is a redis stream entry id, i.e <milliseconds>-<sequence>."""
+    return isinstance(value, str) and re.fullmatch(r"\d+-\d+", value) is not None
+
+
 def convert_array_to_dict(value: list | tuple) -> dict:
     """
     Using dictionary comprehension, convert list or tuple to dict. If
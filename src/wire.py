@@ -0,0 +1,162 @@
+import functools
+import json
+from typing import Any
+
+import msgpack
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import cbor2
+except ImportError:  # optional, only negotiable when installed
+    cbor2 = None
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib json module is used instead
+    orjson = None
+
+
+if orjson is not None:
+
+    def json_dumps(content: Any) -> str:
+        """Serialize content to a JSON string, with orjson."""
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    json_loads = orjson.loads
+
+else:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
+
+class DecodeError(ValueError):
+    """Raised when an inbound websocket frame can't be decoded."""
+
+
+class Envelope(dict):
+    """
+    An inbound frame, decoded once and validated to be an object. It's 'event'
+    key, when a string, selects the handler of the frame.
+    """
+
+    def __init__(self, content: Any):
+        if not isinstance(content, dict):
+            raise DecodeError("Frames must be an object")
+
+        super().__init__(content)
+
+    @property
+    def event(self) -> str | None:
+        event = self.get("event")
+
+        return event if isinstance(event, str) else None
+
+    def require(self, *keys: str) -> None:
+        """Raise KeyError for the first of keys missing from the envelope."""
+        for key in keys:
+            if key not in self:
+                raise KeyError(key)
+
+
+class Codec:
+    """
+    Wire codec of a websocket connection, it encodes outbound frames and
+    decodes inbound frames. Binary codecs send & receive bytes frames, while
+    text codecs send & receive text frames.
+
+    Variables names
+
+    name: the codec name, as requested at index 1 in subprotocols
+    binary: True if frames are bytes frames
+    available: False if a package the codec needs is not installed
+    """
+
+    name: str
+    binary: bool = False
+    available: bool = True
+
+    @staticmethod
+    def encode(content: Any) -> str | bytes:
+        raise NotImplementedError
+
+    @staticmethod
+    def decode(data: str | bytes) -> Any:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """JSON text frames, the default codec. Uses orjson when installed."""
+
+    name = "json"
+
+    @staticmethod
+    def encode(content: Any) -> str:
+        return json_dumps(content)
+
+    @staticmethod
+    def decode(data: str | bytes) -> Any:
+        try:
+            return json_loads(data)
+        except (TypeError, ValueError) as e:
+            raise DecodeError(str(e)) from e
+
+
+class MessagePackCodec(Codec):
+    """MessagePack bytes frames."""
+
+    name = "msgpack"
+    binary = True
+
+    @staticmethod
+    def encode(content: Any) -> bytes:
+        return msgpack.packb(content)
+
+    @staticmethod
+    def decode(data: str | bytes) -> Any:
+        try:
+            return msgpack.unpackb(data)
+        except (TypeError, ValueError, msgpack.UnpackException) as e:
+            raise DecodeError(str(e)) from e
+
+
+class CBORCodec(Codec):
+    """CBOR bytes frames, available when the cbor2 package is installed."""
+
+    name = "cbor"
+    binary = True
+    available = cbor2 is not None
+
+    @staticmethod
+    def encode(content: Any) -> bytes:
+        return cbor2.dumps(content)
+
+    @staticmethod
+    def decode(data: str | bytes) -> Any:
+        try:
+            return cbor2.loads(data)
+        except (TypeError, ValueError, cbor2.CBORDecodeError) as e:
+            raise DecodeError(str(e)) from e
+
+
+@functools.cache
+def get_codecs() -> dict[str, type[Codec]]:
+    """
+    Return the available codecs a client can request, by name. Codecs are
+    imported from their dotted paths in settings.WIRE_CODECS, so a project
+    can plug in it's own codecs, e.g a faster JSON codec named 'json'.
+    """
+    codecs: list[type[Codec]] = [import_string(path) for path in settings.WIRE_CODECS]
+
+    return {codec.name: codec for codec in codecs if codec.available}
+
+
+def get_codec(name: str | None) -> type[Codec]:
+    """
+    Return the codec with the given name, falling back to the 'json' codec when
+    no codec was requested or the requested codec is not available.
+    """
+    codecs: dict[str, type[Codec]] = get_codecs()
+    default: type[Codec] = codecs.get("json", JSONCodec)
+
+    return codecs.get(str(name).lower(), default) if name else default
@@ -1,12 +1,24 @@
 import uuid
 from datetime import datetime, timedelta
 
+import fakeredis
 import pytest
+import pytest_asyncio
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
 from pytest import MonkeyPatch
 
-from chat.lua_scripts import LuaScripts
-from src.utils import redis_client
-from tests.mocks import MockLuaScript, MockRedisClient
+from chat import lua_scripts
+from chat.lua_scripts import scripts
+from chat.routers import websocket_urlpatterns
+from chat.services import alias_reaper, consumer_services, rate_limiter
+from src.utils import async_redis_client
+from tests.mocks import (
+    EchoConsumer,
+    MockAsyncRedisClient,
+    MockLuaScript,
+    MockRedisClient,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -18,39 +30,86 @@ def use_in_memory_channel_layer(settings):
     }
 
 
+@pytest.fixture(autouse=True)
+def disable_route_cache(settings):
+    settings.ROUTE_CACHE = {**settings.ROUTE_CACHE, "ENABLED": False}
+
+
 @pytest.fixture(autouse=True)
 def reset_redis_instance_db():
     return MockRedisClient.reset()
 
 
-@pytest.fixture
-def mock_redis_hset(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(redis_client, "hset", MockRedisClient.hset)
+@pytest_asyncio.fixture
+async def lua_redis(monkeypatch: MonkeyPatch):
+    """
+    In-memory redis with a lua engine, used by services in place of the redis
+    client. Every registered lua script is loaded, so the scripts shipped in
+    chat.lua_scripts run by SHA, instead of the stand-ins of tests.mocks.
+    """
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    for source in scripts.scripts.values():
+        await client.script_load(source)
+
+    for module in (lua_scripts, consumer_services, rate_limiter, alias_reaper):
+        monkeypatch.setattr(module, "async_redis_client", client)
+
+    monkeypatch.setattr(alias_reaper, "async_pubsub_client", client)
+
+    yield client
+
+    await client.flushall()
 
 
 @pytest.fixture
-def mock_redis_hget(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(redis_client, "hget", MockRedisClient.hget)
+def mock_redis_hset(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "hset", MockAsyncRedisClient.hset)
 
 
 @pytest.fixture
-def mock_redis_hvals(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(redis_client, "hvals", MockRedisClient.hvals)
+def mock_redis_hget(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "hget", MockAsyncRedisClient.hget)
 
 
 @pytest.fixture
 def mock_redis_hdel(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(redis_client, "hdel", MockRedisClient.hdel)
+    monkeypatch.setattr(async_redis_client, "hdel", MockAsyncRedisClient.hdel)
 
 
 @pytest.fixture
 def mock_redis_delete(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(redis_client, "delete", MockRedisClient.delete)
+    monkeypatch.setattr(async_redis_client, "delete", MockAsyncRedisClient.delete)
 
 
 @pytest.fixture
 def mock_redis_expireat(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(redis_client, "expireat", MockRedisClient.expireat)
+    monkeypatch.setattr(async_redis_client, "expireat", MockAsyncRedisClient.expireat)
+
+
+@pytest.fixture
+def mock_redis_publish(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "publish", MockAsyncRedisClient.publish)
+
+
+@pytest.fixture
+def mock_redis_hscan(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "hscan", MockAsyncRedisClient.hscan)
+
+
+@pytest.fixture
+def mock_redis_xrange(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "xrange", MockAsyncRedisClient.xrange)
+
+
+@pytest.fixture
+def mock_redis_xtrim(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "xtrim", MockAsyncRedisClient.xtrim)
+
+
+@pytest.fixture
+def mock_redis_unlink(monkeypatch: MonkeyPatch):
+    monkeypatch.setattr(async_redis_client, "unlink", MockAsyncRedisClient.unlink)
 
 
 @pytest.fixture
@@ -66,10 +125,186 @@ def device_data():
 
 
 @pytest.fixture
-def mock_luascript_set_alias_device(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(LuaScripts, "set_alias_device", MockLuaScript.set_alias_device)
+def mock_luascript_get_device_data():
+    with scripts.stand_in("get_device_data", MockLuaScript.get_device_data):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_get_chat_route():
+    with scripts.stand_in("get_chat_route", MockLuaScript.get_chat_route):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_get_chat_routes():
+    with scripts.stand_in("get_chat_routes", MockLuaScript.get_chat_routes):
+        yield
 
 
 @pytest.fixture
-def mock_luascript_get_device_data(monkeypatch: MonkeyPatch):
-    monkeypatch.setattr(LuaScripts, "get_device_data", MockLuaScript.get_device_data)
+def mock_luascript_reserve_alias():
+    with scripts.stand_in("reserve_alias", MockLuaScript.reserve_alias):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_connect_device():
+    with scripts.stand_in("connect_device", MockLuaScript.connect_device):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_disconnect_device():
+    with scripts.stand_in("disconnect_device", MockLuaScript.disconnect_device):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_resume_device():
+    with scripts.stand_in("resume_device", MockLuaScript.resume_device):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_get_device_route():
+    with scripts.stand_in("get_device_route", MockLuaScript.get_device_route):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_get_offline_device():
+    with scripts.stand_in("get_offline_device", MockLuaScript.get_offline_device):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_store_message():
+    with scripts.stand_in("store_message", MockLuaScript.store_message):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_next_sequences():
+    with scripts.stand_in("next_sequences", MockLuaScript.next_sequences):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_ack_sequence():
+    with scripts.stand_in("ack_sequence", MockLuaScript.ack_sequence):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_rate_limit():
+    with scripts.stand_in("rate_limit", MockLuaScript.rate_limit):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_join_group():
+    with scripts.stand_in("join_group", MockLuaScript.join_group):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_leave_group():
+    with scripts.stand_in("leave_group", MockLuaScript.leave_group):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_prune_aliases():
+    with scripts.stand_in("prune_aliases", MockLuaScript.prune_aliases):
+        yield
+
+
+@pytest.fixture
+def mock_luascript_migrate_aliases():
+    with scripts.stand_in("migrate_aliases", MockLuaScript.migrate_aliases):
+        yield
+
+
+@pytest.fixture
+def mocked_redis(
+    mock_redis_hset,
+    mock_redis_hget,
+    mock_redis_hdel,
+    mock_redis_delete,
+    mock_redis_expireat,
+    mock_redis_publish,
+    mock_redis_xrange,
+    mock_redis_xtrim,
+    mock_luascript_get_device_data,
+    mock_luascript_get_device_route,
+    mock_luascript_connect_device,
+    mock_luascript_disconnect_device,
+    mock_luascript_resume_device,
+    mock_luascript_reserve_alias,
+    mock_luascript_get_chat_route,
+    mock_luascript_get_chat_routes,
+    mock_luascript_get_offline_device,
+    mock_luascript_store_message,
+    mock_luascript_next_sequences,
+    mock_luascript_ack_sequence,
+    mock_luascript_rate_limit,
+    mock_luascript_join_group,
+    mock_luascript_leave_group,
+):
+    """
+    Every redis call a consumer makes, served from the in-memory store of
+    tests.mocks.MockRedisClient, with the lua scripts replaced by their stand-ins.
+    """
+
+
+@pytest.fixture
+def connect_device(mocked_redis):
+    """
+    Connect a device to the consumer routed at path, over mocked redis. The device,
+    and it's alias when given, are in the store before connecting.
+    """
+
+    async def connect(
+        did: str,
+        alias: str | None = None,
+        path: str = "/ws/",
+        subprotocols: tuple[str, ...] = (),
+        client: str | None = None,
+    ) -> tuple[WebsocketCommunicator, dict]:
+        device: str = f"device:{did}"
+        MockRedisClient.redis_store.setdefault(device, {"did": did})
+
+        if alias:
+            MockRedisClient.redis_store[device]["alias"] = alias
+            MockRedisClient.redis_store["alias:device"][alias] = device
+            MockRedisClient.redis_store["device:alias"][device] = alias
+
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), path, subprotocols=[did, *subprotocols]
+        )
+
+        if client:
+            communicator.scope["client"] = [client, 50000]
+
+        await communicator.connect()
+
+        return communicator, await communicator.receive_json_from()
+
+    return connect
+
+
+@pytest.fixture
+def connect_echo():
+    """Connect to an EchoConsumer, or a subclass of it. Returns it's channel as well."""
+
+    async def connect(
+        consumer: type[EchoConsumer] = EchoConsumer,
+    ) -> tuple[WebsocketCommunicator, str]:
+        communicator = WebsocketCommunicator(application=consumer(), path="/test/ws/")
+
+        await communicator.connect()
+
+        return communicator, (await communicator.receive_json_from())["channel"]
+
+    return connect
@@ -1,6 +1,10 @@
+import asyncio
+import fnmatch
 import uuid
 from datetime import datetime, timedelta
 
+from src.utils import BaseAsyncJsonWebsocketConsumer
+
 
 class MockRedisClient:
     redis_store: dict = {
@@ -91,6 +95,173 @@ class MockRedisClient:
         MockRedisClient.redis_store[name]["expireat"] = str(ttl)
 
 
+class MockAsyncRedisClient:
+    """
+    Awaitable version of MockRedisClient, used in place of the asyncio redis
+    client. Reads and writes go to the same mock redis store.
+    """
+
+    @staticmethod
+    async def hset(name: str, mapping: dict) -> int:
+        return MockRedisClient.hset(name=name, mapping=mapping)
+
+    @staticmethod
+    async def hget(name: str, key: str | None = None) -> dict | str | None:
+        return MockRedisClient.hget(name=name, key=key)
+
+    @staticmethod
+    async def hdel(name: str, key: str) -> int:
+        return MockRedisClient.hdel(name=name, key=key)
+
+    @staticmethod
+    async def delete(name: str) -> int:
+        return MockRedisClient.delete(name=name)
+
+    @staticmethod
+    async def expireat(name: str, ttl: datetime) -> None:
+        return MockRedisClient.expireat(name=name, ttl=ttl)
+
+    @staticmethod
+    async def xrange(name: str, min: str = "-", max: str = "+", count: int | None = None) -> list:
+        entries: list = list(MockRedisClient.redis_store.get(name) or [])
+
+        if min.startswith("("):
+            entries = [entry for entry in entries if entry[0] > min[1:]]
+
+        return entries[:count]
+
+    @staticmethod
+    async def xtrim(name: str, minid: str, approximate: bool = True) -> int:
+        entries: list = MockRedisClient.redis_store.get(name) or []
+        kept = [entry for entry in entries if entry[0] >= minid]
+        MockRedisClient.redis_store[name] = kept
+
+        return len(entries) - len(kept)
+
+    @staticmethod
+    async def unlink(*names: str) -> int:
+        return sum(MockRedisClient.redis_store.pop(name, None) is not None for name in names)
+
+    @staticmethod
+    async def publish(channel: str, message: str) -> int:
+        return 0
+
+    @staticmethod
+    async def hscan(name: str, cursor: int = 0, count: int | None = None) -> tuple[int, dict]:
+        return 0, dict(MockRedisClient.redis_store.get(name) or {})
+
+
+class MockPubSub:
+    """Subscription of a MockPubSubRedisClient, to a single channel."""
+
+    def __init__(self, client: "MockPubSubRedisClient"):
+        self.client = client
+        self.channel: str | None = None
+        self.messages: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, channel: str) -> None:
+        self.channel = channel
+        self.client.subscribers.setdefault(channel, []).append(self)
+
+    async def unsubscribe(self) -> None:
+        self.client.subscribers.get(self.channel, []).remove(self)
+        self.messages.put_nowait(None)
+
+    async def listen(self):
+        while (message := await self.messages.get()) is not None:
+            yield {"type": "message", "channel": self.channel, "data": message}
+
+    async def close(self) -> None:
+        pass
+
+
+class MockPipeline:
+    """Pipeline of a MockPubSubRedisClient, that publishes on execute."""
+
+    def __init__(self, client: "MockPubSubRedisClient"):
+        self.client = client
+        self.commands: list[tuple[str, bytes]] = []
+
+    async def __aenter__(self) -> "MockPipeline":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.commands = []
+
+    def publish(self, channel: str, message: bytes) -> "MockPipeline":
+        self.commands.append((channel, message))
+        return self
+
+    async def execute(self) -> list[int]:
+        self.client.executed += 1
+
+        return [await self.client.publish(channel, message) for channel, message in self.commands]
+
+
+class MockPubSubRedisClient:
+    """
+    In-memory redis, for the pub/sub & sorted set commands used by
+    src.layers.PubSubChannelLayer. Layers sharing a client reach each other
+    like workers sharing a redis server.
+    """
+
+    def __init__(self):
+        self.subscribers: dict[str, list[MockPubSub]] = {}
+        self.sorted_sets: dict[str, dict[str, float]] = {}
+        self.published: int = 0
+        self.executed: int = 0
+
+    def pipeline(self, transaction: bool = True) -> MockPipeline:
+        return MockPipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> MockPubSub:
+        return MockPubSub(self)
+
+    async def publish(self, channel: str, message: bytes) -> int:
+        self.published += 1
+
+        for pubsub in self.subscribers.get(channel, []):
+            pubsub.messages.put_nowait(message)
+
+        return len(self.subscribers.get(channel, []))
+
+    async def zadd(self, name: str, mapping: dict) -> int:
+        self.sorted_sets.setdefault(name, {}).update(mapping)
+        return len(mapping)
+
+    async def zrem(self, name: str, *values: str) -> int:
+        return sum(self.sorted_sets.get(name, {}).pop(value, None) is not None for value in values)
+
+    async def zremrangebyscore(self, name: str, min: float, max: float) -> int:
+        members = self.sorted_sets.get(name, {})
+        removed = [member for member, score in members.items() if min <= score <= max]
+
+        for member in removed:
+            del members[member]
+
+        return len(removed)
+
+    async def zrangebyscore(self, name: str, min: float, max: float | str) -> list[bytes]:
+        max = float(max)
+        members = self.sorted_sets.get(name, {})
+
+        return [member.encode() for member, score in members.items() if min <= score <= max]
+
+    async def expire(self, name: str, seconds: int) -> bool:
+        return name in self.sorted_sets
+
+    async def scan_iter(self, match: str):
+        for name in list(self.sorted_sets):
+            if fnmatch.fnmatch(name, match):
+                yield name
+
+    async def delete(self, *names: str) -> int:
+        return sum(self.sorted_sets.pop(name, None) is not None for name in names)
+
+    async def close(self) -> None:
+        pass
+
+
 class MockLuaScript:
     """
     Here, redis methods to execute a lua script gets it's keys as list
@@ -99,11 +270,274 @@ class MockLuaScript:
     """
 
     @staticmethod
-    def set_alias_device(keys: list, client=None) -> int:
-        device = MockRedisClient.hget(name="device:alias", key=keys[0]) or keys[0]
+    async def get_device_data(keys: list, args: list | None = None, client=None) -> dict:
+        return MockRedisClient.hget(name=keys[0])
+
+    @staticmethod
+    async def get_chat_route(args: list, keys: list | None = None, client=None) -> list:
+        recipient = MockRedisClient.hget(name="alias:device", key=args[0])
+
+        return [
+            recipient,
+            MockRedisClient.hget(name=recipient, key="channel") if recipient else None,
+            MockRedisClient.hget(name=recipient, key="did") if recipient else None,
+        ]
+
+    @staticmethod
+    async def get_chat_routes(args: list, keys: list | None = None, client=None) -> list:
+        routes = []
+
+        for alias in args:
+            routes.extend(await MockLuaScript.get_chat_route(args=[alias]))
+
+        return routes
+
+    @staticmethod
+    async def get_device_route(keys: list, args: list | None = None, client=None) -> list:
+        return [
+            MockRedisClient.hget(name=keys[0], key="channel"),
+            MockRedisClient.hget(name="device:alias", key=keys[0]),
+            MockRedisClient.hget(name=keys[0], key="did"),
+        ]
+
+    @staticmethod
+    async def reserve_alias(keys: list, args: list, client=None) -> int:
+        current_alias = MockRedisClient.hget(name="device:alias", key=keys[0])
+
+        if current_alias == args[0]:
+            return 0
 
-        return MockRedisClient.hset(name="alias:device", mapping={"testalias": device})
+        owner = MockRedisClient.hget(name="alias:device", key=args[0])
+
+        if owner and owner != keys[0]:
+            return -1
+
+        offline_owner = MockRedisClient.redis_store.get(f"alias:{args[0]}:offline")
+
+        if (
+            offline_owner
+            and offline_owner != keys[0]
+            and MockRedisClient.redis_store.get(offline_owner)
+            and MockRedisClient.hget(name="device:alias", key=offline_owner) == args[0]
+        ):
+            return -1
+
+        MockRedisClient.hset(name="alias:device", mapping={args[0]: keys[0]})
+        MockRedisClient.hset(name="device:alias", mapping={keys[0]: args[0]})
+        MockRedisClient.redis_store.pop(f"alias:{args[0]}:offline", None)
+
+        if MockRedisClient.redis_store.get(f"alias:{current_alias}:offline") == keys[0]:
+            del MockRedisClient.redis_store[f"alias:{current_alias}:offline"]
+
+        return 1
 
     @staticmethod
-    def get_device_data(keys: list, client=None) -> dict:
+    async def connect_device(keys: list, args: list, client=None) -> dict:
+        MockRedisClient.hset(
+            name=keys[0], mapping={"did": args[0], "channel": args[1], "ttl": args[2]}
+        )
+        MockRedisClient.redis_store[keys[0]].pop("offline", None)
+        MockRedisClient.expireat(name=keys[0], ttl=args[3])
+
+        device_alias = MockRedisClient.hget(name="device:alias", key=keys[0])
+
+        if device_alias and MockRedisClient.hget(name="alias:device", key=device_alias) in (
+            None,
+            keys[0],
+        ):
+            MockRedisClient.hset(name="alias:device", mapping={device_alias: keys[0]})
+
+        if MockRedisClient.redis_store.get(f"alias:{device_alias}:offline") == keys[0]:
+            del MockRedisClient.redis_store[f"alias:{device_alias}:offline"]
+
+        inbox = MockRedisClient.redis_store.get(f"{keys[0]}:inbox")
+
+        if inbox:
+            return {**MockRedisClient.hget(name=keys[0]), "inbox": len(inbox)}
+
         return MockRedisClient.hget(name=keys[0])
+
+    @staticmethod
+    async def disconnect_device(keys: list, args: list, client=None) -> list:
+        if MockRedisClient.hget(name=keys[0], key="channel") != args[3]:
+            return [0, None, 0, 0]
+
+        channel_removed = MockRedisClient.hdel(name=keys[0], key="channel")
+        device_alias = MockRedisClient.hget(name="device:alias", key=keys[0])
+        alias_device_removed = 0
+        device_alias_removed = 0
+
+        if device_alias and MockRedisClient.hget(name="alias:device", key=device_alias) == keys[0]:
+            alias_device_removed = MockRedisClient.hdel(name="alias:device", key=device_alias)
+
+        if args[0]:
+            device_alias_removed = MockRedisClient.hdel(name="device:alias", key=keys[0])
+
+            if MockRedisClient.redis_store.get(f"alias:{device_alias}:offline") == keys[0]:
+                del MockRedisClient.redis_store[f"alias:{device_alias}:offline"]
+        elif len(args) > 2:
+            if alias_device_removed:
+                MockRedisClient.redis_store[f"alias:{device_alias}:offline"] = keys[0]
+
+            MockRedisClient.hset(name=keys[0], mapping={"offline": args[2]})
+
+        return [channel_removed, device_alias, alias_device_removed, device_alias_removed]
+
+    @staticmethod
+    async def resume_device(keys: list, args: list, client=None) -> list:
+        device: dict = MockRedisClient.hget(name=keys[0]) or {}
+        alias = MockRedisClient.hget(name="device:alias", key=keys[0])
+
+        if device.get("offline") is None or device.get("did") != args[0]:
+            return [0]
+
+        if args[4] - device["offline"] > args[5] or alias is None:
+            return [0]
+
+        if MockRedisClient.hget(name="alias:device", key=alias) not in (None, keys[0]):
+            return [0]
+
+        MockRedisClient.hset(name=keys[0], mapping={"channel": args[1], "ttl": args[2]})
+        device.pop("offline")
+        MockRedisClient.hset(name="alias:device", mapping={alias: keys[0]})
+
+        return [
+            1,
+            alias,
+            len(MockRedisClient.redis_store.get(f"{keys[0]}:inbox", [])),
+            list(MockRedisClient.redis_store.get(f"{keys[0]}:groups", [])),
+        ]
+
+    @staticmethod
+    async def get_offline_device(args: list, keys: list | None = None, client=None) -> str | None:
+        device = MockRedisClient.redis_store.get(f"alias:{args[0]}:offline")
+
+        if (
+            device
+            and MockRedisClient.redis_store.get(device)
+            and MockRedisClient.hget(name="device:alias", key=device) == args[0]
+        ):
+            return device
+
+        return None
+
+    @staticmethod
+    async def store_message(keys: list, args: list, client=None) -> str | None:
+        if MockRedisClient.hget(name="device:alias", key=keys[0]) != args[3]:
+            return None
+
+        entries: list = MockRedisClient.redis_store.setdefault(keys[1], [])
+        entry_id = f"{len(entries) + 1:013d}-0"
+        entries.append((entry_id, {"data": args[0]}))
+
+        return entry_id
+
+    @staticmethod
+    async def next_sequences(keys: list, args: list, client=None) -> list:
+        sequences = []
+
+        for key in keys:
+            hash: dict = MockRedisClient.redis_store.setdefault(key, {})
+            hash[args[0]] = int(hash.get(args[0], 0)) + 1
+            sequences.append(hash[args[0]])
+
+        return sequences
+
+    @staticmethod
+    async def ack_sequence(keys: list, args: list, client=None) -> list:
+        hash: dict = MockRedisClient.redis_store.setdefault(keys[0], {})
+        last, acked = int(hash.get(args[0], 0)), int(hash.get(f"{args[0]}:acked", 0))
+
+        if args[1] <= acked or args[1] > last:
+            return [acked, 0]
+
+        hash[f"{args[0]}:acked"] = args[1]
+
+        return [args[1], 1]
+
+    @staticmethod
+    async def rate_limit(keys: list, args: list, client=None) -> list:
+        capacity, rate, now, cost = (float(arg) for arg in args)
+        levels = []
+
+        for key in keys:
+            bucket: dict = MockRedisClient.redis_store.get(key, {})
+            tokens = float(bucket.get("tokens", capacity))
+            elapsed = max(0, now - float(bucket.get("ts", now)))
+            levels.append(min(capacity, tokens + elapsed * rate / 1000))
+
+        if any(level < cost for level in levels):
+            return [0, max(int((cost - level) * 1000 / rate) + 1 for level in levels)]
+
+        for key, level in zip(keys, levels):
+            MockRedisClient.redis_store[key] = {"tokens": level - cost, "ts": now}
+
+        return [1, 0]
+
+    @staticmethod
+    async def join_group(keys: list, args: list, client=None) -> int:
+        members: set = MockRedisClient.redis_store.setdefault(keys[0], set())
+
+        if args[0] in members:
+            return 0
+
+        if len(members) >= int(args[2]):
+            return -1
+
+        members.add(args[0])
+        MockRedisClient.redis_store.setdefault(keys[1], set()).add(args[1])
+
+        return 1
+
+    @staticmethod
+    async def leave_group(keys: list, args: list, client=None) -> int:
+        MockRedisClient.redis_store.get(keys[1], set()).discard(args[1])
+        members: set = MockRedisClient.redis_store.get(keys[0], set())
+
+        if args[0] not in members:
+            return 0
+
+        members.discard(args[0])
+        return 1
+
+    @staticmethod
+    async def prune_aliases(args: list, keys: list | None = None, client=None) -> int:
+        pruned = 0
+
+        for device in args:
+            device_alias = MockRedisClient.hget(name="device:alias", key=device)
+
+            if MockRedisClient.redis_store.get(device) is None and device_alias:
+                MockRedisClient.hdel(name="device:alias", key=device)
+
+                if MockRedisClient.hget(name="alias:device", key=device_alias) == device:
+                    MockRedisClient.hdel(name="alias:device", key=device_alias)
+
+                pruned += 1
+
+        return pruned
+
+    @staticmethod
+    async def migrate_aliases(args: list, keys: list | None = None, client=None) -> int:
+        migrated = 0
+
+        for device, alias in zip(args[::2], args[1::2]):
+            owner = MockRedisClient.redis_store.get(f"alias:{alias}")
+
+            if MockRedisClient.redis_store.get(device) and owner in (None, device):
+                MockRedisClient.hset(name=device, mapping={"alias": alias})
+                MockRedisClient.redis_store[f"alias:{alias}"] = device
+                migrated += 1
+
+        return migrated
+
+
+class EchoConsumer(BaseAsyncJsonWebsocketConsumer):
+    """Consumer that sends it's channel on connect, then the data of every chat event."""
+
+    async def connect(self):
+        await self.accept()
+        await self.send_json({"channel": self.channel_name})
+
+    async def chat_message(self, event):
+        await self.send_event(event["data"])
@@ -0,0 +1,51 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from chat.lua_scripts import AliasKeyLuaScripts, LuaScripts, get_lua_scripts
+from tests.mocks import MockRedisClient
+
+
+class TestAliasLayout:
+    @pytest.mark.parametrize(
+        "layout, expected",
+        [
+            ("hash", LuaScripts),
+            ("keys", AliasKeyLuaScripts),
+        ],
+    )
+    def test_get_lua_scripts_follows_layout_in_settings(self, settings, layout, expected):
+        settings.REDIS_KEY_LAYOUT = layout
+
+        assert get_lua_scripts() is expected
+
+    def test_migrate_alias_layout_copies_aliases_of_existing_devices(
+        self, mock_redis_hscan, mock_luascript_migrate_aliases
+    ):
+        out = StringIO()
+        call_command("migrate_alias_layout", stdout=out)
+
+        assert "Migrated 1 device alias(es)" in out.getvalue()
+        assert MockRedisClient.redis_store["device:001"]["alias"] == "testalias_001.linq"
+        assert MockRedisClient.redis_store["alias:testalias_001.linq"] == "device:001"
+        assert "device:alias" in MockRedisClient.redis_store
+
+    def test_migrate_alias_layout_cleanup_requires_keys_layout(
+        self, mock_redis_hscan, mock_luascript_migrate_aliases, mock_redis_unlink
+    ):
+        err = StringIO()
+        call_command("migrate_alias_layout", "--cleanup", stderr=err)
+
+        assert "Set REDIS_KEY_LAYOUT to 'keys'" in err.getvalue()
+        assert "device:alias" in MockRedisClient.redis_store
+
+    def test_migrate_alias_layout_cleanup_deletes_old_hashes(
+        self, settings, mock_redis_hscan, mock_luascript_migrate_aliases, mock_redis_unlink
+    ):
+        settings.REDIS_KEY_LAYOUT = "keys"
+
+        call_command("migrate_alias_layout", "--cleanup", stdout=StringIO())
+
+        assert "device:alias" not in MockRedisClient.redis_store
+        assert "alias:device" not in MockRedisClient.redis_store
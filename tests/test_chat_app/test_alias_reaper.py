@@ -0,0 +1,51 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from chat.services.alias_reaper import AliasReaper
+from tests.mocks import MockRedisClient
+
+
+class TestAliasReaper:
+    @pytest.mark.parametrize(
+        "key, expected",
+        [
+            ("device:5a1c8c4e-2b7b-4a4e-9f5e-6d3d7c6a1b2f", True),
+            ("device:alias", False),
+            ("device:5a1c8c4e-2b7b-4a4e-9f5e-6d3d7c6a1b2f:groups", False),
+            ("alias:device", False),
+        ],
+    )
+    def test_is_device_only_matches_device_hashes(self, key, expected):
+        assert AliasReaper.is_device(key) is expected
+
+    @pytest.mark.asyncio
+    async def test_prune_only_removes_aliases_of_expired_devices(
+        self, mock_luascript_prune_aliases
+    ):
+        reaper = AliasReaper(batch_size=10, interval=60)
+
+        assert await reaper.prune(["device:001", "device:002"]) == 1
+        assert reaper.pruned == 1
+        assert MockRedisClient.redis_store["device:alias"]["device:001"] == "testalias_001.linq"
+        assert MockRedisClient.redis_store["device:alias"]["device:002"] is None
+
+    @pytest.mark.asyncio
+    async def test_prune_without_devices(self, mock_luascript_prune_aliases):
+        assert await AliasReaper().prune([]) == 0
+
+    @pytest.mark.asyncio
+    async def test_sweep_prunes_every_expired_device(
+        self, mock_redis_hscan, mock_luascript_prune_aliases
+    ):
+        assert await AliasReaper().sweep() == 2
+        assert MockRedisClient.redis_store["device:alias"]["device:003"] is None
+
+    def test_reap_aliases_command_reports_number_pruned(
+        self, mock_redis_hscan, mock_luascript_prune_aliases
+    ):
+        out = StringIO()
+        call_command("reap_aliases", "--once", stdout=out)
+
+        assert "Pruned 2 expired device(s)" in out.getvalue()
@@ -0,0 +1,76 @@
+import uuid
+
+import pytest
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from src.outbound import outbound_metrics
+from tests.mocks import MockRedisClient
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def batching(settings):
+    settings.WEBSOCKET_BATCH = {"WINDOW": 0.05, "MAX_SIZE": 3}
+    outbound_metrics.reset()
+
+
+async def connect(connect_device, *subprotocols: str) -> tuple[WebsocketCommunicator, str]:
+    did: str = str(uuid.uuid4())
+    communicator, _ = await connect_device(did, path="/ws/connect/", subprotocols=subprotocols)
+
+    return communicator, MockRedisClient.redis_store[f"device:{did}"]["channel"]
+
+
+async def send_events(channel: str, count: int) -> None:
+    for n in range(count):
+        await get_channel_layer().send(
+            channel,
+            {"type": "chat.message", "data": {"event": "chat.message", "message": n}},
+        )
+
+
+async def test_events_are_coalesced_within_window_or_up_to_max_size(batching, connect_device):
+    communicator, channel = await connect(connect_device, "json", "batch")
+
+    # a full batch is sent at once, the rest once the window elapses
+    await send_events(channel, 5)
+
+    first = await communicator.receive_json_from()
+    second = await communicator.receive_json_from()
+
+    assert [event["message"] for event in first] == [0, 1, 2]
+    assert [event["message"] for event in second] == [3, 4]
+    assert outbound_metrics.stats["batches"] == 2
+    assert outbound_metrics.stats["batch_sizes"] == {2: 1, 3: 1}
+    assert outbound_metrics.stats["average_batch_size"] == 2.5
+
+    await communicator.disconnect()
+
+
+async def test_buffered_events_are_flushed_before_responses(settings, batching, connect_device):
+    settings.WEBSOCKET_BATCH = {"WINDOW": 10, "MAX_SIZE": 3}
+    communicator, channel = await connect(connect_device, "json", "batch")
+
+    await send_events(channel, 1)
+    assert await communicator.receive_nothing()
+
+    await communicator.send_to(text_data='{"name": "testuser_001"}')
+
+    assert [event["message"] for event in await communicator.receive_json_from()] == [0]
+    assert (await communicator.receive_json_from())["message"] == "Missing key 'alias'"
+
+    await communicator.disconnect()
+
+
+async def test_events_are_not_coalesced_without_opting_in(batching, connect_device):
+    communicator, channel = await connect(connect_device)
+
+    await send_events(channel, 2)
+
+    assert (await communicator.receive_json_from())["message"] == 0
+    assert (await communicator.receive_json_from())["message"] == 1
+    assert outbound_metrics.stats["batches"] == 0
+
+    await communicator.disconnect()
@@ -0,0 +1,91 @@
+import uuid
+from io import StringIO
+
+import pytest
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+
+from chat.consumers.chat_p2p_consumer import P2PChatConsumer
+from chat.events import CHAT_EVENT_TYPES
+from chat.services.broadcast import broadcast, broadcast_group
+from tests.mocks import MockRedisClient
+
+
+@pytest.fixture
+def broadcast_settings(settings):
+    settings.BROADCAST = {"SHARDS": 4, "PACE": 0}
+
+    return settings
+
+
+def test_devices_are_spread_over_broadcast_group_shards(broadcast_settings):
+    groups = {broadcast_group(uuid.uuid4()) for _ in range(200)}
+
+    assert groups == {"broadcast.0", "broadcast.1", "broadcast.2", "broadcast.3"}
+    assert broadcast_group("001") == broadcast_group("001")
+
+
+@pytest.mark.asyncio
+async def test_broadcast_is_sent_to_every_shard(broadcast_settings):
+    channel_layer = get_channel_layer()
+
+    for shard in range(4):
+        await channel_layer.group_add(f"broadcast.{shard}", f"channel-{shard}")
+
+    assert await broadcast("Maintenance at noon", channel_layer=channel_layer) == 4
+
+    for shard in range(4):
+        received = await channel_layer.receive(f"channel-{shard}")
+
+        assert received["data"]["event"] == CHAT_EVENT_TYPES.CHAT_BROADCAST.value
+        assert received["data"]["data"]["message"] == "Maintenance at noon"
+
+        await channel_layer.group_discard(f"broadcast.{shard}", f"channel-{shard}")
+
+
+def test_broadcast_command(broadcast_settings):
+    out = StringIO()
+    call_command("broadcast", "Maintenance at noon", stdout=out)
+
+    assert "Broadcast sent to 4 group shard(s)" in out.getvalue()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("subprotocols, receives", [(["json", "broadcast"], True), ([], False)])
+async def test_devices_only_receive_broadcasts_when_opted_in(
+    subprotocols,
+    receives,
+    broadcast_settings,
+    mock_redis_hset,
+    mock_redis_hget,
+    mock_redis_hdel,
+    mock_redis_delete,
+    mock_redis_expireat,
+    mock_luascript_get_device_data,
+    mock_luascript_connect_device,
+    mock_luascript_disconnect_device,
+):
+    did: str = str(uuid.uuid4())
+    MockRedisClient.redis_store[f"device:{did}"] = {"did": did, "alias": "testalias"}
+
+    communicator = WebsocketCommunicator(
+        application=P2PChatConsumer(),
+        path="/test/ws/chat/p2p/",
+        subprotocols=[did, *subprotocols],
+    )
+
+    await communicator.connect()
+    await communicator.receive_json_from()
+
+    await broadcast("Maintenance at noon")
+
+    if receives:
+        response = await communicator.receive_json_from()
+
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_BROADCAST.value
+        assert response["data"]["message"] == "Maintenance at noon"
+    else:
+        assert await communicator.receive_nothing()
+
+    await communicator.disconnect()
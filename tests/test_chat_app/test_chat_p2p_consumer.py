@@ -2,13 +2,16 @@ import json
 import uuid
 
 import pytest
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 
 from chat.consumers.chat_p2p_consumer import P2PChatConsumer
-from chat.events import CHAT_EVENT_TYPES
+from chat.events import CHAT_EVENT_TYPES, SCAN_EVENT_TYPES
 from tests.mocks import MockRedisClient
 
-pytestmark = pytest.mark.asyncio
+pytestmark = [pytest.mark.asyncio, pytest.mark.usefixtures("mock_luascript_rate_limit")]
+
+CHAT_PATH = "/ws/chat/p2p/"
 
 
 class TestConsumerConnect:
@@ -16,6 +19,7 @@ class TestConsumerConnect:
         self,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_delete,
     ):
         """
@@ -43,6 +47,7 @@ class TestConsumerConnect:
         self,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_delete,
     ):
         """
@@ -72,9 +77,10 @@ class TestConsumerConnect:
         mock_redis_hset,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_delete,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -101,9 +107,10 @@ class TestConsumerConnect:
         mock_redis_hset,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_delete,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         device_data = device_data
@@ -134,15 +141,29 @@ class TestConsumerConnect:
 
 
 class TestConsumerReceive:
+    @pytest.mark.parametrize(
+        "frame, message",
+        [
+            ("testalias_001", "Message(s) must be in json format"),
+            ('["testalias_001", "Hi"]', "Message(s) must be in json format"),
+            (
+                '{"to": {"alias": "testalias_001"}, "message": "Hi"}',
+                "Key 'to' must be an alias or a non empty list of aliases",
+            ),
+        ],
+    )
     async def test_receive_method_only_accepts_data_in_json_format(
         self,
+        frame,
+        message,
         device_data,
         mock_redis_hset,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_delete,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         device_data = device_data
@@ -159,13 +180,13 @@ class TestConsumerReceive:
         connected, _ = await communicator.connect()
         await communicator.receive_json_from()
 
-        await communicator.send_to(text_data="testalias_001")
+        await communicator.send_to(text_data=frame)
         response = await communicator.receive_json_from()
 
         assert connected
         assert response["event"] == CHAT_EVENT_TYPES.CHAT_MESSAGE.value
         assert response["status"] is False
-        assert response["message"] == "Message(s) must be in json format"
+        assert response["message"] == message
 
         await communicator.disconnect()
 
@@ -184,9 +205,10 @@ class TestConsumerReceive:
         mock_redis_hset,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_delete,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         device_data = device_data
@@ -212,3 +234,573 @@ class TestConsumerReceive:
         assert response["message"] == f"Missing key '{missing}'"
 
         await communicator.disconnect()
+
+    async def test_receive_chat_to_offline_or_unknown_alias(
+        self,
+        device_data,
+        mock_redis_hset,
+        mock_redis_hget,
+        mock_redis_hdel,
+        mock_luascript_disconnect_device,
+        mock_redis_delete,
+        mock_redis_expireat,
+        mock_luascript_connect_device,
+        mock_luascript_get_device_data,
+        mock_luascript_get_chat_route,
+        mock_luascript_get_offline_device,
+    ):
+        device_data = device_data
+
+        # set device data in redis store
+        MockRedisClient.redis_store[f"device:{device_data['did']}"] = device_data
+
+        communicator = WebsocketCommunicator(
+            application=P2PChatConsumer(),
+            path="/test/ws/chat/p2p/",
+            subprotocols=[device_data["did"]],
+        )
+
+        connected, _ = await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_to(text_data=json.dumps({"to": "nobody.linq", "message": "Hi"}))
+        response = await communicator.receive_json_from()
+
+        assert connected
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_MESSAGE.value
+        assert response["status"] is False
+        assert response["message"] == "nobody.linq is offline or not available"
+
+        await communicator.disconnect()
+
+    async def test_receive_chat_is_sent_to_recipient_and_echoed_to_sender(
+        self,
+        device_data,
+        mock_redis_hset,
+        mock_redis_hget,
+        mock_redis_hdel,
+        mock_luascript_disconnect_device,
+        mock_redis_delete,
+        mock_redis_expireat,
+        mock_luascript_connect_device,
+        mock_luascript_get_device_data,
+        mock_luascript_get_chat_route,
+        mock_luascript_next_sequences,
+    ):
+        device_data = device_data
+        recipient_did: str = str(uuid.uuid4())
+
+        # set sender & recipient data in redis store
+        MockRedisClient.redis_store[f"device:{device_data['did']}"] = device_data
+        MockRedisClient.redis_store[f"device:{recipient_did}"] = {
+            "did": recipient_did,
+            "channel": "recipient-channel",
+        }
+        MockRedisClient.redis_store["alias:device"]["recipient.linq"] = f"device:{recipient_did}"
+
+        communicator = WebsocketCommunicator(
+            application=P2PChatConsumer(),
+            path="/test/ws/chat/p2p/",
+            subprotocols=[device_data["did"]],
+        )
+
+        connected, _ = await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_to(text_data=json.dumps({"to": "recipient.linq", "message": "Hi"}))
+        response = await communicator.receive_json_from()
+
+        assert connected
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_MESSAGE.value
+        assert response["status"] is True
+        assert response["message"] == "send"
+        assert response["data"]["alias"] == "recipient.linq"
+        assert response["data"]["did"] == recipient_did
+        assert response["data"]["message"] == "Hi"
+        assert response["data"]["seq"] == 1
+
+        await communicator.disconnect()
+
+    async def test_sender_identity_is_kept_and_refreshed_on_setup_events(
+        self,
+        device_data,
+        mock_redis_hset,
+        mock_redis_hget,
+        mock_redis_hdel,
+        mock_redis_delete,
+        mock_redis_expireat,
+        mock_luascript_get_device_data,
+        mock_luascript_connect_device,
+        mock_luascript_disconnect_device,
+        mock_luascript_get_chat_route,
+        mock_luascript_next_sequences,
+    ):
+        device_data = device_data
+        channel_layer = get_channel_layer()
+
+        # set sender & recipient data in redis store
+        MockRedisClient.redis_store[f"device:{device_data['did']}"] = device_data
+        MockRedisClient.redis_store["device:recipient"] = {
+            "did": "recipient",
+            "channel": "recipient-channel",
+        }
+        MockRedisClient.redis_store["alias:device"]["recipient.linq"] = "device:recipient"
+
+        communicator = WebsocketCommunicator(
+            application=P2PChatConsumer(),
+            path="/test/ws/chat/p2p/",
+            subprotocols=[device_data["did"]],
+        )
+
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_to(text_data=json.dumps({"to": "recipient.linq", "message": "1"}))
+        await communicator.receive_json_from()
+        received = await channel_layer.receive("recipient-channel")
+
+        assert received["data"]["data"]["alias"] == "testalias"
+        assert received["data"]["data"]["did"] == device_data["did"]
+        assert received["data"]["data"]["seq"] == 1
+
+        # device alias changed via scan to connect
+        await channel_layer.send(
+            MockRedisClient.redis_store[f"device:{device_data['did']}"]["channel"],
+            {
+                "type": "chat.message",
+                "data": {
+                    "event": SCAN_EVENT_TYPES.SCAN_SETUP.value,
+                    "status": True,
+                    "message": "Alias accepted",
+                    "data": {"alias": "newalias.linq"},
+                },
+            },
+        )
+        await communicator.receive_json_from()
+
+        await communicator.send_to(text_data=json.dumps({"to": "recipient.linq", "message": "2"}))
+        await communicator.receive_json_from()
+        received = await channel_layer.receive("recipient-channel")
+
+        assert received["data"]["data"]["alias"] == "newalias.linq"
+        assert received["data"]["data"]["seq"] == 2
+
+        await communicator.disconnect()
+
+
+class TestConsumerMulticast:
+    async def test_multicast_chat_is_sent_to_online_recipients_with_one_report(
+        self,
+        device_data,
+        mock_redis_hset,
+        mock_redis_hget,
+        mock_redis_hdel,
+        mock_redis_delete,
+        mock_redis_expireat,
+        mock_luascript_get_device_data,
+        mock_luascript_connect_device,
+        mock_luascript_disconnect_device,
+        mock_luascript_get_chat_routes,
+        mock_luascript_store_message,
+        mock_luascript_next_sequences,
+        mock_luascript_get_offline_device,
+    ):
+        device_data = device_data
+        channel_layer = get_channel_layer()
+
+        # set sender & recipients data in redis store, with one offline recipient
+        MockRedisClient.redis_store[f"device:{device_data['did']}"] = device_data
+
+        for name in ["one", "two"]:
+            MockRedisClient.redis_store[f"device:{name}"] = {
+                "did": name,
+                "channel": f"{name}-channel",
+            }
+            MockRedisClient.redis_store["alias:device"][f"{name}.linq"] = f"device:{name}"
+
+        MockRedisClient.redis_store["device:three"] = {"did": "three"}
+        MockRedisClient.redis_store["alias:device"]["three.linq"] = "device:three"
+        MockRedisClient.redis_store["device:alias"]["device:three"] = "three.linq"
+
+        communicator = WebsocketCommunicator(
+            application=P2PChatConsumer(),
+            path="/test/ws/chat/p2p/",
+            subprotocols=[device_data["did"]],
+        )
+
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_to(
+            text_data=json.dumps(
+                {
+                    "to": ["one.linq", "two.linq", "three.linq", "nobody.linq", "one.linq"],
+                    "message": "Hi",
+                }
+            )
+        )
+        response = await communicator.receive_json_from()
+
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_MESSAGE.value
+        assert response["status"] is True
+        assert response["message"] == "send"
+        assert response["data"]["to"] == [
+            {"alias": "one.linq", "did": "one", "seq": 1},
+            {"alias": "two.linq", "did": "two", "seq": 1},
+        ]
+        assert response["data"]["queued"] == [{"alias": "three.linq", "seq": 1}]
+        assert response["data"]["offline"] == ["nobody.linq"]
+
+        for name in ["one", "two"]:
+            received = await channel_layer.receive(f"{name}-channel")
+
+            assert received["data"]["message"] == "received"
+            assert received["data"]["data"]["alias"] == "testalias"
+            assert received["data"]["data"]["message"] == "Hi"
+
+        # duplicate aliases are only sent once
+        assert "one-channel" not in channel_layer.channels
+
+        await communicator.disconnect()
+
+    @pytest.mark.parametrize(
+        "to, message",
+        [
+            ([], "Key 'to' must be an alias or a non empty list of aliases"),
+            ([1, 2], "Key 'to' must be an alias or a non empty list of aliases"),
+            ([f"{n}.linq" for n in range(51)], "Message(s) can't have more than 50 recipients"),
+        ],
+    )
+    async def test_multicast_chat_with_invalid_recipients(
+        self,
+        to,
+        message,
+        device_data,
+        mock_redis_hset,
+        mock_redis_hget,
+        mock_redis_hdel,
+        mock_redis_delete,
+        mock_redis_expireat,
+        mock_luascript_get_device_data,
+        mock_luascript_connect_device,
+        mock_luascript_disconnect_device,
+        mock_luascript_get_chat_routes,
+    ):
+        device_data = device_data
+        MockRedisClient.redis_store[f"device:{device_data['did']}"] = device_data
+
+        communicator = WebsocketCommunicator(
+            application=P2PChatConsumer(),
+            path="/test/ws/chat/p2p/",
+            subprotocols=[device_data["did"]],
+        )
+
+        await communicator.connect()
+        await communicator.receive_json_from()
+
+        await communicator.send_to(text_data=json.dumps({"to": to, "message": "Hi"}))
+        response = await communicator.receive_json_from()
+
+        assert response["status"] is False
+        assert response["message"] == message
+
+        await communicator.disconnect()
+
+
+class TestConsumerGroupChat:
+    async def send_group(self, communicator: WebsocketCommunicator, **frame) -> dict:
+        await communicator.send_to(
+            text_data=json.dumps({"event": CHAT_EVENT_TYPES.CHAT_GROUP.value, **frame})
+        )
+
+        return await communicator.receive_json_from()
+
+    async def test_group_message_is_sent_to_every_other_member(self, connect_device):
+        sender, _ = await connect_device(str(uuid.uuid4()), "sender.linq", CHAT_PATH)
+        member, _ = await connect_device(str(uuid.uuid4()), "member.linq", CHAT_PATH)
+
+        response = await self.send_group(sender, action="join", group="Book Club")
+
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_GROUP.value
+        assert response["status"] is True
+        assert response["message"] == "Joined book_club"
+
+        await self.send_group(member, action="join", group="book_club")
+
+        response = await self.send_group(sender, action="message", group="book_club", message="Hi")
+        received = await member.receive_json_from()
+
+        assert response["status"] is True
+        assert response["message"] == "send"
+        assert received["event"] == CHAT_EVENT_TYPES.CHAT_GROUP.value
+        assert received["data"]["group"] == "book_club"
+        assert received["data"]["alias"] == "sender.linq"
+        assert received["data"]["message"] == "Hi"
+
+        # the sender does not get it's own message back
+        assert await sender.receive_nothing()
+
+        await sender.disconnect()
+        await member.disconnect()
+
+    async def test_group_message_requires_membership(self, connect_device):
+        communicator, _ = await connect_device(str(uuid.uuid4()), "sender.linq", CHAT_PATH)
+
+        response = await self.send_group(
+            communicator, action="message", group="book_club", message="Hi"
+        )
+
+        assert response["status"] is False
+        assert response["message"] == "You are not a member of book_club"
+
+        await self.send_group(communicator, action="join", group="book_club")
+        response = await self.send_group(communicator, action="leave", group="book_club")
+
+        assert response["message"] == "Left book_club"
+
+        response = await self.send_group(
+            communicator, action="message", group="book_club", message="Hi"
+        )
+
+        assert response["status"] is False
+
+        await communicator.disconnect()
+
+    async def test_group_join_is_refused_when_group_is_full(self, settings, connect_device):
+        settings.CHAT_GROUP = {"MAX_MEMBERS": 1}
+
+        first, _ = await connect_device(str(uuid.uuid4()), "first.linq", CHAT_PATH)
+        second, _ = await connect_device(str(uuid.uuid4()), "second.linq", CHAT_PATH)
+
+        await self.send_group(first, action="join", group="book_club")
+        response = await self.send_group(second, action="join", group="book_club")
+
+        assert response["status"] is False
+        assert response["message"] == "book_club is full"
+
+        await first.disconnect()
+        await second.disconnect()
+
+    @pytest.mark.parametrize(
+        "frame, message",
+        [
+            ({"action": "shout", "group": "book_club"}, "Key 'action' must be one of"),
+            ({"action": "join"}, "Missing key 'group'"),
+            ({"action": "join", "group": "ab"}, "Group name must be between 3 to 30"),
+        ],
+    )
+    async def test_invalid_group_frames(self, frame, message, connect_device):
+        communicator, _ = await connect_device(str(uuid.uuid4()), "sender.linq", CHAT_PATH)
+
+        response = await self.send_group(communicator, **frame)
+
+        assert response["status"] is False
+        assert response["message"].startswith(message)
+
+        await communicator.disconnect()
+
+
+class TestConsumerOfflineDelivery:
+    async def queue_chats(self, connect_device, recipient_did: str, messages: list[str]) -> None:
+        # the recipient alias still points to it's offline device
+        recipient: str = f"device:{recipient_did}"
+        MockRedisClient.redis_store[recipient] = {"did": recipient_did}
+        MockRedisClient.redis_store["device:alias"][recipient] = "recipient.linq"
+        MockRedisClient.redis_store["alias:recipient.linq:offline"] = recipient
+
+        sender, _ = await connect_device(str(uuid.uuid4()), "sender.linq", CHAT_PATH)
+
+        for message in messages:
+            await sender.send_to(text_data=json.dumps({"to": "recipient.linq", "message": message}))
+            response = await sender.receive_json_from()
+
+            assert response["status"] is True
+            assert response["message"] == "queued"
+            assert response["data"]["seq"] == int(message)
+
+        await sender.disconnect()
+
+    async def test_chat_to_offline_device_is_queued_then_drained_on_connect(
+        self, settings, connect_device
+    ):
+        settings.CHAT_INBOX = {**settings.CHAT_INBOX, "BATCH_SIZE": 2}
+        recipient_did: str = str(uuid.uuid4())
+        await self.queue_chats(connect_device, recipient_did, ["1", "2", "3"])
+
+        recipient, connected = await connect_device(recipient_did, "recipient.linq", CHAT_PATH)
+
+        assert connected["data"]["inbox"] == 3
+
+        first = await recipient.receive_json_from()
+        second = await recipient.receive_json_from()
+
+        assert first["event"] == CHAT_EVENT_TYPES.CHAT_INBOX.value
+        assert [m["data"]["message"] for m in first["data"]["messages"]] == ["1", "2"]
+        assert first["data"]["cursor"] == first["data"]["messages"][-1]["id"]
+        assert [m["data"]["message"] for m in second["data"]["messages"]] == ["3"]
+        assert first["data"]["messages"][0]["data"]["alias"] == "sender.linq"
+        assert [m["data"]["seq"] for m in first["data"]["messages"]] == [1, 2]
+
+        # messages are only removed once the client acknowledges their cursor
+        assert len(MockRedisClient.redis_store[f"device:{recipient_did}:inbox"]) == 3
+
+        await recipient.send_to(
+            text_data=json.dumps({"event": "chat.inbox", "cursor": second["data"]["cursor"]})
+        )
+
+        assert await recipient.receive_nothing()
+        assert MockRedisClient.redis_store[f"device:{recipient_did}:inbox"] == []
+
+        await recipient.disconnect()
+
+    async def test_unacknowledged_chats_are_drained_again_on_reconnect(
+        self, settings, connect_device
+    ):
+        settings.CHAT_INBOX = {**settings.CHAT_INBOX, "BATCH_SIZE": 2}
+        recipient_did: str = str(uuid.uuid4())
+        await self.queue_chats(connect_device, recipient_did, ["1", "2", "3"])
+
+        # the connection drops mid-drain, before any cursor is acknowledged
+        recipient, _ = await connect_device(recipient_did, "recipient.linq", CHAT_PATH)
+        first = await recipient.receive_json_from()
+        await recipient.disconnect()
+
+        recipient, connected = await connect_device(recipient_did, "recipient.linq", CHAT_PATH)
+
+        assert connected["data"]["inbox"] == 3
+        assert (await recipient.receive_json_from())["data"] == first["data"]
+
+        await recipient.disconnect()
+
+        # reconnecting with the cursor of the last received frame skips it's messages
+        recipient, connected = await connect_device(
+            recipient_did, "recipient.linq", f"{CHAT_PATH}?inbox={first['data']['cursor']}"
+        )
+        remaining = await recipient.receive_json_from()
+
+        assert [m["data"]["message"] for m in remaining["data"]["messages"]] == ["3"]
+        assert len(MockRedisClient.redis_store[f"device:{recipient_did}:inbox"]) == 1
+
+        await recipient.disconnect()
+
+    async def test_chat_to_an_alias_the_offline_device_no_longer_owns_is_not_queued(
+        self, connect_device
+    ):
+        recipient: str = f"device:{uuid.uuid4()}"
+        MockRedisClient.redis_store[recipient] = {"did": recipient}
+        MockRedisClient.redis_store["device:alias"][recipient] = "renamed.linq"
+        MockRedisClient.redis_store["alias:recipient.linq:offline"] = recipient
+
+        sender, _ = await connect_device(str(uuid.uuid4()), "sender.linq", CHAT_PATH)
+        await sender.send_to(text_data=json.dumps({"to": "recipient.linq", "message": "Hi"}))
+        response = await sender.receive_json_from()
+
+        assert response["status"] is False
+        assert response["message"] == "recipient.linq is offline or not available"
+        assert f"{recipient}:inbox" not in MockRedisClient.redis_store
+
+        await sender.disconnect()
+
+    @pytest.mark.parametrize("cursor", ["not-a-cursor", 1, None])
+    async def test_inbox_ack_with_invalid_cursor(self, cursor, connect_device):
+        recipient, _ = await connect_device(str(uuid.uuid4()), "recipient.linq", CHAT_PATH)
+
+        await recipient.send_to(text_data=json.dumps({"event": "chat.inbox", "cursor": cursor}))
+        response = await recipient.receive_json_from()
+
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_INBOX.value
+        assert response["status"] is False
+
+        await recipient.disconnect()
+
+
+class TestConsumerAcknowledgements:
+    async def test_cumulative_ack_is_forwarded_to_sender_once(self, connect_device):
+        sender_did, recipient_did = str(uuid.uuid4()), str(uuid.uuid4())
+
+        sender, _ = await connect_device(sender_did, "sender.linq", CHAT_PATH)
+        recipient, _ = await connect_device(recipient_did, "recipient.linq", CHAT_PATH)
+
+        for message in ["1", "2", "3"]:
+            await sender.send_to(text_data=json.dumps({"to": "recipient.linq", "message": message}))
+            await sender.receive_json_from()
+            received = await recipient.receive_json_from()
+
+        assert received["data"]["seq"] == 3
+
+        # one ack for every message up to 2, then a stale ack that is ignored
+        await recipient.send_to(
+            text_data=json.dumps({"event": "chat.ack", "did": sender_did, "seq": 2})
+        )
+        await recipient.send_to(
+            text_data=json.dumps({"event": "chat.ack", "did": sender_did, "seq": 1})
+        )
+        await recipient.send_to(
+            text_data=json.dumps({"event": "chat.ack", "did": sender_did, "seq": 3})
+        )
+
+        first = await sender.receive_json_from()
+        second = await sender.receive_json_from()
+
+        assert first["event"] == CHAT_EVENT_TYPES.CHAT_ACK.value
+        assert first["data"] == {"alias": "recipient.linq", "did": recipient_did, "seq": 2}
+        assert second["data"]["seq"] == 3
+        assert await sender.receive_nothing()
+
+        await sender.disconnect()
+        await recipient.disconnect()
+
+    async def test_chats_are_held_back_until_earlier_ones_are_acknowledged(
+        self, settings, connect_device
+    ):
+        settings.WEBSOCKET_OUTBOUND = {**settings.WEBSOCKET_OUTBOUND, "MAX_UNACKED": 1}
+        sender_did, recipient_did = str(uuid.uuid4()), str(uuid.uuid4())
+
+        sender, _ = await connect_device(sender_did, "sender.linq", CHAT_PATH)
+        recipient, _ = await connect_device(recipient_did, "recipient.linq", CHAT_PATH)
+
+        for message in ["1", "2"]:
+            await sender.send_to(text_data=json.dumps({"to": "recipient.linq", "message": message}))
+            await sender.receive_json_from()
+
+        assert (await recipient.receive_json_from())["data"]["seq"] == 1
+        assert await recipient.receive_nothing()
+
+        await recipient.send_to(
+            text_data=json.dumps({"event": "chat.ack", "did": sender_did, "seq": 1})
+        )
+
+        assert (await recipient.receive_json_from())["data"]["seq"] == 2
+
+        await sender.disconnect()
+        await recipient.disconnect()
+
+    async def test_ack_past_the_last_sequence_is_ignored(self, connect_device):
+        recipient, _ = await connect_device(str(uuid.uuid4()), "recipient.linq", CHAT_PATH)
+
+        await recipient.send_to(
+            text_data=json.dumps({"event": "chat.ack", "did": str(uuid.uuid4()), "seq": 5})
+        )
+
+        assert await recipient.receive_nothing()
+
+        await recipient.disconnect()
+
+    @pytest.mark.parametrize(
+        "frame",
+        [
+            {"event": "chat.ack", "did": "not-a-uuid", "seq": 1},
+            {"event": "chat.ack", "did": "00000000-0000-0000-0000-000000000000", "seq": "1"},
+            {"event": "chat.ack", "seq": 1},
+        ],
+    )
+    async def test_invalid_ack_frames(self, frame, connect_device):
+        recipient, _ = await connect_device(str(uuid.uuid4()), "recipient.linq", CHAT_PATH)
+
+        await recipient.send_to(text_data=json.dumps(frame))
+        response = await recipient.receive_json_from()
+
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_ACK.value
+        assert response["status"] is False
+
+        await recipient.disconnect()
@@ -2,6 +2,7 @@ import json
 import uuid
 from datetime import datetime, timedelta
 
+import msgpack
 import pytest
 from channels.testing import WebsocketCommunicator
 from django.utils.text import slugify
@@ -10,7 +11,7 @@ from chat.consumers.connect_consumer import ConnectConsumer
 from chat.events import DEVICE_EVENT_TYPES
 from tests.mocks import MockRedisClient
 
-pytestmark = pytest.mark.asyncio
+pytestmark = [pytest.mark.asyncio, pytest.mark.usefixtures("mock_luascript_rate_limit")]
 
 
 class TestConsumerConnect:
@@ -18,6 +19,7 @@ class TestConsumerConnect:
         self,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
     ):
         """
         Connection is accepted but will later be closed if no uuid is present
@@ -44,6 +46,7 @@ class TestConsumerConnect:
         self,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
     ):
         """
         Connection is accepted but will later be closed if provided uuid is invalid
@@ -72,8 +75,9 @@ class TestConsumerConnect:
         mock_redis_hset,
         mock_redis_hget,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         """
@@ -105,8 +109,9 @@ class TestConsumerReceive:
         mock_redis_hget,
         mock_redis_hset,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         communicator = WebsocketCommunicator(
@@ -136,8 +141,9 @@ class TestConsumerReceive:
         mock_redis_hget,
         mock_redis_hset,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         communicator = WebsocketCommunicator(
@@ -179,8 +185,9 @@ class TestConsumerReceive:
         mock_redis_hget,
         mock_redis_hset,
         mock_redis_hdel,
+        mock_luascript_disconnect_device,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         communicator = WebsocketCommunicator(
@@ -222,9 +229,11 @@ class TestConsumerReceive:
         mock_redis_hset,
         mock_redis_hget,
         mock_redis_hdel,
-        mock_redis_hvals,
+        mock_luascript_disconnect_device,
+        mock_luascript_reserve_alias,
+        mock_redis_publish,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
+        mock_luascript_connect_device,
         mock_luascript_get_device_data,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -263,3 +272,81 @@ class TestConsumerReceive:
         assert set_alias_response["message"] == test_message
 
         await communicator.disconnect()
+
+
+class TestConsumerCodec:
+    async def test_msgpack_codec_is_negotiated_at_index_1_in_subprotocols(
+        self,
+        mock_redis_hget,
+        mock_redis_hset,
+        mock_redis_hdel,
+        mock_luascript_disconnect_device,
+        mock_redis_expireat,
+        mock_luascript_connect_device,
+        mock_luascript_get_device_data,
+    ):
+        communicator = WebsocketCommunicator(
+            application=ConnectConsumer(),
+            path="/test/ws/connect/",
+            subprotocols=[str(uuid.uuid4()), "msgpack"],
+        )
+
+        connected, subprotocol = await communicator.connect()
+        response = msgpack.unpackb(await communicator.receive_from())
+
+        assert connected
+        assert subprotocol == "msgpack"
+        assert response["message"] == "Current device data"
+
+        # bytes frames are decoded with msgpack, text frames as json
+        await communicator.send_to(bytes_data=msgpack.packb({"name": "testuser_001"}))
+        response = msgpack.unpackb(await communicator.receive_from())
+
+        assert response["message"] == "Missing key 'alias'"
+
+        await communicator.send_to(text_data='{"name": "testuser_001"}')
+        response = msgpack.unpackb(await communicator.receive_from())
+
+        assert response["message"] == "Missing key 'alias'"
+
+        await communicator.send_to(bytes_data=b"\xc1")
+        response = msgpack.unpackb(await communicator.receive_from())
+
+        assert response["status"] is False
+        assert response["message"] == "Message(s) must be in json format"
+
+        await communicator.disconnect()
+
+    @pytest.mark.parametrize(
+        "subprotocols, echoed",
+        [([], "did"), (["json"], "json"), (["batch"], "did"), (["MsgPack", "batch"], "MsgPack")],
+    )
+    async def test_accept_echoes_the_selected_codec_or_else_the_device_uuid(
+        self, subprotocols, echoed, mocked_redis
+    ):
+        did: str = str(uuid.uuid4())
+        communicator = WebsocketCommunicator(
+            application=ConnectConsumer(),
+            path="/test/ws/connect/",
+            subprotocols=[did, *subprotocols],
+        )
+
+        connected, subprotocol = await communicator.connect()
+
+        assert connected
+        assert subprotocol == (did if echoed == "did" else echoed)
+
+        await communicator.disconnect()
+
+    async def test_connection_requesting_an_unavailable_codec_is_closed(self, connect_device):
+        communicator, response = await connect_device(
+            str(uuid.uuid4()), path="/ws/connect/", subprotocols=("protobuf",)
+        )
+
+        assert response["status"] is False
+        assert response["message"] == (
+            "Codec at index 1 in subprotocols must be one of json, msgpack, cbor"
+        )
+        assert (await communicator.receive_output())["type"] == "websocket.close"
+
+        await communicator.disconnect()
@@ -6,6 +6,9 @@ from django.utils.text import slugify
 from chat.services.consumer_services import ConsumerServices
 from tests.mocks import MockRedisClient
 
+# channel of device:001 in the mocked redis store
+CHANNEL: str = "specific_uniqu_str_by_channels"
+
 
 class TestConsumerServices:
     @pytest.mark.parametrize(
@@ -64,13 +67,16 @@ class TestConsumerServices:
             ("linq", "linq is not allowed", False),
         ],
     )
-    def test_format_and_verify_alias_with_wrong_alias(self, test_alias, test_message, test_status):
+    @pytest.mark.asyncio
+    async def test_format_and_verify_alias_with_wrong_alias(
+        self, test_alias, test_message, test_status
+    ):
         """
         This method first passes the alias to the format_and_validate_alias
         if the returned status is true we then proceed, if not we return the
         reason, alias and status
         """
-        message, alias, status = ConsumerServices.format_and_verify_alias(
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
             device="device:123", alias=test_alias
         )
         test_alias = slugify(str(test_alias).lower()).replace("-", "_")
@@ -98,21 +104,22 @@ class TestConsumerServices:
             ),
         ],
     )
-    def test_format_and_verify_alias_with_correct_alias_but_already_device_alias_or_alias_taken(
+    @pytest.mark.asyncio
+    async def test_format_and_verify_alias_with_correct_alias_but_already_device_alias_or_alias_taken(  # noqa: E501
         self,
         test_device,
         test_alias,
         test_message,
         test_status,
         mock_redis_hget,
-        mock_redis_hvals,
+        mock_luascript_reserve_alias,
         mock_redis_hset,
     ):
         """
         This method first passes the alias to the format_and_validate_alias method.
         If the returned status is true we then proceed, if not, we stop.
         """
-        message, alias, status = ConsumerServices.format_and_verify_alias(
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
             device=test_device, alias=test_alias
         )
         test_alias = slugify(str(test_alias).lower()).replace("-", "_")
@@ -124,42 +131,74 @@ class TestConsumerServices:
         assert alias == test_alias
         assert message == test_message
 
-    def test_set_device_data_sets_device_data_in_redis_store(
-        self,
-        mock_redis_hset,
-        mock_redis_expireat,
-        mock_luascript_set_alias_device,
+    @pytest.mark.asyncio
+    async def test_format_and_verify_alias_claims_free_alias_for_device(
+        self, mock_luascript_reserve_alias
     ):
-        assert (
-            ConsumerServices.set_device_data(
-                device="device_001",
-                did=uuid.uuid4(),
-                channel="channels_auto_generated_channel_name",
-            )
-            is None
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
+            device="device:004", alias="new_alias"
         )
 
-    def test_set_device_alias_saves_alias_in_redis_store(
-        self, mock_redis_hset, mock_redis_expireat
+        assert status is True
+        assert message == "Alias accepted"
+        assert MockRedisClient.redis_store["alias:device"]["new_alias.linq"] == "device:004"
+        assert MockRedisClient.redis_store["device:alias"]["device:004"] == "new_alias.linq"
+
+    @pytest.mark.asyncio
+    async def test_format_and_verify_alias_of_offline_device_is_still_taken(
+        self, mock_luascript_disconnect_device, mock_luascript_reserve_alias
     ):
-        """NOTE: This method assumes the alias provided has already been validated and verified"""
-        assert (
-            ConsumerServices.set_device_alias(
-                device="device:001",
-                alias="testuser",
-                device_alias="device:alias",
-                alias_device="alias:device",
-            )
-            is None
+        await ConsumerServices.disconnect_device(device="device:001", channel=CHANNEL)
+
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
+            device="device:004", alias="testalias_001"
         )
 
-    def test_get_device_data(self, device_data, mock_luascript_get_device_data):
+        assert status is False
+        assert message == "Alias already taken"
+        assert MockRedisClient.redis_store["alias:testalias_001.linq:offline"] == "device:001"
+
+    @pytest.mark.asyncio
+    async def test_format_and_verify_alias_of_expired_offline_device_can_be_claimed(
+        self, mock_luascript_disconnect_device, mock_luascript_reserve_alias
+    ):
+        await ConsumerServices.disconnect_device(device="device:001", channel=CHANNEL)
+        del MockRedisClient.redis_store["device:001"]
+
+        message, alias, status = await ConsumerServices.format_and_verify_alias(
+            device="device:004", alias="testalias_001"
+        )
+
+        assert status is True
+        assert MockRedisClient.redis_store["alias:device"]["testalias_001.linq"] == "device:004"
+        assert "alias:testalias_001.linq:offline" not in MockRedisClient.redis_store
+
+    @pytest.mark.asyncio
+    async def test_set_device_data_sets_device_data_in_redis_store(
+        self,
+        mock_luascript_connect_device,
+    ):
+        did: uuid.UUID = uuid.uuid4()
+
+        data = await ConsumerServices.set_device_data(
+            device="device_001",
+            did=did,
+            channel="channels_auto_generated_channel_name",
+        )
+
+        assert type(data) is dict
+        assert data["did"] == str(did)
+        assert data["channel"] == "channels_auto_generated_channel_name"
+        assert MockRedisClient.redis_store["device_001"] == data
+
+    @pytest.mark.asyncio
+    async def test_get_device_data(self, device_data, mock_luascript_get_device_data):
         device_data = device_data
 
         # create device data
         MockRedisClient.redis_store[f"device:{device_data['did']}"] = device_data
 
-        data = ConsumerServices.get_device_data(device=f"device:{device_data['did']}")
+        data = await ConsumerServices.get_device_data(device=f"device:{device_data['did']}")
 
         assert type(data) is dict
         assert device_data["did"] == data["did"]
@@ -167,5 +206,88 @@ class TestConsumerServices:
         assert device_data["ttl"] == data["ttl"]
         assert device_data["alias"] == data["alias"]
 
-    def test_set_alias_device(self, mock_luascript_set_alias_device):
-        assert ConsumerServices.set_alias_device("device:005") == 1
+    @pytest.mark.asyncio
+    async def test_get_chat_route(self, mock_luascript_get_chat_route):
+        route = await ConsumerServices.get_chat_route(alias="testalias_002.linq")
+
+        assert route == {
+            "device": "device:001",
+            "did": MockRedisClient.redis_store["device:001"]["did"],
+            "channel": MockRedisClient.redis_store["device:001"]["channel"],
+            "alias": "testalias_002.linq",
+        }
+
+    @pytest.mark.asyncio
+    async def test_get_chat_route_with_unknown_alias(self, mock_luascript_get_chat_route):
+        route = await ConsumerServices.get_chat_route(alias="unknown.linq")
+
+        assert route["device"] is None
+        assert route["channel"] is None
+        assert route["did"] is None
+
+    @pytest.mark.asyncio
+    async def test_disconnect_device_removes_channel_and_alias_device(
+        self, mock_luascript_disconnect_device
+    ):
+        removed = await ConsumerServices.disconnect_device(device="device:001", channel=CHANNEL)
+
+        assert removed == {
+            "channel": True,
+            "alias": "testalias_001.linq",
+            "alias_device": True,
+            "device_alias": False,
+        }
+        assert MockRedisClient.redis_store["device:001"]["channel"] is None
+        assert MockRedisClient.redis_store["alias:device"]["testalias_001.linq"] is None
+        assert MockRedisClient.redis_store["device:alias"]["device:001"] == "testalias_001.linq"
+
+    @pytest.mark.asyncio
+    async def test_disconnect_device_can_forget_device_alias(
+        self, mock_luascript_disconnect_device
+    ):
+        removed = await ConsumerServices.disconnect_device(
+            device="device:001", channel=CHANNEL, forget_alias=True
+        )
+
+        assert removed["device_alias"] is True
+        assert MockRedisClient.redis_store["device:alias"]["device:001"] is None
+
+    @pytest.mark.asyncio
+    async def test_stale_disconnect_of_a_reconnected_device_removes_nothing(
+        self, mock_luascript_disconnect_device
+    ):
+        removed = await ConsumerServices.disconnect_device(
+            device="device:001", channel="previous_channel", forget_alias=True
+        )
+
+        assert removed == {
+            "channel": False,
+            "alias": None,
+            "alias_device": False,
+            "device_alias": False,
+        }
+        assert MockRedisClient.redis_store["device:001"]["channel"] == CHANNEL
+        assert MockRedisClient.redis_store["alias:device"]["testalias_001.linq"] == "device:001"
+        assert MockRedisClient.redis_store["device:alias"]["device:001"] == "testalias_001.linq"
+
+    @pytest.mark.asyncio
+    async def test_disconnect_device_without_alias(self, mock_luascript_disconnect_device):
+        removed = await ConsumerServices.disconnect_device(device="device:004", channel=CHANNEL)
+
+        assert removed == {
+            "channel": False,
+            "alias": None,
+            "alias_device": False,
+            "device_alias": False,
+        }
+
+    @pytest.mark.asyncio
+    async def test_get_device_route(self, mock_luascript_get_device_route):
+        route = await ConsumerServices.get_device_route(device="device:001")
+
+        assert route == {
+            "device": "device:001",
+            "did": MockRedisClient.redis_store["device:001"]["did"],
+            "channel": MockRedisClient.redis_store["device:001"]["channel"],
+            "alias": "testalias_001.linq",
+        }
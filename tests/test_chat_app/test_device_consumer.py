@@ -0,0 +1,221 @@
+import json
+import time
+import uuid
+
+import pytest
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core import signing
+
+from chat.consumers.device_consumer import DeviceConsumer
+from chat.events import CHAT_EVENT_TYPES, DEVICE_EVENT_TYPES, SCAN_EVENT_TYPES
+from tests.mocks import MockRedisClient
+
+pytestmark = pytest.mark.asyncio
+
+
+async def send_frame(communicator: WebsocketCommunicator, **frame) -> dict:
+    await communicator.send_to(text_data=json.dumps(frame))
+
+    return await communicator.receive_json_from()
+
+
+class TestDeviceConsumer:
+    async def test_device_sets_up_and_chats_on_a_single_socket(self, connect_device):
+        did: str = str(uuid.uuid4())
+        MockRedisClient.redis_store["device:recipient"] = {
+            "did": "recipient",
+            "channel": "recipient-channel",
+        }
+        MockRedisClient.redis_store["alias:device"]["recipient.linq"] = "device:recipient"
+
+        communicator, response = await connect_device(did)
+
+        assert response["event"] == DEVICE_EVENT_TYPES.DEVICE_CONNECT.value
+        assert response["status"] is True
+        assert "alias" not in response["data"]
+
+        # chats need the device setup to be complete
+        response = await send_frame(
+            communicator, event="chat.message", to="recipient.linq", message="Hi"
+        )
+
+        assert response["event"] == CHAT_EVENT_TYPES.CHAT_MESSAGE.value
+        assert response["status"] is False
+        assert response["message"] == "Device setup not complete"
+
+        response = await send_frame(communicator, event="device.setup", alias="newdevice")
+
+        assert response["event"] == DEVICE_EVENT_TYPES.DEVICE_SETUP.value
+        assert response["status"] is True
+
+        response = await send_frame(
+            communicator, event="chat.message", to="recipient.linq", message="Hi"
+        )
+        received = await get_channel_layer().receive("recipient-channel")
+
+        assert response["status"] is True
+        assert response["message"] == "send"
+        assert received["data"]["data"]["alias"] == "newdevice.linq"
+        assert received["data"]["data"]["did"] == did
+
+        await communicator.disconnect()
+
+    @pytest.mark.parametrize("frame", [{"to": "recipient.linq"}, {"event": "chat.unknown"}])
+    async def test_frames_without_a_handler_are_refused(self, frame, connect_device):
+        communicator, _ = await connect_device(str(uuid.uuid4()), "device.linq")
+
+        response = await send_frame(communicator, **frame)
+
+        assert response["event"] == frame.get("event")
+        assert response["status"] is False
+        assert response["message"] == f"Unknown event {frame.get('event')!r}"
+
+        await communicator.disconnect()
+
+    async def test_device_scans_and_sets_up_another_device(self, connect_device):
+        scanned_did: str = str(uuid.uuid4())
+        MockRedisClient.redis_store[f"device:{scanned_did}"] = {
+            "did": scanned_did,
+            "channel": "scanned-channel",
+        }
+        channel_layer = get_channel_layer()
+
+        communicator, _ = await connect_device(str(uuid.uuid4()), "device.linq")
+
+        response = await send_frame(communicator, event="scan.setup", alias="scanned")
+
+        assert response["status"] is False
+        assert response["message"] == "No scanned device, send a scan.connect frame first"
+
+        response = await send_frame(communicator, event="scan.connect", did=scanned_did)
+        received = await channel_layer.receive("scanned-channel")
+
+        assert response["event"] == SCAN_EVENT_TYPES.SCAN_CONNECT.value
+        assert response["status"] is True
+        assert received["data"]["event"] == SCAN_EVENT_TYPES.SCAN_CONNECT.value
+
+        response = await send_frame(communicator, event="scan.setup", alias="scanned")
+        received = await channel_layer.receive("scanned-channel")
+
+        assert response["event"] == SCAN_EVENT_TYPES.SCAN_SETUP.value
+        assert response["status"] is True
+        assert response["data"]["alias"] == "scanned.linq"
+        assert received["data"]["event"] == SCAN_EVENT_TYPES.SCAN_SETUP.value
+        assert received["data"]["status"] is True
+
+        # the scanning device keeps it's socket
+        assert await communicator.receive_nothing()
+
+        await communicator.disconnect()
+
+    async def test_scanned_device_must_be_connected_without_alias(self, connect_device):
+        communicator, _ = await connect_device(str(uuid.uuid4()), "device.linq")
+
+        for did in ("not-a-valid-uuid", str(uuid.uuid4())):
+            response = await send_frame(communicator, event="scan.connect", did=did)
+
+            assert response["status"] is False
+            assert response["message"] == "Invalid channel or device already setup"
+
+        await communicator.disconnect()
+
+    async def test_device_disconnect_forgets_the_device_alias(self, connect_device):
+        did: str = str(uuid.uuid4())
+        communicator, _ = await connect_device(did, "device.linq")
+
+        response = await send_frame(communicator, event="device.disconnect")
+
+        assert response["event"] == DEVICE_EVENT_TYPES.DEVICE_DISCONNECT.value
+        assert response["status"] is True
+        assert (await communicator.receive_output())["type"] == "websocket.close"
+
+        await communicator.disconnect()
+
+        assert MockRedisClient.redis_store["device:alias"][f"device:{did}"] is None
+
+
+class TestResume:
+    async def go_offline(self, connect_device, did: str) -> str:
+        """Connect & disconnect a device with an alias, and return it's resume token."""
+        communicator, response = await connect_device(did, "device.linq")
+        await communicator.disconnect()
+
+        assert MockRedisClient.redis_store[f"device:{did}"]["channel"] is None
+
+        return response["data"]["resume"]
+
+    async def test_reconnect_within_grace_resumes_the_session(self, connect_device):
+        did: str = str(uuid.uuid4())
+        MockRedisClient.redis_store[f"device:{did}:groups"] = ["friends"]
+        token: str = await self.go_offline(connect_device, did)
+
+        communicator, response = await connect_device(did, path=f"/ws/?resume={token}")
+
+        assert response["event"] == DEVICE_EVENT_TYPES.DEVICE_CONNECT.value
+        assert response["status"] is True
+        assert response["message"] == "Resumed"
+        assert response["data"]["alias"] == "device.linq"
+        assert signing.loads(response["data"]["resume"], salt=DeviceConsumer.resume_salt) == {
+            "did": did
+        }
+
+        # rebound to the new channel, and back in it's groups
+        device: dict = MockRedisClient.redis_store[f"device:{did}"]
+        assert device["channel"] is not None
+        assert "offline" not in device
+        assert MockRedisClient.redis_store["alias:device"]["device.linq"] == f"device:{did}"
+
+        assert device["channel"] in get_channel_layer().groups["chat_group.friends"]
+
+        await communicator.disconnect()
+
+    @pytest.mark.parametrize("token", ["tampered", "other did", "expired"])
+    async def test_invalid_tokens_fall_back_to_the_handshake(self, token, settings, connect_device):
+        did: str = str(uuid.uuid4())
+        tokens: dict = {
+            "tampered": (await self.go_offline(connect_device, did))[:-1],
+            "other did": signing.dumps({"did": str(uuid.uuid4())}, salt="chat.resume"),
+            "expired": await self.go_offline(connect_device, did),
+        }
+        settings.CHAT_RESUME = {**settings.CHAT_RESUME, "MAX_AGE": -1}
+
+        communicator, response = await connect_device(did, path=f"/ws/?resume={tokens[token]}")
+
+        assert response["status"] is True
+        assert response["message"] == "Current device data"
+
+        await communicator.disconnect()
+
+    async def test_reconnect_after_grace_falls_back_to_the_handshake(
+        self, settings, connect_device
+    ):
+        did: str = str(uuid.uuid4())
+        token: str = await self.go_offline(connect_device, did)
+        MockRedisClient.redis_store[f"device:{did}"]["offline"] = (
+            int(time.time()) - settings.CHAT_RESUME["GRACE"] - 1
+        )
+
+        communicator, response = await connect_device(did, path=f"/ws/?resume={token}")
+
+        assert response["message"] == "Current device data"
+        assert "offline" not in MockRedisClient.redis_store[f"device:{did}"]
+
+        await communicator.disconnect()
+
+
+@pytest.mark.parametrize(
+    "path, event",
+    [
+        ("/ws/", DEVICE_EVENT_TYPES.DEVICE_CONNECT.value),
+        ("/ws/connect/", DEVICE_EVENT_TYPES.DEVICE_CONNECT.value),
+        ("/ws/chat/p2p/", CHAT_EVENT_TYPES.CHAT_CONNECT.value),
+        ("/ws/disconnect/", DEVICE_EVENT_TYPES.DEVICE_CONNECT.value),
+    ],
+)
+async def test_ws_endpoint_and_it_aliases_are_routed(path, event, connect_device):
+    communicator, response = await connect_device(str(uuid.uuid4()), path=path)
+
+    assert response["event"] == event
+
+    await communicator.disconnect()
@@ -0,0 +1,134 @@
+import hashlib
+
+import pytest
+from redis import exceptions as redis_exceptions
+
+from chat.lua_scripts import LuaScripts, ScriptRegistry, scripts
+from chat.middleware import LuaScriptsMiddleware
+
+
+class MockScriptClient:
+    """Redis client that only knows the scripts loaded with script_load."""
+
+    def __init__(self):
+        self.loaded: set[str] = set()
+        self.evals: int = 0
+
+    async def script_load(self, source: str) -> str:
+        sha = hashlib.sha1(source.encode()).hexdigest()
+        self.loaded.add(sha)
+
+        return sha
+
+    async def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        if sha not in self.loaded:
+            raise redis_exceptions.NoScriptError("NOSCRIPT No matching script")
+
+        return list(keys_and_args)
+
+    async def eval(self, source: str, numkeys: int, *keys_and_args):
+        self.evals += 1
+
+        return list(keys_and_args)
+
+
+@pytest.fixture
+def registry():
+    registry = ScriptRegistry()
+    registry.register("return 1")
+    registry.register("return 2")
+
+    return registry
+
+
+class TestScriptRegistry:
+    def test_scripts_are_versioned_by_sha(self, registry):
+        sha = registry.register("return 1")
+
+        assert sha == hashlib.sha1(b"return 1").hexdigest()
+        assert len(registry.scripts) == 2
+
+    def test_lua_scripts_are_registered_at_import(self):
+        assert LuaScripts.connect_device.name == "connect_device"
+        assert scripts.scripts[LuaScripts.connect_device.sha] == LuaScripts.connect_device.source
+
+    @pytest.mark.asyncio
+    async def test_load_loads_every_script(self, registry):
+        client = MockScriptClient()
+
+        assert await registry.load(client=client) == 2
+        assert registry.loaded
+        assert client.loaded == set(registry.scripts)
+
+    @pytest.mark.asyncio
+    async def test_loaded_script_is_called_by_sha(self, registry):
+        client = MockScriptClient()
+        await registry.load(client=client)
+
+        sha = registry.register("return 1")
+
+        assert await registry.evalsha(sha, ["key"], ["arg"], client=client) == ["key", "arg"]
+        assert client.evals == 0
+
+    @pytest.mark.asyncio
+    async def test_noscript_falls_back_to_eval_and_reloads_in_background(
+        self, registry, monkeypatch
+    ):
+        client = MockScriptClient()
+        sha = registry.register("return 1")
+
+        async def load(client=None):
+            registry.loaded = True
+            return 2
+
+        monkeypatch.setattr(registry, "load", load)
+
+        assert await registry.evalsha(sha, ["key"], ["arg"], client=client) == ["key", "arg"]
+        assert client.evals == 1
+        assert registry.reloads == 1
+
+        await registry._loader
+
+        assert registry.loaded
+
+    @pytest.mark.asyncio
+    async def test_stand_in_replaces_script_by_name(self):
+        async def stand_in(keys: list, args: list, client=None):
+            return "stand-in"
+
+        with scripts.stand_in("get_device_route", stand_in):
+            assert await LuaScripts.get_device_route(keys=["device:001"]) == "stand-in"
+
+        assert "get_device_route" not in scripts.stand_ins
+
+
+class TestLuaScriptsMiddleware:
+    @pytest.mark.asyncio
+    async def test_scripts_are_loaded_on_lifespan_startup(self, monkeypatch):
+        loaded: list[bool] = []
+
+        async def load(client=None):
+            loaded.append(True)
+            return 0
+
+        monkeypatch.setattr(scripts, "load", load)
+
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent: list[dict] = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message)
+
+        async def inner(scope, receive, send):
+            raise AssertionError("lifespan should not reach the inner application")
+
+        await LuaScriptsMiddleware(inner)({"type": "lifespan"}, receive, send)
+
+        assert loaded == [True]
+        assert sent == [
+            {"type": "lifespan.startup.complete"},
+            {"type": "lifespan.shutdown.complete"},
+        ]
@@ -0,0 +1,296 @@
+"""
+The lua scripts shipped in chat.lua_scripts, run by SHA against an in-memory redis
+with a lua engine, see the lua_redis fixture. Consumer & service tests replace the
+scripts with the stand-ins of tests.mocks, these make sure the scripts themselves
+behave, in every key layout.
+"""
+import time
+import uuid
+
+import pytest
+
+from chat.lua_scripts import scripts
+from chat.services.alias_reaper import AliasReaper
+from chat.services.consumer_services import ConsumerServices
+from chat.services.rate_limiter import RateLimiter
+from src.utils import device_key, offline_alias_key
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(params=["hash", "keys", "cluster"])
+def layout(request, settings) -> str:
+    settings.REDIS_KEY_LAYOUT = "hash" if request.param == "hash" else "keys"
+    settings.REDIS_CLUSTER = request.param == "cluster"
+
+    return request.param
+
+
+async def connect(alias: str | None = None, channel: str = "channel.1") -> tuple[str, str]:
+    """Connect a new device, claiming alias when given. Returns it's did & device key."""
+    did: str = str(uuid.uuid4())
+    device: str = device_key(did)
+
+    await ConsumerServices.set_device_data(device=device, did=did, channel=channel)
+
+    if alias:
+        assert await ConsumerServices.reserve_alias(device=device, alias=alias) == 1
+
+    return did, device
+
+
+class TestAliases:
+    async def test_alias_is_claimed_once(self, layout, lua_redis):
+        _, device = await connect()
+        _, other = await connect()
+
+        assert await ConsumerServices.reserve_alias(device=device, alias="bob.linq") == 1
+        assert await ConsumerServices.reserve_alias(device=device, alias="bob.linq") == 0
+        assert await ConsumerServices.reserve_alias(device=other, alias="bob.linq") == -1
+
+        route: dict = await ConsumerServices.get_chat_route(alias="bob.linq")
+
+        assert route["device"] == device
+        assert route["channel"] == "channel.1"
+
+    async def test_previous_alias_is_released_on_alias_change(self, layout, lua_redis):
+        _, device = await connect("bob.linq")
+        _, other = await connect()
+
+        assert await ConsumerServices.reserve_alias(device=device, alias="robert.linq") == 1
+        assert await ConsumerServices.reserve_alias(device=other, alias="bob.linq") == 1
+        assert (await ConsumerServices.get_chat_route(alias="robert.linq"))["device"] == device
+
+    async def test_alias_of_an_offline_device_stays_taken_until_it_expires(self, layout, lua_redis):
+        _, device = await connect("bob.linq")
+        _, other = await connect()
+
+        await ConsumerServices.disconnect_device(device=device, channel="channel.1")
+
+        assert await ConsumerServices.reserve_alias(device=other, alias="bob.linq") == -1
+
+        await lua_redis.delete(device)
+
+        assert await ConsumerServices.reserve_alias(device=other, alias="bob.linq") == 1
+        assert (await ConsumerServices.get_chat_route(alias="bob.linq"))["device"] == other
+
+    async def test_forgotten_alias_can_be_claimed(self, layout, lua_redis):
+        _, device = await connect("bob.linq")
+        _, other = await connect()
+
+        removed: dict = await ConsumerServices.disconnect_device(
+            device=device, channel="channel.1", forget_alias=True
+        )
+
+        assert removed["channel"] is True
+        assert removed["device_alias"] is True
+        assert await ConsumerServices.reserve_alias(device=other, alias="bob.linq") == 1
+
+    async def test_reconnect_restores_alias_groups_and_inbox(self, layout, lua_redis):
+        did, device = await connect("bob.linq")
+        await ConsumerServices.join_group(
+            device=device, device_groups=f"{device}:groups", group="friends"
+        )
+        await ConsumerServices.disconnect_device(device=device, channel="channel.1")
+
+        assert (await ConsumerServices.get_chat_route(alias="bob.linq"))["channel"] is None
+
+        await ConsumerServices.store_message(alias="bob.linq", data={"message": "Hi"})
+        device_data: dict = await ConsumerServices.set_device_data(
+            device=device, did=did, channel="channel.2"
+        )
+
+        assert device_data["alias"] == "bob.linq"
+        assert list(device_data["groups"]) == ["friends"]
+        assert int(device_data["inbox"]) == 1
+        assert (await ConsumerServices.get_chat_route(alias="bob.linq"))["channel"] == "channel.2"
+
+    async def test_resume_rebinds_an_offline_device(self, layout, lua_redis):
+        did, device = await connect("bob.linq")
+        await ConsumerServices.disconnect_device(device=device, channel="channel.1")
+
+        resumed: dict = await ConsumerServices.resume_device(
+            device=device, did=did, channel="channel.2"
+        )
+
+        assert resumed == {"alias": "bob.linq", "inbox": 0, "groups": []}
+        assert (await ConsumerServices.get_chat_route(alias="bob.linq"))["channel"] == "channel.2"
+
+    async def test_resume_of_an_online_device_is_refused(self, layout, lua_redis):
+        did, device = await connect("bob.linq")
+
+        assert await ConsumerServices.resume_device(device=device, did=did, channel="x") is None
+
+    async def test_stale_disconnect_after_a_reconnect_removes_nothing(self, layout, lua_redis):
+        did, device = await connect("bob.linq")
+        await ConsumerServices.set_device_data(device=device, did=did, channel="channel.2")
+
+        # the disconnect of the first connection arrives after the reconnect
+        removed: dict = await ConsumerServices.disconnect_device(
+            device=device, channel="channel.1", forget_alias=True
+        )
+        route: dict = await ConsumerServices.get_chat_route(alias="bob.linq")
+
+        assert removed == {
+            "channel": False,
+            "alias": None,
+            "alias_device": False,
+            "device_alias": False,
+        }
+        assert route["device"] == device
+        assert route["channel"] == "channel.2"
+        assert await lua_redis.hget(device, "offline") is None
+        assert await lua_redis.exists(offline_alias_key("bob.linq")) == 0
+
+    async def test_offline_alias_is_dropped_when_the_device_comes_back(self, layout, lua_redis):
+        did, device = await connect("bob.linq")
+        await ConsumerServices.disconnect_device(device=device, channel="channel.1")
+
+        assert await ConsumerServices.get_offline_device(alias="bob.linq") == device
+
+        await ConsumerServices.resume_device(device=device, did=did, channel="channel.2")
+
+        assert await lua_redis.exists(offline_alias_key("bob.linq")) == 0
+
+        await ConsumerServices.disconnect_device(device=device, channel="channel.2")
+        await ConsumerServices.set_device_data(device=device, did=did, channel="channel.3")
+
+        assert await lua_redis.exists(offline_alias_key("bob.linq")) == 0
+
+    async def test_offline_alias_is_dropped_when_the_alias_is_forgotten(self, layout, lua_redis):
+        _, device = await connect("bob.linq")
+        # e.g left behind by an earlier disconnect of the device
+        await lua_redis.set(offline_alias_key("bob.linq"), device)
+
+        await ConsumerServices.disconnect_device(
+            device=device, channel="channel.1", forget_alias=True
+        )
+
+        assert await lua_redis.exists(offline_alias_key("bob.linq")) == 0
+        assert await ConsumerServices.get_offline_device(alias="bob.linq") is None
+
+    async def test_offline_alias_is_dropped_when_the_alias_changes(self, layout, lua_redis):
+        _, device = await connect("bob.linq")
+        await lua_redis.set(offline_alias_key("bob.linq"), device)
+
+        assert await ConsumerServices.reserve_alias(device=device, alias="robert.linq") == 1
+        assert await lua_redis.exists(offline_alias_key("bob.linq")) == 0
+
+    async def test_offline_alias_of_another_alias_is_not_trusted(self, layout, lua_redis):
+        _, device = await connect("bob.linq")
+        # a stale pointer, the device alias changed since
+        await lua_redis.set(offline_alias_key("robert.linq"), device)
+
+        assert await ConsumerServices.get_offline_device(alias="robert.linq") is None
+        assert await ConsumerServices.store_message(alias="robert.linq", data={"n": 1}) is None
+        assert (
+            await ConsumerServices.store_message(alias="robert.linq", data={"n": 1}, device=device)
+            is None
+        )
+        assert await ConsumerServices.read_inbox(device=device, count=10) == []
+
+    async def test_chat_routes_of_many_aliases(self, layout, lua_redis):
+        _, first = await connect("first.linq")
+        _, second = await connect("second.linq", channel="channel.2")
+
+        routes: dict = await ConsumerServices.get_chat_routes(
+            aliases=["first.linq", "second.linq", "nobody.linq"]
+        )
+
+        assert routes["first.linq"]["device"] == first
+        assert routes["second.linq"]["channel"] == "channel.2"
+        assert routes["nobody.linq"]["device"] is None
+
+    async def test_aliases_of_expired_devices_are_pruned(self, settings, lua_redis):
+        _, device = await connect("bob.linq")
+        await lua_redis.delete(device)
+
+        assert await AliasReaper().prune([device]) == 1
+        assert (await ConsumerServices.get_chat_route(alias="bob.linq"))["device"] is None
+
+
+class TestChats:
+    async def test_sequences_are_per_conversation_and_acks_are_cumulative(self, layout, lua_redis):
+        sender, _ = await connect()
+        _, first = await connect()
+        _, second = await connect()
+
+        assert await ConsumerServices.next_sequences(sender, [first, second]) == [1, 1]
+        assert await ConsumerServices.next_sequences(sender, [first]) == [2]
+
+        assert await ConsumerServices.ack_sequence(first, sender, 3) == (0, False)
+        assert await ConsumerServices.ack_sequence(first, sender, 2) == (2, True)
+        assert await ConsumerServices.ack_sequence(first, sender, 1) == (2, False)
+
+    async def test_inbox_is_capped(self, settings, layout, lua_redis):
+        settings.CHAT_INBOX = {**settings.CHAT_INBOX, "MAXLEN": 2}
+        _, device = await connect("bob.linq")
+
+        for n in range(3):
+            await ConsumerServices.store_message(alias="bob.linq", data={"n": n}, device=device)
+
+        entries: list = await ConsumerServices.read_inbox(device=device, count=10)
+
+        # MAXLEN is approximate, older entries may be kept but never newer ones dropped
+        assert entries[-1][1] == {"n": 2}
+        assert await ConsumerServices.ack_inbox(device=device, cursor=entries[-1][0]) == len(
+            entries
+        )
+
+    async def test_full_group_refuses_joins(self, settings, layout, lua_redis):
+        settings.CHAT_GROUP = {"MAX_MEMBERS": 1}
+        _, first = await connect()
+        _, second = await connect()
+
+        join = ConsumerServices.join_group
+
+        assert await join(device=first, device_groups=f"{first}:groups", group="friends") == 1
+        assert await join(device=first, device_groups=f"{first}:groups", group="friends") == 0
+        assert await join(device=second, device_groups=f"{second}:groups", group="friends") == -1
+
+        await ConsumerServices.leave_group(
+            device=first, device_groups=f"{first}:groups", group="friends"
+        )
+
+        assert await join(device=second, device_groups=f"{second}:groups", group="friends") == 1
+
+    async def test_full_group_makes_room_for_members_whose_device_expired(
+        self, settings, layout, lua_redis
+    ):
+        settings.CHAT_GROUP = {"MAX_MEMBERS": 1}
+        _, first = await connect()
+        _, second = await connect()
+
+        join = ConsumerServices.join_group
+
+        assert await join(device=first, device_groups=f"{first}:groups", group="friends") == 1
+
+        await lua_redis.delete(first)
+
+        assert await join(device=second, device_groups=f"{second}:groups", group="friends") == 1
+
+
+async def test_rate_limit_takes_from_every_bucket(settings, layout, lua_redis):
+    settings.RATE_LIMITS = {"chat.message": {"CAPACITY": 2, "RATE": 1}}
+    limiter = RateLimiter()
+    identities: list[str] = [f"device:{uuid.uuid4()}", "ip:127.0.0.1"]
+
+    assert await limiter.hit("chat.message", identities) == 0
+    assert await limiter.hit("chat.message", identities) == 0
+    assert await limiter.hit("chat.message", identities) > 0
+    assert limiter.stats["limited"] == {"chat.message": 1}
+
+
+async def test_scripts_run_by_sha(layout, lua_redis):
+    reloads: int = scripts.reloads
+    did, device = await connect("bob.linq")
+
+    assert (await ConsumerServices.get_device_route(device=device)) == {
+        "device": device,
+        "did": did,
+        "channel": "channel.1",
+        "alias": "bob.linq",
+    }
+    assert time.time() < float(await lua_redis.hget(device, "ttl"))
+    # no script was missing from redis, i.e none fell back to EVAL
+    assert scripts.reloads == reloads
@@ -0,0 +1,58 @@
+import uuid
+
+import pytest
+from channels.testing import WebsocketCommunicator
+
+from chat.events import DEVICE_EVENT_TYPES
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def rate_limits(settings):
+    settings.RATE_LIMITS = {"device.setup": {"CAPACITY": 2, "RATE": 0.01}}
+
+
+async def connect(connect_device, ip: str) -> WebsocketCommunicator:
+    communicator, _ = await connect_device(str(uuid.uuid4()), path="/ws/connect/", client=ip)
+
+    return communicator
+
+
+async def test_frames_over_the_device_limit_are_refused(rate_limits, connect_device):
+    communicator = await connect(connect_device, "10.0.0.1")
+
+    for _ in range(2):
+        await communicator.send_to(text_data='{"name": "testuser_001"}')
+        response = await communicator.receive_json_from()
+
+        assert response["message"] == "Missing key 'alias'"
+
+    await communicator.send_to(text_data='{"name": "testuser_001"}')
+    response = await communicator.receive_json_from()
+
+    assert response["event"] == DEVICE_EVENT_TYPES.DEVICE_SETUP.value
+    assert response["status"] is False
+    assert response["data"]["error"] == "rate_limited"
+    assert 0 < response["data"]["retry_after"] <= 101
+
+    await communicator.disconnect()
+
+
+async def test_devices_sharing_a_client_ip_share_its_limit(rate_limits, connect_device):
+    first = await connect(connect_device, "10.0.0.2")
+    second = await connect(connect_device, "10.0.0.2")
+    other = await connect(connect_device, "10.0.0.3")
+
+    for communicator in [first, second, other]:
+        await communicator.send_to(text_data='{"name": "testuser_001"}')
+        await communicator.receive_json_from()
+
+    await second.send_to(text_data='{"name": "testuser_001"}')
+    await other.send_to(text_data='{"name": "testuser_001"}')
+
+    assert (await second.receive_json_from())["data"]["error"] == "rate_limited"
+    assert (await other.receive_json_from())["message"] == "Missing key 'alias'"
+
+    for communicator in [first, second, other]:
+        await communicator.disconnect()
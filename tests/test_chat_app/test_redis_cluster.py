@@ -0,0 +1,186 @@
+import contextlib
+import time
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from redis.crc import key_slot
+
+from chat.lua_scripts import ClusterLuaScripts, get_lua_scripts, scripts
+from src.utils import alias_key, device_key
+
+
+@pytest.fixture
+def cluster_settings(settings):
+    settings.REDIS_CLUSTER = True
+    settings.REDIS_KEY_LAYOUT = "keys"
+
+    return settings
+
+
+@pytest.fixture
+def single_slot_calls():
+    """
+    Replace the single-slot scripts of ClusterLuaScripts with stand-ins that
+    record their calls, and return what is set in 'results' for each script.
+    """
+    calls: list[tuple[str, list, list]] = []
+    results: dict = {
+        "connect": ["did", "did", "channel", "channel", "alias", "taken.linq", "groups", []],
+        "alias_state": [None, 1800000],
+        "offline_owner": None,
+        "claim_alias": 1,
+        "set_alias": 1,
+        "forget_alias": 1,
+        "release_alias": 1,
+        "resume": [1, "taken.linq", 0, []],
+    }
+
+    def stand_in(name: str):
+        async def script(keys: list, args: list | None = None, client=None):
+            calls.append((name, keys, args))
+            return results[name]
+
+        return script
+
+    with contextlib.ExitStack() as stack:
+        for name in results:
+            stack.enter_context(scripts.stand_in(name, stand_in(name)))
+
+        yield calls, results
+
+
+class TestRedisCluster:
+    def test_keys_are_hash_tagged_in_cluster_mode(self, cluster_settings):
+        assert device_key("001") == "device:{001}"
+        assert alias_key("testalias.linq") == "alias:{testalias.linq}"
+
+        # a device hash & it's groups set share a slot
+        assert key_slot(b"device:{001}") == key_slot(b"device:{001}:groups")
+
+    def test_keys_are_not_hash_tagged_by_default(self):
+        assert device_key("001") == "device:001"
+        assert alias_key("testalias.linq") == "alias:testalias.linq"
+
+    def test_get_lua_scripts_returns_cluster_scripts(self, cluster_settings):
+        assert get_lua_scripts() is ClusterLuaScripts
+
+    @pytest.mark.asyncio
+    async def test_reserve_alias_only_touches_single_slot_keys(
+        self, cluster_settings, single_slot_calls
+    ):
+        calls, results = single_slot_calls
+        results["alias_state"] = ["old.linq", 1800000]
+
+        reserved = await ClusterLuaScripts.reserve_alias(
+            keys=["device:{001}"], args=["new.linq", time.time() + 1800, int(time.time()) + 1800]
+        )
+
+        assert reserved == 1
+        assert [name for name, _, _ in calls] == [
+            "alias_state",
+            "offline_owner",
+            "claim_alias",
+            "set_alias",
+            "release_alias",
+        ]
+        assert calls[2][1] == ["alias:{new.linq}", "alias:{new.linq}:offline"]
+        assert calls[4][1] == ["alias:{old.linq}", "alias:{old.linq}:offline"]
+
+        for _, keys, _ in calls:
+            assert len({key_slot(key.encode()) for key in keys}) == 1
+
+    @pytest.mark.asyncio
+    async def test_reserve_alias_taken_by_another_device(self, cluster_settings, single_slot_calls):
+        calls, results = single_slot_calls
+        results["claim_alias"] = -1
+
+        reserved = await ClusterLuaScripts.reserve_alias(
+            keys=["device:{001}"], args=["taken.linq", time.time() + 1800, int(time.time()) + 1800]
+        )
+
+        assert reserved == -1
+        assert "set_alias" not in [name for name, _, _ in calls]
+
+    @pytest.mark.asyncio
+    async def test_reserve_alias_taken_by_an_offline_device(
+        self, cluster_settings, single_slot_calls
+    ):
+        calls, results = single_slot_calls
+        results["offline_owner"] = "device:{002}"
+
+        async def alias_state(keys: list, args: list | None = None, client=None):
+            calls.append(("alias_state", keys, args))
+            return ["taken.linq" if keys == ["device:{002}"] else "old.linq", 1800000]
+
+        with scripts.stand_in("alias_state", alias_state):
+            reserved = await ClusterLuaScripts.reserve_alias(
+                keys=["device:{001}"],
+                args=["taken.linq", time.time() + 1800, int(time.time()) + 1800],
+            )
+
+        assert reserved == -1
+        assert calls[-1] == ("alias_state", ["device:{002}"], [])
+        assert "claim_alias" not in [name for name, _, _ in calls]
+
+    @pytest.mark.asyncio
+    async def test_connect_device_forgets_alias_claimed_while_offline(
+        self, cluster_settings, single_slot_calls
+    ):
+        calls, results = single_slot_calls
+        results["claim_alias"] = -1
+
+        device_data = await ClusterLuaScripts.connect_device(
+            keys=["device:{001}"], args=["001", "channel", 1800000000.0, 1800000000]
+        )
+
+        assert "alias" not in device_data
+        assert calls[0][1] == ["device:{001}", "device:{001}:groups", "device:{001}:inbox"]
+        assert calls[-1] == ("forget_alias", ["device:{001}"], ["taken.linq"])
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("claimed, resumed", [(1, 1), (-1, 0)])
+    async def test_resume_device_claims_alias_in_its_own_slot(
+        self, claimed, resumed, cluster_settings, single_slot_calls
+    ):
+        calls, results = single_slot_calls
+        results["claim_alias"] = claimed
+
+        result = await ClusterLuaScripts.resume_device(
+            keys=["device:{001}"],
+            args=["001", "channel", time.time() + 1800, int(time.time()) + 1800, 0, 120],
+        )
+
+        assert result[0] == resumed
+        assert calls[0][1] == ["device:{001}", "device:{001}:groups", "device:{001}:inbox"]
+        assert calls[1][1] == ["alias:{taken.linq}", "alias:{taken.linq}:offline"]
+        assert (calls[-1][0] == "forget_alias") is (claimed == -1)
+
+    @pytest.mark.asyncio
+    async def test_rate_limit_takes_from_each_bucket_in_its_own_slot(self, cluster_settings):
+        calls: list[list] = []
+
+        async def rate_limit(keys: list, args: list, client=None):
+            calls.append(keys)
+            return [0, 1500] if "ip" in keys[0] else [1, 0]
+
+        with scripts.stand_in("rate_limit", rate_limit):
+            result = await ClusterLuaScripts.rate_limit(
+                keys=[
+                    "ratelimit:chat.message:{device:001}",
+                    "ratelimit:chat.message:{ip:10.0.0.1}",
+                ],
+                args=[30, 5, 1800000000000, 1],
+            )
+
+        assert result == [0, 1500]
+        assert calls == [
+            ["ratelimit:chat.message:{device:001}"],
+            ["ratelimit:chat.message:{ip:10.0.0.1}"],
+        ]
+
+    def test_migrate_alias_layout_is_refused_in_cluster_mode(self, cluster_settings):
+        err = StringIO()
+        call_command("migrate_alias_layout", stderr=err)
+
+        assert "nothing to migrate" in err.getvalue()
@@ -0,0 +1,139 @@
+import time
+
+import pytest
+
+from chat.lua_scripts import scripts
+from chat.services.consumer_services import ConsumerServices
+from chat.services.route_cache import RouteCache, route_cache
+from tests.mocks import MockLuaScript, MockRedisClient
+
+
+@pytest.fixture
+def cache():
+    cache = RouteCache(maxsize=3, ttl=30)
+    cache.listening = True
+
+    return cache
+
+
+@pytest.fixture
+def listening_route_cache():
+    route_cache.clear()
+    route_cache.listening = True
+    route_cache.hits = route_cache.misses = 0
+
+    yield route_cache
+
+    route_cache.listening = False
+    route_cache.clear()
+
+
+def route(device: str, alias: str = "testalias.linq") -> dict:
+    return {"device": device, "did": "did", "channel": "channel", "alias": alias}
+
+
+class TestRouteCache:
+    def test_get_returns_cached_route_and_counts_hits_and_misses(self, cache):
+        cache.set("testalias.linq", route("device:001"))
+
+        assert cache.get("testalias.linq") == route("device:001")
+        assert cache.get("unknown.linq") is None
+        assert cache.stats == {"hits": 1, "misses": 1, "size": 1, "maxsize": 3}
+
+    def test_nothing_is_cached_or_served_when_not_listening(self, cache):
+        cache.set("testalias.linq", route("device:001"))
+        cache.listening = False
+
+        assert cache.get("testalias.linq") is None
+
+        cache.set("other.linq", route("device:002"))
+
+        assert len(cache) == 1
+
+    def test_least_recently_used_entry_is_evicted_when_full(self, cache):
+        cache.set("one.linq", route("device:001"))
+        cache.set("two.linq", route("device:002"))
+        cache.set("three.linq", route("device:003"))
+
+        # use the oldest entry, so the second one becomes the least recently used
+        cache.get("one.linq")
+        cache.set("four.linq", route("device:004"))
+
+        assert len(cache) == 3
+        assert cache.get("two.linq") is None
+        assert cache.get("one.linq") is not None
+
+    def test_expired_entry_is_not_served(self, cache, monkeypatch):
+        cache.set("testalias.linq", route("device:001"))
+
+        monkeypatch.setattr(time, "monotonic", lambda: float("inf"))
+
+        assert cache.get("testalias.linq") is None
+        assert len(cache) == 0
+
+    def test_invalidate_drops_every_entry_of_device(self, cache):
+        cache.set("testalias.linq", route("device:001"))
+        cache.set("device:001", route("device:001"))
+        cache.set("other.linq", route("device:002"))
+
+        assert cache.invalidate("device:001") == 2
+        assert cache.get("testalias.linq") is None
+        assert cache.get("device:001") is None
+        assert cache.get("other.linq") is not None
+
+    def test_route_read_before_an_invalidation_is_not_cached(self, cache):
+        generation = cache.generation
+        cache.invalidate("device:001")
+        cache.set("testalias.linq", route("device:001"), generation)
+
+        assert len(cache) == 0
+
+
+class TestConsumerServicesRouteCache:
+    @pytest.mark.asyncio
+    async def test_get_chat_route_is_served_from_cache(
+        self, listening_route_cache, mock_luascript_get_chat_route
+    ):
+        first = await ConsumerServices.get_chat_route(alias="testalias_002.linq")
+
+        async def not_called(*args, **kwargs):
+            raise AssertionError("route should be served from the cache")
+
+        with scripts.stand_in("get_chat_route", not_called):
+            second = await ConsumerServices.get_chat_route(alias="testalias_002.linq")
+
+        assert first == second
+        assert listening_route_cache.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_get_chat_route_does_not_cache_unknown_alias(
+        self, listening_route_cache, mock_luascript_get_chat_route
+    ):
+        await ConsumerServices.get_chat_route(alias="unknown.linq")
+
+        assert listening_route_cache.get("unknown.linq") is None
+
+    @pytest.mark.asyncio
+    async def test_get_chat_routes_only_resolves_aliases_missing_from_cache(
+        self, listening_route_cache, mock_luascript_get_chat_routes
+    ):
+        MockRedisClient.redis_store["device:002"] = {"did": "002", "channel": "channel-002"}
+        MockRedisClient.redis_store["alias:device"]["testalias_002.linq"] = "device:002"
+        listening_route_cache.set("cached.linq", route("device:001", alias="cached.linq"))
+
+        resolved: list[list] = []
+
+        async def get_chat_routes(args: list, keys: list | None = None, client=None) -> list:
+            resolved.append(args)
+            return await MockLuaScript.get_chat_routes(args=args)
+
+        with scripts.stand_in("get_chat_routes", get_chat_routes):
+            routes = await ConsumerServices.get_chat_routes(
+                aliases=["testalias_002.linq", "cached.linq", "unknown.linq"]
+            )
+
+        assert resolved == [["testalias_002.linq", "unknown.linq"]]
+        assert list(routes) == ["testalias_002.linq", "cached.linq", "unknown.linq"]
+        assert routes["testalias_002.linq"]["channel"] == "channel-002"
+        assert routes["unknown.linq"]["device"] is None
+        assert listening_route_cache.get("testalias_002.linq") is not None
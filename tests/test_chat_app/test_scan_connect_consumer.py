@@ -11,13 +11,14 @@ from chat.consumers.scan_consumer import ScanConnectConsumer
 from chat.events import SCAN_EVENT_TYPES
 from tests.mocks import MockRedisClient
 
-pytestmark = pytest.mark.asyncio
+pytestmark = [pytest.mark.asyncio, pytest.mark.usefixtures("mock_luascript_rate_limit")]
 
 
 class TestConsumerConnect:
     async def test_drop_connection_if_scanned_device_has_no_channel(
         self,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hdel,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -49,6 +50,7 @@ class TestConsumerConnect:
     async def test_drop_connection_if_scanned_device_has_channel_and_alias(
         self,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hdel,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -83,6 +85,7 @@ class TestConsumerConnect:
     async def test_keep_connection_if_scanned_device_has_channel_but_no_alias(
         self,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hdel,
         mock_luascript_get_device_data,
     ):
@@ -120,10 +123,10 @@ class TestConsumerReceive:
     async def test_received_messages_must_be_in_json_format(
         self,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hset,
         mock_redis_hdel,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
         mock_luascript_get_device_data,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -164,10 +167,10 @@ class TestConsumerReceive:
     async def test_received_messages_must_have_key_alias_in_received_json_data(
         self,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hset,
         mock_redis_hdel,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
         mock_luascript_get_device_data,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -219,10 +222,10 @@ class TestConsumerReceive:
         test_message,
         test_status,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hset,
         mock_redis_hdel,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
         mock_luascript_get_device_data,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -276,10 +279,11 @@ class TestConsumerReceive:
         test_status,
         mock_redis_hset,
         mock_redis_hget,
+        mock_luascript_get_device_route,
         mock_redis_hdel,
-        mock_redis_hvals,
+        mock_luascript_reserve_alias,
+        mock_redis_publish,
         mock_redis_expireat,
-        mock_luascript_set_alias_device,
         mock_luascript_get_device_data,
     ):
         did: uuid.UUID = uuid.uuid4()
@@ -0,0 +1,196 @@
+import asyncio
+import time
+
+import msgpack
+import pytest
+import pytest_asyncio
+from channels.layers import get_channel_layer
+from redis import exceptions as redis_exceptions
+
+from src.layers import PubSubChannelLayer
+from tests.mocks import MockPubSubRedisClient
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """Every PubSubChannelLayer, i.e worker, shares an in-memory redis."""
+    client = MockPubSubRedisClient()
+    monkeypatch.setattr(PubSubChannelLayer, "create_clients", lambda self: (client, client))
+
+    return client
+
+
+@pytest_asyncio.fixture
+async def workers(redis_server):
+    layers = [PubSubChannelLayer(prefix="test", capacity=2) for _ in range(3)]
+
+    yield layers
+
+    for layer in layers:
+        await layer.close()
+
+
+async def test_channels_embed_their_worker(workers):
+    channel = await workers[0].new_channel()
+
+    assert channel.startswith(f"test.{workers[0].worker}!")
+    assert workers[0].worker_of(channel) == workers[0].worker
+
+
+async def test_send_is_published_to_the_inbox_of_the_receiving_worker(redis_server, workers):
+    sender, receiver = workers[:2]
+    channel = await receiver.new_channel()
+
+    await sender.send(channel, {"type": "chat.message", "data": {"n": 1}})
+
+    assert await receiver.receive(channel) == {"type": "chat.message", "data": {"n": 1}}
+    assert redis_server.published == 1
+    assert receiver.stats["delivered"] == 1
+
+
+async def test_send_to_a_channel_of_the_same_worker_skips_redis(redis_server, workers):
+    channel = await workers[0].new_channel()
+    message = {"type": "chat.message", "data": {"n": 1}}
+
+    await workers[0].send(channel, message)
+    received = await workers[0].receive(channel)
+
+    assert received == message
+    assert received is not message
+    assert redis_server.published == 0
+
+
+async def test_send_many_publishes_in_a_single_pipeline(redis_server, workers):
+    first, second, third = workers
+    channels = [await first.new_channel(), await second.new_channel(), await third.new_channel()]
+
+    await first.send_many(
+        [(channel, {"type": "chat.message", "n": n}) for n, channel in enumerate(channels)]
+    )
+
+    assert await first.receive(channels[0]) == {"type": "chat.message", "n": 0}
+    assert await second.receive(channels[1]) == {"type": "chat.message", "n": 1}
+    assert await third.receive(channels[2]) == {"type": "chat.message", "n": 2}
+    assert redis_server.executed == 1
+    assert redis_server.published == 2
+    assert first.stats["published"] == 2
+
+
+async def test_group_send_publishes_once_per_worker(redis_server, workers):
+    first, second, third = workers
+    channels = [await first.new_channel() for _ in range(3)] + [await second.new_channel()]
+
+    for channel in channels:
+        await third.group_add("group", channel)
+
+    await third.group_send("group", {"type": "chat.message"})
+
+    for channel in channels:
+        layer = first if first.worker in channel else second
+        assert await layer.receive(channel) == {"type": "chat.message"}
+
+    assert redis_server.published == 2
+
+
+async def test_group_discard_and_expiry(redis_server, workers):
+    layer = workers[0]
+    kept, discarded, expired = [await layer.new_channel() for _ in range(3)]
+
+    for channel in (kept, discarded, expired):
+        await layer.group_add("group", channel)
+
+    await layer.group_discard("group", discarded)
+    redis_server.sorted_sets["test:group:group"][expired] = time.time() - layer.group_expiry - 1
+
+    await layer.group_send("group", {"type": "chat.message"})
+
+    assert layer.channels[kept].qsize() == 1
+    assert layer.channels[discarded].empty()
+    assert layer.channels[expired].empty()
+
+
+async def test_events_to_full_or_gone_channels_are_dropped(workers):
+    layer = workers[0]
+    channel = await layer.new_channel()
+
+    for n in range(3):
+        await layer.send(channel, {"type": "chat.message", "n": n})
+
+    assert layer.stats["dropped"] == 1
+    assert [(await layer.receive(channel))["n"] for _ in range(2)] == [0, 1]
+
+    receive = asyncio.create_task(layer.receive(channel))
+    await asyncio.sleep(0)
+    receive.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await receive
+
+    # the consumer exited, it's channel is forgotten
+    await layer.send(channel, {"type": "chat.message"})
+
+    assert channel not in layer.channels
+    assert layer.stats["dropped"] == 2
+
+
+async def test_bad_inbox_messages_are_dropped_and_the_worker_keeps_receiving(redis_server, workers):
+    layer = workers[0]
+    channel = await layer.new_channel()
+
+    await redis_server.publish(layer.inbox, b"not msgpack")
+    await redis_server.publish(layer.inbox, msgpack.packb({"message": {}}))
+    await workers[1].send(channel, {"type": "chat.message", "n": 1})
+
+    assert await layer.receive(channel) == {"type": "chat.message", "n": 1}
+    assert layer.stats["dropped"] == 2
+    assert not layer._listener.done()
+
+
+async def test_new_channel_fails_when_redis_is_down(monkeypatch):
+    async def listen(self):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(PubSubChannelLayer, "create_clients", lambda self: (None, None))
+    monkeypatch.setattr(PubSubChannelLayer, "listen", listen)
+    layer = PubSubChannelLayer(prefix="test", subscribe_timeout=0.01)
+
+    with pytest.raises(redis_exceptions.ConnectionError):
+        await layer.new_channel()
+
+    layer._listener.cancel()
+
+
+async def test_only_channels_of_the_layer_can_be_sent_to(workers):
+    with pytest.raises(ValueError):
+        await workers[0].send("specific.channel", {"type": "chat.message"})
+
+
+async def test_flush_deletes_every_group(redis_server, workers):
+    layer = workers[0]
+    await layer.group_add("group", await layer.new_channel())
+
+    await layer.flush()
+
+    assert redis_server.sorted_sets == {}
+
+
+async def test_layer_is_a_drop_in_channel_layer_setting(settings, redis_server, connect_echo):
+    settings.CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "src.layers.PubSubChannelLayer",
+            "CONFIG": {"hosts": [("localhost", 6379)]},
+        },
+    }
+    channel_layer = get_channel_layer()
+
+    communicator, channel = await connect_echo()
+
+    await channel_layer.group_add("group", channel)
+    await channel_layer.group_send("group", {"type": "chat.message", "data": {"n": 1}})
+
+    assert await communicator.receive_json_from() == {"n": 1}
+
+    await communicator.disconnect()
+    await channel_layer.close()
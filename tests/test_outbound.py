@@ -0,0 +1,126 @@
+import pytest
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from src.outbound import outbound_metrics
+from src.wire import Envelope
+from tests.mocks import EchoConsumer
+
+pytestmark = pytest.mark.asyncio
+
+
+class AckingConsumer(EchoConsumer):
+    """Consumer whose events are acknowledged by the client, with {"did", "seq"} frames."""
+
+    async def receive_envelope(self, envelope: Envelope):
+        self.acknowledge(envelope["did"], envelope["seq"])
+
+    def awaited_ack(self, content: dict) -> tuple[str, int] | None:
+        return content["did"], content["seq"]
+
+
+@pytest.fixture
+def slow_client(settings):
+    settings.WEBSOCKET_OUTBOUND = {
+        "MAX_UNACKED": 2,
+        "MAX_SIZE": 3,
+        "POLICY": "drop-oldest",
+        "CLOSE_CODE": 4008,
+    }
+    outbound_metrics.reset()
+
+
+async def send_events(channel: str, sequences: range) -> None:
+    for seq in sequences:
+        await get_channel_layer().send(
+            channel, {"type": "chat.message", "data": {"did": "sender", "seq": seq}}
+        )
+
+
+async def receive_events(communicator: WebsocketCommunicator, ack: bool = False) -> list[int]:
+    events: list[int] = []
+
+    while not await communicator.receive_nothing():
+        events.append((await communicator.receive_json_from())["seq"])
+
+        if ack:
+            await communicator.send_json_to({"did": "sender", "seq": events[-1]})
+
+    return events
+
+
+async def test_events_are_held_back_until_acknowledged(slow_client, connect_echo):
+    communicator, channel = await connect_echo(AckingConsumer)
+    await send_events(channel, range(4))
+
+    assert await receive_events(communicator) == [0, 1]
+
+    # acknowledging the first event lets one more through
+    await communicator.send_json_to({"did": "sender", "seq": 0})
+
+    assert await receive_events(communicator) == [2]
+
+    await communicator.send_json_to({"did": "sender", "seq": 2})
+
+    assert await receive_events(communicator, ack=True) == [3]
+    assert outbound_metrics.stats["policies"] == {}
+
+    await communicator.disconnect()
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        # the client got events 0 & 1, while the queue keeps the 3 latest events
+        ("drop-oldest", [4, 5, 6]),
+        ("drop-newest", [2, 3, 4]),
+    ],
+)
+async def test_full_outbound_queue_drops_events_by_policy(
+    settings, slow_client, connect_echo, policy, expected
+):
+    settings.WEBSOCKET_OUTBOUND["POLICY"] = policy
+    communicator, channel = await connect_echo(AckingConsumer)
+    await send_events(channel, range(2))
+
+    # the client stops reading, without acknowledging what it got
+    assert await receive_events(communicator) == [0, 1]
+
+    await send_events(channel, range(2, 7))
+
+    assert await communicator.receive_nothing()
+    assert outbound_metrics.stats["policies"] == {policy: 2}
+    assert outbound_metrics.stats["max_queue_depth"] == 3
+
+    await communicator.send_json_to({"did": "sender", "seq": 1})
+
+    assert await receive_events(communicator, ack=True) == expected
+
+    await communicator.disconnect()
+
+
+async def test_full_outbound_queue_closes_slow_client(settings, slow_client, connect_echo):
+    settings.WEBSOCKET_OUTBOUND["POLICY"] = "close"
+    communicator, channel = await connect_echo(AckingConsumer)
+    await send_events(channel, range(2))
+
+    assert await receive_events(communicator) == [0, 1]
+
+    await send_events(channel, range(2, 6))
+
+    assert await communicator.receive_output() == {"type": "websocket.close", "code": 4008}
+    assert outbound_metrics.stats["policies"] == {"close": 1}
+
+    await communicator.disconnect()
+
+
+async def test_acknowledgements_are_not_awaited_without_max_unacked(
+    settings, slow_client, connect_echo
+):
+    settings.WEBSOCKET_OUTBOUND["MAX_UNACKED"] = None
+    communicator, channel = await connect_echo(AckingConsumer)
+    await send_events(channel, range(5))
+
+    assert await receive_events(communicator) == [0, 1, 2, 3, 4]
+
+    await communicator.disconnect()
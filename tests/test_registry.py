@@ -0,0 +1,51 @@
+import pytest
+from channels.layers import get_channel_layer
+
+from src.registry import local_consumers
+from src.utils import send, send_many
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def registry_stats():
+    local, remote = local_consumers.local, local_consumers.remote
+
+    def stats() -> tuple[int, int]:
+        return local_consumers.local - local, local_consumers.remote - remote
+
+    return stats
+
+
+async def test_events_to_local_consumers_skip_the_channel_layer(registry_stats, connect_echo):
+    communicator, channel = await connect_echo()
+
+    assert channel in local_consumers.consumers
+
+    await send(get_channel_layer(), channel, {"type": "chat.message", "data": {"n": 1}})
+
+    assert await communicator.receive_json_from() == {"n": 1}
+    assert registry_stats() == (1, 0)
+
+    await communicator.disconnect()
+
+    assert channel not in local_consumers.consumers
+
+
+async def test_events_to_other_workers_go_through_the_channel_layer(registry_stats, connect_echo):
+    communicator, channel = await connect_echo()
+    channel_layer = get_channel_layer()
+
+    await send_many(
+        channel_layer,
+        [
+            (channel, {"type": "chat.message", "data": {"n": 1}}),
+            ("remote-channel", {"type": "chat.message", "data": {"n": 2}}),
+        ],
+    )
+
+    assert await communicator.receive_json_from() == {"n": 1}
+    assert (await channel_layer.receive("remote-channel"))["data"] == {"n": 2}
+    assert registry_stats() == (1, 1)
+
+    await communicator.disconnect()
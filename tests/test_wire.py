@@ -0,0 +1,95 @@
+import msgpack
+import pytest
+
+from src.wire import (
+    CBORCodec,
+    DecodeError,
+    Envelope,
+    JSONCodec,
+    MessagePackCodec,
+    get_codec,
+    get_codecs,
+)
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("json", JSONCodec),
+        ("msgpack", MessagePackCodec),
+        ("MsgPack", MessagePackCodec),
+        ("unknown", JSONCodec),
+        (None, JSONCodec),
+    ],
+)
+def test_get_codec_falls_back_to_json(name, expected):
+    assert get_codec(name) is expected
+
+
+@pytest.mark.parametrize("codec", get_codecs().values())
+def test_codecs_round_trip_frames(codec):
+    content = {"event": "chat.message", "status": True, "data": {"to": ["one.linq"], "seq": 1}}
+    frame = codec.encode(content)
+
+    assert isinstance(frame, bytes if codec.binary else str)
+    assert codec.decode(frame) == content
+
+
+@pytest.mark.parametrize(
+    "codec, frame",
+    [
+        (JSONCodec, "testuser_001"),
+        (JSONCodec, None),
+        (MessagePackCodec, b"\xc1"),
+        (MessagePackCodec, msgpack.packb({"alias": "one"})[:-2]),
+        (MessagePackCodec, "not bytes"),
+        (CBORCodec, b"\x1c"),
+        (CBORCodec, CBORCodec.encode({"alias": "one"})[:-2]),
+    ],
+)
+def test_codecs_raise_decode_error_on_invalid_frames(codec, frame):
+    with pytest.raises(DecodeError):
+        codec.decode(frame)
+
+
+class PluggedJSONCodec(JSONCodec):
+    """A project codec, plugged in from settings.WIRE_CODECS."""
+
+
+@pytest.fixture
+def codecs_cache():
+    get_codecs.cache_clear()
+    yield
+    get_codecs.cache_clear()
+
+
+def test_unavailable_codecs_are_not_negotiable(monkeypatch, codecs_cache):
+    monkeypatch.setattr(CBORCodec, "available", False)
+
+    assert "cbor" not in get_codecs()
+    assert get_codec("cbor") is JSONCodec
+
+
+def test_codecs_are_pluggable_from_settings(settings, codecs_cache):
+    settings.WIRE_CODECS = ["tests.test_wire.PluggedJSONCodec"]
+
+    assert get_codec("json") is PluggedJSONCodec
+    assert get_codec("msgpack") is PluggedJSONCodec
+
+
+@pytest.mark.parametrize("content", [["to", "message"], "testuser_001", 1, None])
+def test_envelope_must_be_an_object(content):
+    with pytest.raises(DecodeError):
+        Envelope(content)
+
+
+def test_envelope_event_and_required_keys():
+    envelope = Envelope({"event": ["chat.ack"], "to": "one.linq"})
+
+    assert envelope.event is None
+    assert Envelope({"event": "chat.ack"}).event == "chat.ack"
+
+    envelope.require("to")
+
+    with pytest.raises(KeyError, match="message"):
+        envelope.require("to", "message")